@@ -0,0 +1,551 @@
+import asyncio
+import time
+
+from metrics import CommandTracker, metrics
+from protocol import *
+from slot_map import SlotMap
+from wire_trace import TRACE_ERRORS, WireTracer
+
+# Cliente asyncio para o protocolo <...> do sketch.
+#
+# Uma tarefa de leitura transforma os bytes da serial em quadros (FrameParser) e os
+# coloca numa fila; os métodos (init_sensor, enroll, identify, count, download_template_b1,
+# download_slots/upload_slots para transferências em lote) mandam os comandos e consomem a
+# fila, sem bloquear o event loop. Assim um processo
+# atende várias portas e uma API web ao mesmo tempo, sem uma thread por porta.
+#
+# A porta é aberta com pyserial-asyncio (pip install pyserial-asyncio); connect() também
+# inicializa o sensor. Para testes, qualquer par (StreamReader, StreamWriter) serve
+# (ver AsyncFingerprintClient(reader, writer)).
+
+DEFAULT_RESPONSE_TIMEOUT = 15 # Mesmo RESPONSE_TIMEOUT do main.py
+SENSOR_INIT_TIMEOUT = 10
+WARM_START_TIMEOUT = 3.0 # Mesmo WARM_START_TIMEOUT do main.py
+WARM_PROBE_INTERVAL = 0.25 # Mesmo WARM_PROBE_INTERVAL do main.py
+SKETCH_COMMAND_TIMEOUT = 10 # O sketch desiste de esperar o próximo subcomando depois de 10 s
+AUTO_EVENT_TIMEOUT = 20 # Mesmo AUTO_EVENT_TIMEOUT do main.py
+WIRE_TRACE_DUMP_BYTES = 4096 # Mesmo WIRE_TRACE_DUMP_BYTES do main.py
+DEFAULT_SENSOR_CAPACITY = 127 # Mesmo DEFAULT_SENSOR_CAPACITY do main.py
+_RAW_BLOCK_PREFIX = f"{RESP_PREFIX}{RESP_TEMPLATE_BIN}:"
+
+
+class SensorError(Exception):
+    # Resposta de erro (ou inesperada) do Arduino; response é o conteúdo sem RESP:
+    def __init__(self, response, context=""):
+        super().__init__(f"{context}: {response}" if context else response)
+        self.response = response
+
+
+class AsyncFingerprintClient:
+
+    def __init__(self, reader, writer, name=None, trace_level=TRACE_ERRORS):
+        self.name = name
+        self.tracer = WireTracer(name or 'serial', level=trace_level) # Ver wire_trace.py
+        self.capacity = None
+        self._reader = reader
+        self._writer = writer
+        self._parser = FrameParser()
+        self._frames = asyncio.Queue()
+        self._raw_block = None # (quadro, bytearray, bytes já lidos) de um TEMPLATE_BIN em andamento
+        self._lock = asyncio.Lock() # Um fluxo (ENROLL, IDENTIFY...) por vez no sketch
+        self._needs_resync = False
+        self._tracker = CommandTracker(metrics)
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, port, baudrate=9600, name=None):
+        try:
+            import serial_asyncio
+        except ImportError:
+            raise RuntimeError("AsyncFingerprintClient.open precisa do pacote pyserial-asyncio") from None
+        reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=baudrate)
+        return cls(reader, writer, name=name or port)
+
+    @classmethod
+    async def connect(cls, port, baudrate=9600, name=None):
+        # open() + init_sensor() (que espera o boot da placa); fecha a porta se a inicialização falhar
+        client = await cls.open(port, baudrate, name)
+        try:
+            await client.init_sensor()
+        except BaseException:
+            await client.close()
+            raise
+        return client
+
+    async def close(self):
+        self._reader_task.cancel()
+        try:
+            await self._reader_task
+        except asyncio.CancelledError:
+            pass
+        self._writer.close()
+
+    # --- Transporte ---
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self._reader.read(4096)
+                if not data:
+                    break
+                self._tracker.received(len(data))
+                if self.tracer.level:
+                    self.tracer.rx(data)
+                self._parser.feed(data)
+                self._drain_parser()
+        finally:
+            self._frames.put_nowait(ConnectionError("Conexão serial encerrada"))
+
+    def _drain_parser(self):
+        parser = self._parser
+        while True:
+            if self._raw_block is not None:
+                frame, block, filled = self._raw_block
+                filled += parser.read_raw(memoryview(block)[filled:])
+                if filled < len(block):
+                    self._raw_block = (frame, block, filled)
+                    return
+                self._raw_block = None
+                self._frames.put_nowait((frame[len(RESP_PREFIX):], bytes(block)))
+                self._tracker.frame()
+                continue
+            frame = parser.pop_frame()
+            if frame is None:
+                return
+            if self.tracer.level:
+                self.tracer.frame(frame)
+            if frame.startswith(_RAW_BLOCK_PREFIX) and parser.raw_pending and not parser.frames:
+                self._raw_block = (frame, bytearray(parser.raw_pending), 0)
+                continue
+            if frame.startswith(RESP_PREFIX):
+                frame = frame[len(RESP_PREFIX):]
+            self._frames.put_nowait(frame)
+            self._tracker.frame()
+
+    async def send(self, command_payload):
+        data = f"{START_MARKER}{command_payload}{END_MARKER}\n".encode('utf-8')
+        self._tracker.sent(command_payload, len(data))
+        if self.tracer.level:
+            self.tracer.tx(data)
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def send_raw(self, data):
+        self._tracker.sent_raw(len(data))
+        if self.tracer.level:
+            self.tracer.tx(data)
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def receive(self, timeout=DEFAULT_RESPONSE_TIMEOUT):
+        # Próximo quadro (sem RESP:). Blocos TEMPLATE_BIN chegam como (quadro, bytes).
+        # Mensagens DBG: são descartadas.
+        while True:
+            try:
+                item = await asyncio.wait_for(self._frames.get(), timeout)
+            except asyncio.TimeoutError:
+                self._tracker.timeout()
+                raise
+            if isinstance(item, Exception):
+                self._frames.put_nowait(item) # Mantém o erro para as próximas chamadas
+                raise item
+            if isinstance(item, str) and item.startswith("DBG:"):
+                continue
+            return item
+
+    async def _expect(self, command, expected, timeout=DEFAULT_RESPONSE_TIMEOUT, context=""):
+        if command is not None:
+            await self.send(command)
+        response = await self.receive(timeout)
+        if not isinstance(response, str) or expected not in response:
+            self.tracer.dump(f"esperava {expected}", WIRE_TRACE_DUMP_BYTES)
+            raise SensorError(response, context or expected)
+        return response
+
+    def _discard_stale_frames(self):
+        while not self._frames.empty():
+            item = self._frames.get_nowait()
+            if isinstance(item, Exception):
+                self._frames.put_nowait(item)
+                return
+
+    async def _resync(self):
+        # Um fluxo cancelado pode deixar o sketch ocupado (busca em andamento) ou em
+        # waitForPythonCommand, que ignora outros comandos. Manda PING até receber o PONG
+        # (no pior caso depois do FAIL:TIMEOUT_WAITING_FOR_CMD do sketch).
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SKETCH_COMMAND_TIMEOUT + 1
+        attempt = 0
+        while loop.time() < deadline:
+            attempt += 1
+            if attempt > 1:
+                self._tracker.retry(CMD_PING)
+            token = f"R{attempt}"
+            await self.send(f"{CMD_PING},{token}")
+            try:
+                while True:
+                    response = await self.receive(1)
+                    if isinstance(response, str) and parse_pong(response, token) is not None:
+                        self._needs_resync = False
+                        self._discard_stale_frames()
+                        return
+            except asyncio.TimeoutError:
+                continue
+        self._needs_resync = False
+
+    async def _run(self, flow, timeout, span=None):
+        # Executa um fluxo com exclusão mútua, timeout total opcional e tratamento de cancelamento.
+        # span: nome do fluxo nas métricas (a espera pelo lock não entra na duração)
+        async with self._lock:
+            start_time = time.perf_counter()
+            if self._needs_resync:
+                await self._resync()
+            self._discard_stale_frames()
+            try:
+                if timeout is None:
+                    return await flow
+                return await asyncio.wait_for(flow, timeout)
+            except asyncio.TimeoutError:
+                self._needs_resync = True
+                self.tracer.dump("timeout", WIRE_TRACE_DUMP_BYTES)
+                raise
+            except asyncio.CancelledError:
+                self._needs_resync = True
+                raise
+            finally:
+                self._tracker.finish()
+                if span is not None:
+                    metrics.record_span(span, time.perf_counter() - start_time)
+
+    # --- Comandos ---
+
+    async def init_sensor(self, timeout=WARM_START_TIMEOUT + SENSOR_INIT_TIMEOUT):
+        return await self._run(self._init_sensor(), timeout, span='init_sensor')
+
+    async def _init_sensor(self):
+        # Abrir a porta reinicia um Uno pelo DTR, e o que chega durante o bootloader se perde.
+        # Como no connect_arduino: PING até o sketch responder, e um ARDUINO_READY_FOR_INIT
+        # depois do INIT_SENSOR (a placa reiniciou no meio) pede o INIT_SENSOR de novo.
+        state = await self._probe_sketch()
+        if state and state.get('INIT') and 'CAP' in state:
+            self.capacity = state['CAP'] # Início a quente: o sensor já está inicializado
+            return self.capacity
+        await self.send(CMD_INIT_SENSOR)
+        while True:
+            response = await self.receive(SENSOR_INIT_TIMEOUT)
+            if not isinstance(response, str):
+                continue
+            if RESP_SENSOR_READY in response:
+                if ",CAP:" in response:
+                    self.capacity = int(response.split(",CAP:")[1])
+                return self.capacity
+            if response == RESP_ARDUINO_READY_FOR_INIT:
+                self._tracker.retry(CMD_INIT_SENSOR)
+                await self.send(CMD_INIT_SENSOR)
+                # Se o primeiro INIT_SENSOR não se perdeu vem um SENSOR_READY a mais: o próximo
+                # fluxo faz o PING/PONG do _resync antes e o descarta
+                self._needs_resync = True
+                continue
+            if response == f"{RESP_SENSOR_ERROR}:NOT_INITIALIZED_YET":
+                continue # Resposta atrasada a um PING do _probe_sketch (sketch antigo)
+            if RESP_SENSOR_ERROR in response or RESP_FAIL in response:
+                raise SensorError(response, "INIT_SENSOR")
+            # PONG atrasado e outros avisos: continua esperando
+
+    async def _probe_sketch(self):
+        # PING até WARM_START_TIMEOUT, como o _probe_arduino do main.py. Retorna o estado do
+        # PONG ({} no sketch antigo) ou None se ninguém respondeu (placa ainda no bootloader).
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WARM_START_TIMEOUT
+        attempt = 0
+        while loop.time() < deadline:
+            attempt += 1
+            if attempt > 1:
+                self._tracker.retry(CMD_PING)
+            token = f"W{attempt}"
+            await self.send(f"{CMD_PING},{token}")
+            probe_deadline = min(loop.time() + WARM_PROBE_INTERVAL, deadline)
+            try:
+                while True:
+                    response = await self.receive(max(probe_deadline - loop.time(), 0))
+                    if response == RESP_ARDUINO_READY_FOR_INIT:
+                        break # O PING pode ter chegado durante o boot e se perdido
+                    if response == f"{RESP_SENSOR_ERROR}:NOT_INITIALIZED_YET":
+                        return {} # Sketch sem PING, esperando o INIT_SENSOR
+                    state = parse_pong(response, token) if isinstance(response, str) else None
+                    if state is not None:
+                        return state
+            except asyncio.TimeoutError:
+                continue
+        return None
+
+    async def count(self, timeout=None):
+        return await self._run(self._count(), timeout)
+
+    async def _count(self):
+        response = await self._expect(CMD_COUNT, RESP_COUNT_RESULT, context="COUNT")
+        return int(response.split(f"{RESP_COUNT_RESULT}:")[1])
+
+    async def identify(self, on_prompt=None, timeout=None):
+        # Retorna (ID, confiança) ou None se a digital não estiver no sensor.
+        # on_prompt(mensagem) é chamado quando o Arduino pede para colocar o dedo.
+        return await self._run(self._identify(on_prompt), timeout, span='identify')
+
+    async def _capture_probe(self, command, on_prompt):
+        await self._expect(command, RESP_ASK_PLACE_FINGER, context="IDENTIFY")
+        await _call_prompt(on_prompt, RESP_ASK_PLACE_FINGER)
+        await self._expect(CMD_GET_IMAGE, f"{RESP_OK}:IMAGE_TAKEN", context="GET_IMAGE")
+        await self._expect(CMD_IMAGE_TO_TZ1, f"{RESP_OK}:CONVERT_DONE", context="IMAGE_TO_TZ1")
+
+    async def _identify(self, on_prompt):
+        await self._capture_probe(CMD_IDENTIFY, on_prompt)
+        response = await self.receive(10) # A busca pode demorar um pouco
+        return parse_identify_response(response)
+
+    async def capture_probe_template(self, on_prompt=None, timeout=None):
+        # IDENTIFY,HOST + DOWNLOAD_TPL_B1: template do dedo atual, para a busca no PC
+        async def flow():
+            await self._capture_probe(f"{CMD_IDENTIFY},{IDENTIFY_MODE_HOST}", on_prompt)
+            return await self._download_template_b1()
+        return await self._run(flow(), timeout, span='capture_probe')
+
+    async def enroll(self, user_id, on_prompt=None, store=True, download=False, timeout=None):
+        # Cadastro completo. Retorna o template (bytes) se download=True, senão None.
+        return await self._run(self._enroll(user_id, on_prompt, store, download), timeout, span='enroll')
+
+    async def _enroll(self, user_id, on_prompt, store, download):
+        await self._expect(f"{CMD_ENROLL},{user_id}", RESP_ASK_PLACE_FINGER, context="ENROLL")
+        await _call_prompt(on_prompt, RESP_ASK_PLACE_FINGER)
+        await self._expect(CMD_GET_IMAGE, f"{RESP_OK}:IMAGE1_TAKEN", context="GET_IMAGE")
+        await self._expect(CMD_IMAGE_TO_TZ1, f"{RESP_OK}:CONVERT1_DONE", context="IMAGE_TO_TZ1")
+        await self._expect(None, RESP_ASK_REMOVE_FINGER, context="ENROLL")
+        await _call_prompt(on_prompt, RESP_ASK_REMOVE_FINGER)
+        await self._expect(CMD_REMOVE_FINGER_ACK, RESP_FINGER_REMOVED, context="REMOVE_FINGER_ACK")
+        await self._expect(None, RESP_ASK_PLACE_AGAIN, context="ENROLL")
+        await _call_prompt(on_prompt, RESP_ASK_PLACE_AGAIN)
+        await self._expect(CMD_GET_IMAGE, f"{RESP_OK}:IMAGE2_TAKEN", context="GET_IMAGE")
+        await self._expect(CMD_IMAGE_TO_TZ2, f"{RESP_OK}:CONVERT2_DONE", context="IMAGE_TO_TZ2")
+        await self._expect(CMD_CREATE_MODEL, f"{RESP_OK}:MODEL_CREATED", context="CREATE_MODEL")
+        template = await self._download_template_b1() if download else None
+        if store:
+            await self._expect(CMD_STORE_MODEL, f"{RESP_OK}:STORED:{user_id}", context="STORE_MODEL")
+        return template
+
+    async def _run_auto(self, command, on_event):
+        # Comandos *_AUTO: repassa os eventos EVT: para on_event e retorna a resposta final
+        await self.send(command)
+        while True:
+            response = await self.receive(AUTO_EVENT_TIMEOUT)
+            if isinstance(response, str) and response.startswith(f"{RESP_EVENT}:"):
+                await _call_prompt(on_event, response[len(RESP_EVENT) + 1:])
+                continue
+            return response
+
+    async def identify_auto(self, on_event=None, timeout=None):
+        # IDENTIFY_AUTO: um comando só; retorna (ID, confiança) ou None
+        async def flow():
+            return parse_identify_response(await self._run_auto(CMD_IDENTIFY_AUTO, on_event))
+        return await self._run(flow(), timeout, span='identify_auto')
+
+    async def enroll_auto(self, user_id, on_event=None, store=True, timeout=None):
+        # ENROLL_AUTO: com store=False o modelo fica pendente (STORE_MODEL depois)
+        async def flow():
+            command = f"{CMD_ENROLL_AUTO},{user_id}"
+            expected = f"{RESP_OK}:STORED:{user_id}"
+            if not store:
+                command += f",{AUTO_MODE_NOSTORE}"
+                expected = f"{RESP_OK}:MODEL_PENDING:{user_id}"
+            response = await self._run_auto(command, on_event)
+            if not isinstance(response, str) or expected not in response:
+                raise SensorError(response, "ENROLL_AUTO")
+        return await self._run(flow(), timeout, span='enroll_auto')
+
+    async def download_template_b1(self, timeout=None):
+        return await self._run(self._download_template_b1(), timeout, span='download_template')
+
+    async def _download_template_b1(self, prefetch=None):
+        # prefetch: próximo comando, mandado assim que o último chunk chega (antes do
+        # TEMPLATE_DOWNLOAD_COMPLETE) ou junto com a falha; o sketch o encontra na fila
+        try:
+            ack = await self._expect(f"{CMD_DOWNLOAD_TEMPLATE_B1},{TPL_MODE_BIN}", "TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED",
+                                     timeout=5, context="DOWNLOAD_TPL_B1")
+            template = bytearray(TEMPLATE_SIZE)
+            received = 0
+            while True:
+                response = await self.receive()
+                if isinstance(response, tuple):
+                    block = response[1]
+                    payload = block[:-TEMPLATE_BIN_CHECKSUM_SIZE]
+                    if sum(payload) & 0xFFFF != int.from_bytes(block[-TEMPLATE_BIN_CHECKSUM_SIZE:], 'big'):
+                        raise SensorError(response[0], f"soma do chunk binário não confere (offset {received})")
+                    chunk = payload
+                elif response.startswith(f"{RESP_TEMPLATE_CHUNK}:"):
+                    chunk = bytes.fromhex(response.split(":", 1)[1])
+                elif RESP_OK in response and "TEMPLATE_DOWNLOAD_COMPLETE" in response:
+                    if received != TEMPLATE_SIZE:
+                        raise SensorError(response, f"template incompleto ({received} bytes)")
+                    return bytes(template)
+                else:
+                    raise SensorError(response, "DOWNLOAD_TPL_B1")
+                if received + len(chunk) > TEMPLATE_SIZE:
+                    raise SensorError(ack, f"template maior que {TEMPLATE_SIZE} bytes")
+                template[received:received + len(chunk)] = chunk
+                received += len(chunk)
+                if received == TEMPLATE_SIZE and prefetch is not None:
+                    await self.send(prefetch)
+                    prefetch = None
+        except SensorError:
+            if prefetch is not None:
+                await self.send(prefetch)
+            raise
+
+    async def occupied_slots(self, timeout=None):
+        # Mapa dos IDs ocupados no flash (tabela <INDEX,PAGINA> do sensor, ver slot_map.py)
+        async def flow():
+            slot_map = SlotMap(self.capacity or DEFAULT_SENSOR_CAPACITY)
+            for page in range(slot_map.pages):
+                prefix = f"{RESP_OK}:INDEX:{page}:"
+                response = await self._expect(f"{CMD_INDEX},{page}", prefix, context="INDEX")
+                try:
+                    slot_map.load_page(page, bytes.fromhex(response[len(prefix):]))
+                except ValueError:
+                    raise SensorError(response, "INDEX") from None
+            slot_map.mark_synced()
+            return slot_map
+        return await self._run(flow(), timeout)
+
+    async def download_slots(self, slots, on_template, timeout=None):
+        # LOAD_B1 + DOWNLOAD_TPL_B1 de cada slot, um atrás do outro. on_template(slot, template)
+        # é chamado a cada slot (com um SensorError no lugar do template se ele falhou) e deve só
+        # enfileirar o trabalho pesado: o LOAD_B1 do próximo slot sai assim que o último chunk
+        # do atual chega, então o link não fica parado enquanto o PC grava.
+        return await self._run(self._download_slots(list(slots), on_template), timeout, span='download_slots')
+
+    async def _download_slots(self, slots, on_template):
+        if slots:
+            await self.send(f"{CMD_LOAD_B1},{slots[0]}")
+        for index, slot in enumerate(slots):
+            prefetch = f"{CMD_LOAD_B1},{slots[index + 1]}" if index + 1 < len(slots) else None
+            try:
+                await self._expect_loaded(slot)
+            except SensorError as e:
+                if prefetch is not None:
+                    await self.send(prefetch)
+                on_template(slot, e)
+                continue
+            try:
+                template = await self._download_template_b1(prefetch)
+            except SensorError as e:
+                template = e
+            on_template(slot, template)
+
+    async def _expect_loaded(self, slot):
+        while True:
+            response = await self.receive()
+            # Restos de um download que falhou no PC (chunk corrompido) antes do LOADED
+            if isinstance(response, tuple) or response.startswith(f"{RESP_TEMPLATE_CHUNK}:") \
+                    or "TEMPLATE_DOWNLOAD_COMPLETE" in response:
+                continue
+            if f"{RESP_OK}:LOADED:{slot}" in response:
+                return
+            raise SensorError(response, f"LOAD_B1 {slot}")
+
+    async def upload_slots(self, templates, on_stored, timeout=None):
+        # UPLOAD_TPL_B1 + STORE_B1 de cada (slot, template). O UPLOAD_TPL_B1 do próximo vai logo
+        # depois do STORE_B1, sem esperar o STORED; on_stored(slot, None ou SensorError) a cada slot.
+        # O STORE_B1 só sai depois do TEMPLATE_UPLOAD_COMPLETE (chunk recusado não vai para o flash).
+        return await self._run(self._upload_slots(templates, on_stored), timeout, span='upload_slots')
+
+    async def _upload_slots(self, templates, on_stored):
+        queued = False # UPLOAD_TPL_B1 já na fila do sketch
+        iterator = iter(templates)
+        item = next(iterator, None)
+        while item is not None:
+            slot, template = item
+            item = next(iterator, None)
+            try:
+                await self._upload_template_b1(template, command_sent=queued)
+            except SensorError as e:
+                queued = False
+                on_stored(slot, e)
+                continue
+            await self.send(f"{CMD_STORE_B1},{slot}")
+            queued = item is not None
+            if queued:
+                await self.send(CMD_UPLOAD_TEMPLATE_B1)
+            try:
+                await self._expect(None, f"{RESP_OK}:STORED:{slot}", context=f"STORE_B1 {slot}")
+            except SensorError as e:
+                on_stored(slot, e)
+                continue
+            on_stored(slot, None)
+
+    async def upload_template_b1(self, template, timeout=None):
+        # Manda um template do PC para o CharBuffer1 do sensor
+        return await self._run(self._upload_template_b1(template), timeout, span='upload_template')
+
+    async def _upload_template_b1(self, template, command_sent=False):
+        if len(template) != TEMPLATE_SIZE:
+            raise ValueError(f"Template deve ter {TEMPLATE_SIZE} bytes (recebido {len(template)})")
+        await self._expect(None if command_sent else CMD_UPLOAD_TEMPLATE_B1, f"{RESP_OK}:UPLOAD_READY",
+                           timeout=5, context="UPLOAD_TPL_B1")
+        for offset in range(0, TEMPLATE_SIZE, DATA_PACKET_PAYLOAD_SIZE):
+            chunk = bytes(template[offset:offset + DATA_PACKET_PAYLOAD_SIZE])
+            await self.send_raw(chunk + (sum(chunk) & 0xFFFF).to_bytes(TEMPLATE_BIN_CHECKSUM_SIZE, 'big'))
+            await self._expect(None, f"{RESP_OK}:UPLOAD_CHUNK_ACK:{offset + len(chunk)}", timeout=5,
+                               context="UPLOAD_TPL_B1")
+        await self._expect(None, f"{RESP_OK}:TEMPLATE_UPLOAD_COMPLETE", timeout=5, context="UPLOAD_TPL_B1")
+
+    async def poll_finger(self, timeout=None):
+        # GET_IMAGE fora de um fluxo: True se havia um dedo (imagem capturada), False se não
+        async def flow():
+            await self.send(CMD_GET_IMAGE)
+            response = await self.receive(5)
+            if isinstance(response, str) and f"{RESP_OK}:IMAGE_TAKEN" in response:
+                return True
+            if isinstance(response, str) and RESP_NO_FINGER in response:
+                return False
+            raise SensorError(response, "GET_IMAGE")
+        return await self._run(flow(), timeout)
+
+    async def identify_captured(self, timeout=None):
+        # IMAGE_TO_TZ1 + SEARCH_B1 sobre a imagem do último poll_finger(): (ID, confiança) ou None
+        async def flow():
+            await self._expect(CMD_IMAGE_TO_TZ1, f"{RESP_OK}:CONVERT_DONE", context="IMAGE_TO_TZ1")
+            await self.send(CMD_SEARCH_B1)
+            return parse_identify_response(await self.receive(10))
+        return await self._run(flow(), timeout, span='identify_captured')
+
+    async def search_b1(self, timeout=None):
+        # Busca o CharBuffer1 no flash do sensor: (ID, confiança) ou None
+        async def flow():
+            await self.send(CMD_SEARCH_B1)
+            return parse_identify_response(await self.receive(10))
+        return await self._run(flow(), timeout)
+
+    async def store_b1(self, sensor_id, timeout=None):
+        # Grava o CharBuffer1 no slot sensor_id do flash
+        return await self._run(self._expect(f"{CMD_STORE_B1},{sensor_id}", f"{RESP_OK}:STORED:{sensor_id}",
+                                            context="STORE_B1"), timeout)
+
+
+def parse_identify_response(response):
+    # "ID_FOUND:12,CONFIDENCE:150" -> (12, 150); NOT_FOUND -> None; falhas -> SensorError
+    if isinstance(response, str) and RESP_ID_FOUND in response:
+        try:
+            parts_id = response.split(f"{RESP_ID_FOUND}:")[1]
+            sensor_id, confidence = parts_id.split(",CONFIDENCE:")
+            return int(sensor_id), int(confidence)
+        except ValueError:
+            raise SensorError(response, "ID_FOUND mal formatado") from None
+    if isinstance(response, str) and RESP_NOT_FOUND in response:
+        return None
+    raise SensorError(response, "IDENTIFY")
+
+
+async def _call_prompt(on_prompt, message):
+    if on_prompt is None:
+        return
+    result = on_prompt(message)
+    if asyncio.iscoroutine(result):
+        await result
@@ -0,0 +1,45 @@
+# Latência de identificação: fluxo passo a passo (IDENTIFY + GET_IMAGE + IMAGE_TO_TZ1)
+# x IDENTIFY_AUTO, no Arduino falso (fake_arduino.py) com latência de link e a taxa dada.
+#
+#   python benchmarks/bench_auto_identify.py [latencia_link_ms] [baud]
+import builtins
+import contextlib
+import io
+import os
+import sys
+import time
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+from fake_arduino import FakeArduino, template_for
+
+
+def measure(flow, runs):
+    latencies = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            flow()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+if __name__ == '__main__':
+    link_latency_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 8.0 # latency timer típico de USB-serial
+    baudrate = int(sys.argv[2]) if len(sys.argv) > 2 else 9600
+    builtins.input = lambda prompt="": "" # O dedo "já está" no sensor: mede só o protocolo
+
+    with FakeArduino(command_latency=link_latency_ms / 1000) as fake:
+        fake.baud = baudrate
+        fake.sensor_initialized = True
+        fake.library[1] = template_for(fake.finger) # Dedo cadastrado: a busca acha o ID 1
+        main.arduino_serial = serial.Serial(fake.port, baudrate, timeout=0.1)
+        delays = fake.delays
+        print(f"Link: {link_latency_ms} ms por comando, {baudrate} bps; sensor: getImage {delays['get_image'] * 1000:.0f} ms, "
+              f"image2Tz {delays['image2tz'] * 1000:.0f} ms, busca {delays['search'] * 1000:.0f} ms")
+        for label, flow in (("passo a passo", main.identify_current_finger), ("IDENTIFY_AUTO", main.identify_finger_auto)):
+            latencies = sorted(measure(flow, 10))
+            print(f"{label:<14} p50 {latencies[len(latencies) // 2] * 1000:7.1f} ms   máx {latencies[-1] * 1000:7.1f} ms")
+        main.arduino_serial.close()
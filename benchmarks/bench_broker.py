@@ -0,0 +1,111 @@
+# Latência pelo broker (broker.py) x cada processo abrindo a porta e fazendo o handshake,
+# no Arduino falso (fake_arduino.py, numa pty).
+#
+#   python benchmarks/bench_broker.py [--runs 30] [--clients 8] [--time-scale 0.1]
+#
+# O broker fala com o sensor pelo AsyncFingerprintClient (9600 bps, sem troca de taxa);
+# "reabrindo a porta" é o connect_arduino do main.py: a frio (reset pelo DTR, como antes do
+# início a quente) e a quente (placa já inicializada).
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+from async_client import AsyncFingerprintClient
+from bench_protocol import report
+from broker import Broker, BrokerClient
+from fake_arduino import FakeArduino, template_for
+from wire_trace import TRACE_OFF
+
+BOARD_BOOT_TIME = 1.0 # s do reset ao fim do setup() (bootloader + setup() de um Uno, aproximado)
+
+
+async def timed(coroutine_factory, runs):
+    latencies = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        await coroutine_factory()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+async def bench_broker(fake, runs, clients):
+    reader, writer = await fake.open_streams()
+    sensor = AsyncFingerprintClient(reader, writer, name='fake', trace_level=TRACE_OFF)
+    await sensor.init_sensor()
+    broker = Broker(sensor)
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_broker_'), 'broker.sock')
+    server = asyncio.ensure_future(broker.serve(path))
+    while not os.path.exists(path):
+        await asyncio.sleep(0.01)
+    connections = [await BrokerClient.open(path) for _ in range(clients)]
+    client = connections[0]
+
+    report("broker: count", await timed(client.count, runs))
+    report("broker: identify", await timed(client.identify, runs))
+
+    # Vários processos pedindo COUNT ao mesmo tempo: um COUNT só na serial
+    commands_before = fake.commands_received
+    t0 = time.perf_counter()
+    await asyncio.gather(*(connection.count() for connection in connections for _ in range(runs)))
+    elapsed = time.perf_counter() - t0
+    print(f"{'broker: count concorrente':<28} {clients * runs} pedidos em {elapsed * 1000:.0f} ms, "
+          f"{fake.commands_received - commands_before} COUNT na serial")
+
+    # Fechadura identificando enquanto a ferramenta de admin baixa templates: a fila põe a
+    # identificação na frente, então ela espera no máximo o pedido que já está no sensor
+    async def admin():
+        for _ in range(runs):
+            await connections[1].download_template()
+    admin_task = asyncio.ensure_future(admin())
+    await asyncio.sleep(0.05)
+    report("broker: identify c/ admin", await timed(client.identify, runs))
+    await admin_task
+
+    for connection in connections:
+        await connection.close()
+    server.cancel()
+    await sensor.close()
+
+
+def bench_reopen(fake, runs, cold):
+    main.RESET_BOARD_ON_CONNECT = cold
+    latencies = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if cold:
+                threading.Timer(BOARD_BOOT_TIME, fake.reset).start() # O que o DTR faria numa placa de verdade
+            if main.connect_arduino():
+                main.get_sensor_template_count()
+        latencies.append(time.perf_counter() - t0)
+        main.arduino_serial.close()
+    report(f"reabrir ({'a frio' if cold else 'a quente'}) + count", latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--time-scale', type=float, default=0.1)
+    args = parser.parse_args()
+
+    fake = FakeArduino(time_scale=args.time_scale).start()
+    fake.library[1] = template_for(fake.finger)
+    fake.char_buffers[1] = fake.library[1]
+    print(f"Arduino falso em {fake.port}: time_scale {args.time_scale}, {args.runs} execuções, {args.clients} clientes\n")
+    asyncio.run(bench_broker(fake, args.runs, args.clients))
+
+    main.SERIAL_PORT = fake.port
+    main._wire_tracer.level = TRACE_OFF
+    main.SESSION_CACHE_PATH = os.path.join(tempfile.mkdtemp(prefix='bench_broker_'), 'arduino_session.json')
+    bench_reopen(fake, min(args.runs, 3), cold=True)
+    bench_reopen(fake, args.runs, cold=False)
+    fake.stop()
@@ -0,0 +1,94 @@
+# Exportação/importação em lote (bulk_transfer.py) x um slot por vez com os comandos avulsos,
+# no Arduino falso (fake_arduino.py, numa pty), pelo AsyncFingerprintClient a 9600 bps.
+#
+#   python benchmarks/bench_bulk.py [--slots 20] [--time-scale 1.0]
+#
+# "um por vez": LOAD_B1, DOWNLOAD_TPL_B1 e só então grava no banco e manda o próximo comando,
+# num sketch sem o DOWNLOAD_QUIET_MS (limpeza inteira de 500 ms depois de cada download).
+# Depois: exportação interrompida no meio e retomada pelo checkpoint, e a importação num
+# segundo sensor.
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from async_client import AsyncFingerprintClient
+from bulk_transfer import Checkpoint, export_templates, import_templates
+from fake_arduino import FakeArduino, template_for
+from protocol import CMD_LOAD_B1, RESP_OK
+from template_store import TemplateStore
+from wire_trace import TRACE_OFF
+
+
+async def open_client(fake):
+    reader, writer = await fake.open_streams()
+    client = AsyncFingerprintClient(reader, writer, name=fake.port, trace_level=TRACE_OFF)
+    await client.init_sensor()
+    return client
+
+
+async def export_one_by_one(client, store, slots):
+    t0 = time.perf_counter()
+    for slot in slots:
+        await client._run(client._expect(f"{CMD_LOAD_B1},{slot}", f"{RESP_OK}:LOADED:{slot}"), None)
+        store.put(slot, await client.download_template_b1(), port=client.name)
+    return time.perf_counter() - t0
+
+
+async def bench(args):
+    workdir = tempfile.mkdtemp(prefix='bench_bulk_')
+    source = FakeArduino(time_scale=args.time_scale).start()
+    target = FakeArduino(time_scale=args.time_scale).start()
+    slots = list(range(1, 2 * args.slots, 2)) # Slots alternados, como um sensor com cadastros apagados
+    for slot in slots:
+        source.library[slot] = template_for(slot)
+    client = await open_client(source)
+
+    store = TemplateStore(os.path.join(workdir, 'um_por_vez'))
+    quiet = source.delays['download_quiet']
+    source.delays['download_quiet'] = source.delays['download_cleanup'] # Sketch antigo
+    elapsed = await export_one_by_one(client, store, slots)
+    source.delays['download_quiet'] = quiet
+    print(f"um por vez (sketch antigo): {len(slots)} templates em {elapsed:.1f} s ({len(slots) / elapsed:.2f} templates/s)")
+    store.close()
+
+    store = TemplateStore(os.path.join(workdir, 'lote'))
+    checkpoint = Checkpoint(os.path.join(workdir, 'checkpoint.json'))
+    stats = await export_templates(client, store, checkpoint)
+    stats.report()
+    ok = all(store.get(slot) == template_for(slot) for slot in slots)
+    print(f"   templates conferidos: {'ok' if ok else 'DIFERENTES'}")
+
+    # Exportação interrompida (cancelada no meio) e retomada
+    store.close()
+    store = TemplateStore(os.path.join(workdir, 'retomada'))
+    task = asyncio.ensure_future(export_templates(client, store, checkpoint))
+    while len(checkpoint.done(f"export:{client.name}")) < len(slots) // 2:
+        await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    print(f"   interrompida com {len(checkpoint.done(f'export:{client.name}'))} slots no checkpoint")
+    stats = await export_templates(client, store, checkpoint)
+    stats.report()
+    print(f"   banco completo: {sorted(store.ids()) == slots}")
+
+    target_client = await open_client(target)
+    stats = await import_templates(target_client, store, checkpoint)
+    stats.report()
+    print(f"   flash do destino igual à origem: {target.library == source.library}")
+
+    store.close()
+    await client.close()
+    await target_client.close()
+    source.stop()
+    target.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slots', type=int, default=20)
+    parser.add_argument('--time-scale', type=float, default=1.0)
+    asyncio.run(bench(parser.parse_args()))
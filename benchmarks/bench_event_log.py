@@ -0,0 +1,83 @@
+# Benchmark do log de eventos (event_log.py): custo do record() no caminho da identificação
+# e consultas por horário e por ID sobre milhões de eventos sintéticos.
+#
+#   python benchmarks/bench_event_log.py [eventos] [dias]
+#
+# Os eventos são espalhados por [dias] dias até agora, com 1000 IDs; ~80% FOUND.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from bench_matcher import percentile
+from event_log import NO_ID, EventLog
+
+USERS = 1000
+
+
+def report(label, latencies, extra=""):
+    print(f"{label:<34} p50 {percentile(latencies, 50) * 1000:8.3f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:8.3f} ms   {extra}")
+
+
+def timed(function, arguments):
+    latencies, sizes = [], []
+    for args in arguments:
+        t0 = time.perf_counter()
+        result = function(*args)
+        latencies.append(time.perf_counter() - t0)
+        sizes.append(len(result))
+    return latencies, sizes
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rng = random.Random(42)
+    now = time.time()
+    first = now - days * 86400
+    step = (now - first) / count
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = EventLog(directory)
+        # Hot path: record() com o horário atual, como no main.py
+        latencies = []
+        for _ in range(20000):
+            t0 = time.perf_counter()
+            log.record('identify', 'FOUND', rng.randrange(1, USERS), 120)
+            latencies.append(time.perf_counter() - t0)
+        print(f"record(): p50 {percentile(latencies, 50) * 1e6:.2f} µs   p99 {percentile(latencies, 99) * 1e6:.2f} µs")
+
+        t0 = time.perf_counter()
+        for i in range(count):
+            if rng.random() < 0.8:
+                log.record('identify', 'FOUND', rng.randrange(1, USERS), rng.randrange(50, 300), first + i * step)
+            else:
+                log.record('identify', 'NOT_FOUND', NO_ID, 0, first + i * step)
+        log.close()
+        elapsed = time.perf_counter() - t0
+        segments = sum(len(files) for _, _, files in os.walk(directory))
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(directory) for name in files)
+        print(f"{count} eventos gravados em {elapsed:.1f} s ({count / elapsed:.0f}/s), "
+              f"{segments} segmentos, {size / count:.1f} bytes/evento\n")
+
+        t0 = time.perf_counter()
+        log = EventLog(directory)
+        log.between(first, now + 1)
+        print(f"Primeira consulta (carrega o índice de todos os segmentos) + varredura completa: "
+              f"{time.perf_counter() - t0:.2f} s\n")
+
+        windows = [(start, start + 600) for start in (rng.uniform(first, now - 600) for _ in range(50))]
+        latencies, sizes = timed(log.entered, windows)
+        report("quem entrou (janela de 10 min)", latencies, f"~{sum(sizes) / len(sizes):.0f} IDs")
+        windows = [(start, start + 3600) for start in (rng.uniform(first, now - 3600) for _ in range(50))]
+        latencies, sizes = timed(log.between, windows)
+        report("eventos de 1 h", latencies, f"~{sum(sizes) / len(sizes):.0f} eventos")
+        latencies, sizes = timed(log.for_id, [(rng.randrange(1, USERS),) for _ in range(50)])
+        report(f"todos os eventos de um ID ({days} dias)", latencies, f"~{sum(sizes) / len(sizes):.0f} eventos")
+        latencies, sizes = timed(lambda user_id, start: log.for_id(user_id, start, start + 86400),
+                                 [(rng.randrange(1, USERS), rng.uniform(first, now - 86400)) for _ in range(50)])
+        report("eventos de um ID em 1 dia", latencies, f"~{sum(sizes) / len(sizes):.0f} eventos")
+        log.close()
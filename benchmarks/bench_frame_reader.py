@@ -0,0 +1,99 @@
+# Micro-benchmark do leitor de respostas: leitura byte a byte (antiga) x leitura em bloco.
+# Usa a porta de loopback do pyserial (loop://), então não precisa de Arduino.
+#
+#   python benchmarks/bench_frame_reader.py
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+from protocol import START_MARKER, END_MARKER, RESP_PREFIX, RESP_FAIL
+
+FRAME = b"<RESP:OK:IMAGE1_TAKEN>\n"
+CHUNK_FRAME = b"<RESP:TEMPLATE_CHUNK:" + b"AB" * 128 + b">\n"
+
+
+def legacy_read_response(port, timeout_seconds):
+    # Cópia do algoritmo original de read_arduino_response (sem os prints)
+    raw_message_inside_markers = ""
+    message_started = False
+    buffer_debug = ""
+    start_time = time.time()
+    while time.time() - start_time < timeout_seconds:
+        if port.in_waiting > 0:
+            char = port.read(1).decode('utf-8', errors='ignore')
+            buffer_debug += char
+            if char == START_MARKER:
+                raw_message_inside_markers = ""
+                message_started = True
+                continue
+            if message_started:
+                if char == END_MARKER:
+                    if raw_message_inside_markers.startswith(RESP_PREFIX):
+                        return raw_message_inside_markers[len(RESP_PREFIX):]
+                    return raw_message_inside_markers
+                raw_message_inside_markers += char
+        time.sleep(0.005)
+    return f"{RESP_FAIL}:TIMEOUT_PY"
+
+
+def new_read_response(port, timeout_seconds):
+    main.arduino_serial = port
+    with contextlib.redirect_stdout(io.StringIO()):
+        return main.read_arduino_response(timeout_seconds=timeout_seconds)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_latency(reader, frame, count):
+    # Um quadro por vez: latência do write até o retorno do leitor
+    port = serial.serial_for_url('loop://', timeout=0.1)
+    main._frame_parser.reset()
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        port.write(frame)
+        if RESP_FAIL in reader(port, 2):
+            raise RuntimeError("timeout no benchmark")
+        latencies.append(time.perf_counter() - t0)
+    port.close()
+    return latencies
+
+
+def bench_burst(reader, frame, count):
+    # Rajada: quadros escritos de uma vez só, mede quadros/s.
+    # O loop:// tem fila de 4096 bytes, então o escritor roda em outra thread.
+    port = serial.serial_for_url('loop://', timeout=0.1)
+    main._frame_parser.reset()
+    writer = threading.Thread(target=port.write, args=(frame * count,), daemon=True)
+    t0 = time.perf_counter()
+    writer.start()
+    for _ in range(count):
+        if RESP_FAIL in reader(port, 5):
+            raise RuntimeError("timeout no benchmark")
+    elapsed = time.perf_counter() - t0
+    port.close()
+    return count / elapsed
+
+
+def report(name, reader, frame, count):
+    latencies = bench_latency(reader, frame, count)
+    fps = bench_burst(reader, frame, count)
+    print(f"{name:<10} {fps:>12.1f} quadros/s   p50 {percentile(latencies, 50) * 1000:8.3f} ms"
+          f"   p99 {percentile(latencies, 99) * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    for label, frame, legacy_count in (("curto", FRAME, 20), ("chunk hex", CHUNK_FRAME, 3)):
+        print(f"\n--- Quadro {label} ({len(frame)} bytes) ---")
+        report("antigo", legacy_read_response, frame, legacy_count)
+        report("novo", new_read_response, frame, 2000)
@@ -0,0 +1,58 @@
+# Benchmark da busca 1:N no PC (matcher.py) com templates sintéticos.
+#
+#   python benchmarks/bench_matcher.py [N] [workers]
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from matcher import TemplateMatcher, default_workers
+from protocol import TEMPLATE_SIZE
+from template_store import TemplateStore
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(matcher, probes):
+    matcher.top_k(probes[0]) # Aquece (empacota a matriz / sobe o pool)
+    latencies = []
+    for probe in probes:
+        t0 = time.perf_counter()
+        matcher.top_k(probe, 5)
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else default_workers()
+    rng = np.random.default_rng(42)
+    templates = rng.integers(0, 256, size=(count, TEMPLATE_SIZE), dtype=np.uint8)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TemplateStore(directory)
+        t0 = time.perf_counter()
+        for i, template in enumerate(templates, start=1):
+            store.put(i, template.tobytes())
+        print(f"{count} templates gravados em {time.perf_counter() - t0:.1f} s")
+
+        # Probes: templates existentes com 10% dos bits trocados (o top-1 deve ser o original)
+        probes = []
+        for target in rng.integers(0, count, size=50):
+            noise = np.packbits(rng.random(TEMPLATE_SIZE * 8) < 0.1)
+            probes.append((target + 1, (templates[target] ^ noise).tobytes()))
+
+        for label, matcher in (("1 núcleo", TemplateMatcher(store)),
+                               (f"{workers} processos", TemplateMatcher(store, workers=workers))):
+            latencies = run(matcher, [probe for _, probe in probes])
+            hits = sum(matcher.top_k(probe, 1)[0][0] == target for target, probe in probes)
+            print(f"{label:<12} p50 {percentile(latencies, 50) * 1000:7.2f} ms   "
+                  f"p99 {percentile(latencies, 99) * 1000:7.2f} ms   top-1 correto {hits}/{len(probes)}")
+            matcher.close()
+        store.close()
@@ -0,0 +1,141 @@
+# Benchmark do protocolo sem hardware: roda os fluxos do main.py contra o Arduino falso
+# (fake_arduino.py, numa pty) e mostra latência (p50/p95/p99) e vazão de cada um.
+#
+#   python benchmarks/bench_protocol.py [--runs 20] [--time-scale 0.1] [--noise 0] [--max-baud 230400] [--framing 2]
+#
+# --time-scale encolhe os tempos do sensor (1.0 = tempos reais aproximados do R305/ZFM-20),
+# para medir o custo do lado do PC e do protocolo. O primeiro connect é a frio (INIT_SENSOR
+# e troca de taxa); o segundo reabre a porta com a placa já inicializada (início a quente).
+import argparse
+import builtins
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+from fake_arduino import FakeArduino
+from metrics import metrics
+from wire_trace import TRACE_OFF
+
+
+class Answers:
+    # Responde os input() dos fluxos: ID do cadastro, download (s/N) e gravar no flash (S/n)
+    def __init__(self, user_id=1, download=False):
+        self.user_id = user_id
+        self.download = download
+
+    def __call__(self, prompt=""):
+        if "ID" in prompt:
+            return str(self.user_id)
+        if "download" in prompt:
+            return 's' if self.download else 'n'
+        return ''
+
+
+def run(label, flow, runs, success_text, before=None):
+    latencies = []
+    failures = 0
+    for i in range(runs):
+        if before:
+            before(i)
+        output = io.StringIO()
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            result = flow()
+        latencies.append(time.perf_counter() - t0)
+        text = output.getvalue()
+        if success_text is None and result is None or success_text is not None and success_text not in text:
+            failures += 1
+    report(label, latencies, failures)
+    return latencies
+
+
+def report(label, latencies, failures=0, extra=""):
+    ordered = sorted(latencies)
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    total = sum(ordered)
+    print(f"{label:<28} n={len(ordered):<4} p50 {pct(0.5):8.1f} ms  p95 {pct(0.95):8.1f} ms  "
+          f"p99 {pct(0.99):8.1f} ms  {len(ordered) / total:6.2f} op/s  falhas {failures}{extra}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--time-scale', type=float, default=0.1)
+    parser.add_argument('--noise', type=float, default=0.0, help="Probabilidade de erro por byte enviado pelo Arduino")
+    parser.add_argument('--max-baud', type=int, default=230400)
+    parser.add_argument('--framing', type=int, choices=(1, 2), default=2, help="1 = protocolo sem sequência/CRC")
+    args = parser.parse_args()
+
+    fake = FakeArduino(time_scale=args.time_scale, noise_rate=args.noise, max_baud=args.max_baud).start()
+    main.SERIAL_PORT = fake.port
+    main.FRAMED_PROTOCOL = args.framing == 2
+    main._wire_tracer.level = TRACE_OFF
+    main.TEMPLATE_STORE_DIR = tempfile.mkdtemp(prefix='bench_protocol_')
+    main.SESSION_CACHE_PATH = os.path.join(main.TEMPLATE_STORE_DIR, 'arduino_session.json')
+    answers = Answers()
+    builtins.input = answers
+    print(f"Arduino falso em {fake.port}: time_scale {args.time_scale}, ruído {args.noise}, "
+          f"máx {args.max_baud} bps, protocolo v{args.framing}, {args.runs} execuções por fluxo\n")
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        connected = main.connect_arduino()
+    report("connect_arduino (a frio)", [time.perf_counter() - t0], 0 if connected else 1, f"  ({fake.baud} bps)")
+    if not connected:
+        sys.exit(1)
+    main.arduino_serial.close()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        connected = main.connect_arduino()
+    report("connect_arduino (a quente)", [time.perf_counter() - t0], 0 if connected else 1, f"  ({fake.baud} bps)")
+    if not connected:
+        sys.exit(1)
+
+    def enroll_as(i):
+        answers.user_id = i % fake.capacity + 1
+        fake.finger = answers.user_id
+        if answers.user_id in fake.library:
+            # Recadastro: apaga o ID antes (o ask_enroll_id recusa ID ocupado)
+            main.send_to_arduino(f"{main.CMD_DELETE},{answers.user_id}")
+            main.read_arduino_response()
+
+    run("enroll (passo a passo)", main.enroll_finger_interactive, args.runs,
+        "armazenada com sucesso", before=enroll_as)
+    run("enroll (ENROLL_AUTO)", main.enroll_finger_auto, args.runs,
+        "armazenada com sucesso", before=enroll_as)
+    fake.finger = 1
+    run("identify (passo a passo)", main.identify_current_finger, args.runs, "Digital encontrada")
+    run("identify (IDENTIFY_AUTO)", main.identify_finger_auto, args.runs, "Digital encontrada")
+    run("count", main.get_sensor_template_count, args.runs, "Templates armazenados")
+
+    fake.char_buffers[1] = fake.library[1]
+    for binary in (True, False):
+        main.TEMPLATE_TRANSFER_BINARY = binary
+        mode = "binário" if binary else "HEX"
+        start_bytes = fake.bytes_sent
+        latencies = run(f"download template ({mode})", main.download_template_b1, args.runs, None)
+        wire_bytes = (fake.bytes_sent - start_bytes) / args.runs
+        print(f"{'':<28} {wire_bytes:.0f} bytes na serial por template, "
+              f"{main.TEMPLATE_SIZE * len(latencies) / sum(latencies) / 1024:.1f} KiB/s de template")
+
+    main._command_tracker.finish()
+    if args.framing == 2:
+        sequencer = main._frame_sequencer
+        print(f"\nv2: {sequencer.corrupted} quadros corrompidos, {sequencer.lost} perdidos, "
+              f"{sequencer.duplicates} repetidos, {fake.retransmissions} retransmitidos pelo Arduino")
+    print("\nPor comando (envio -> último quadro, p95 pelo histograma):")
+    for name, stats in sorted(metrics.snapshot()['commands'].items()):
+        p95 = stats['final_frame_seconds']['p95']
+        print(f"   {name:<18} {stats['sent']:>5} envios  p95 <= {p95 * 1000 if p95 else 0:.0f} ms  "
+              f"timeouts {stats['timeouts']}")
+
+    main.arduino_serial.close()
+    if main.template_store is not None:
+        main.template_store.close()
+    fake.stop()
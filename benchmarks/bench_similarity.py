@@ -0,0 +1,98 @@
+# Benchmark da checagem de cadastro duplicado (similarity_index.py) x varredura completa
+# do banco (matcher.py), com templates sintéticos.
+#
+#   python benchmarks/bench_similarity.py [N]
+#
+# Duplicados: templates existentes com 5% e 8% dos bits trocados (score ~0.95 e ~0.92, acima
+# do DUPLICATE_MIN_SCORE). Digitais novas: templates aleatórios (não devem acusar nada).
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from bench_matcher import percentile
+from matcher import TemplateMatcher
+from protocol import TEMPLATE_SIZE
+from similarity_index import DUPLICATE_MIN_SCORE, SimilarityIndex
+from template_store import TemplateStore
+
+
+def timed(function, probes):
+    latencies, results = [], []
+    for probe in probes:
+        t0 = time.perf_counter()
+        results.append(function(probe))
+        latencies.append(time.perf_counter() - t0)
+    return latencies, results
+
+
+def report(label, latencies, extra=""):
+    print(f"{label:<30} p50 {percentile(latencies, 50) * 1000:7.3f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:7.3f} ms   {extra}")
+
+
+def noisy(rng, template, flip_ratio):
+    return (template ^ np.packbits(rng.random(TEMPLATE_SIZE * 8) < flip_ratio)).tobytes()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(42)
+    templates = rng.integers(0, 256, size=(count, TEMPLATE_SIZE), dtype=np.uint8)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TemplateStore(directory)
+        t0 = time.perf_counter()
+        for i, template in enumerate(templates, start=1):
+            store.put(i, template.tobytes())
+        print(f"{count} templates gravados em {time.perf_counter() - t0:.1f} s")
+
+        index = SimilarityIndex(store)
+        t0 = time.perf_counter()
+        index.refresh()
+        print(f"Índice montado em {time.perf_counter() - t0:.2f} s\n")
+
+        matcher = TemplateMatcher(store)
+        matcher.refresh()
+
+        def full_scan(probe):
+            scores = matcher.scores(probe)
+            return set(np.flatnonzero(scores >= DUPLICATE_MIN_SCORE) + 1)
+
+        targets = rng.integers(0, count, size=200)
+        groups = [(f"duplicado 5% ({len(targets)})", [noisy(rng, templates[t], 0.05) for t in targets]),
+                  (f"duplicado 8% ({len(targets)})", [noisy(rng, templates[t], 0.08) for t in targets]),
+                  ("digital nova (200)", [rng.integers(0, 256, TEMPLATE_SIZE, dtype=np.uint8).tobytes() for _ in range(200)])]
+        for label, probes in groups:
+            candidates = []
+
+            def check(probe):
+                found = index.find_duplicates(probe)
+                candidates.append(index.last_candidates)
+                return {template_id for template_id, _ in found}
+
+            latencies, found = timed(check, probes)
+            scan_latencies, expected = timed(full_scan, probes)
+            hits = sum(e <= f for e, f in zip(expected, found))
+            flagged = sum(bool(f) for f in found)
+            report(f"índice: {label}", latencies,
+                   f"acusou {flagged}, igual à varredura {hits}/{len(probes)}, {np.mean(candidates):.0f} comparados")
+            report(f"varredura: {label}", scan_latencies)
+
+        # Cadastros novos: store.put + add, sem reconstruir o índice
+        adds = []
+        for i in range(2000):
+            template = rng.integers(0, 256, TEMPLATE_SIZE, dtype=np.uint8).tobytes()
+            store.put(count + 1 + i, template)
+            t0 = time.perf_counter()
+            index.add(count + 1 + i, template)
+            adds.append(time.perf_counter() - t0)
+        report("add (2000 cadastros)", adds, f"{len(index)} no índice")
+        latencies, found = timed(index.find_duplicates, [noisy(rng, templates[t], 0.05) for t in targets])
+        report("índice depois dos cadastros", latencies,
+               f"acusou o original {sum(found_list[0][0] == t + 1 for found_list, t in zip(found, targets) if found_list)}/{len(targets)}")
+        matcher.close()
+        store.close()
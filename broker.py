@@ -0,0 +1,409 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from async_client import AsyncFingerprintClient, SensorError
+from metrics import metrics
+
+# Broker local: um processo fica com a serial e os outros (fechadura, ferramenta de
+# cadastro, health check) usam o sensor por um socket Unix, sem reabrir a porta nem
+# refazer o handshake a cada uso.
+#
+# Protocolo: uma linha JSON por mensagem, nos dois sentidos.
+#   -> {"id": 1, "op": "identify", "args": {...}, "priority": 0}   ("priority" é opcional)
+#   <- {"id": 1, "event": "ASK_PLACE_FINGER"}                      (progresso, zero ou mais)
+#   <- {"id": 1, "ok": true, "result": ...}  ou  {"id": 1, "ok": false, "error": "..."}
+#
+# Operações (OPERATIONS): identify, enroll (user_id, store, download), count,
+# download_template (template em HEX) e status (respondida pelo broker, sem ir ao sensor).
+# Um cliente pode mandar vários pedidos sem esperar as respostas; cada um volta com o seu id.
+#
+# O sensor atende um pedido por vez. A fila escolhe o de menor prioridade (identify antes
+# das tarefas de admin); a cada PRIORITY_AGING segundos de espera um pedido ganha um nível,
+# para um cadastro não ficar para sempre atrás de uma fechadura movimentada. Mesma prioridade:
+# ordem de chegada. Pedidos COUNT que chegam com um COUNT na fila ou em execução recebem a
+# resposta dele (nada muda o flash enquanto o sensor está ocupado com o COUNT).
+# Cliente que desconecta cancela os pedidos dele (o AsyncFingerprintClient ressincroniza).
+#
+#   python broker.py [--socket fingerprint_broker.sock] serve COM3 [--baud 9600]
+#   python broker.py [--socket ...] status|count|identify|download
+#   python broker.py [--socket ...] enroll ID
+
+SOCKET_PATH = 'fingerprint_broker.sock'
+PRIORITY_IDENTIFY = 0
+PRIORITY_COUNT = 5
+PRIORITY_ADMIN = 10
+PRIORITY_AGING = 2.0 # s de espera que valem um nível de prioridade
+MAX_REQUEST_LINE = 64 * 1024
+
+# op -> prioridade padrão
+OPERATIONS = {
+    'identify': PRIORITY_IDENTIFY,
+    'count': PRIORITY_COUNT,
+    'enroll': PRIORITY_ADMIN,
+    'download_template': PRIORITY_ADMIN,
+}
+
+
+class _Job:
+
+    def __init__(self, op, args, priority, seq, on_event):
+        self.op = op
+        self.args = args
+        self.priority = priority
+        self.seq = seq
+        self.on_event = on_event
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        self.waiters = 1
+        self.task = None
+
+
+class Broker:
+
+    def __init__(self, client, opener=None, aging=PRIORITY_AGING):
+        self.client = client
+        self.aging = aging
+        self.served = 0
+        self.coalesced = 0 # COUNT respondidos com o resultado de outro
+        self._opener = opener # Reabre o cliente depois de a serial cair
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._seq = 0
+        self._current = None
+        self._count_job = None # COUNT na fila ou em execução
+        self._started_at = time.monotonic()
+
+    @classmethod
+    async def open(cls, port, baudrate=9600):
+        async def opener():
+            # Reabrir a porta reinicia a placa (DTR): o connect() espera o boot antes do INIT_SENSOR
+            # e, se o sensor não subir, fecha a porta e deixa a próxima tentativa para o próximo pedido
+            return await AsyncFingerprintClient.connect(port, baudrate)
+        return cls(await opener(), opener)
+
+    # --- Fila ---
+
+    async def submit(self, op, args=None, priority=None, on_event=None):
+        # Enfileira (ou junta a um COUNT pendente) e espera o resultado
+        if op not in OPERATIONS:
+            raise ValueError(f"Operação desconhecida: {op}")
+        if op == 'count' and self._count_job is not None:
+            job = self._count_job
+            job.waiters += 1
+            self.coalesced += 1
+        else:
+            self._seq += 1
+            job = _Job(op, args or {}, OPERATIONS[op] if priority is None else priority, self._seq, on_event)
+            self._pending.append(job)
+            self._wakeup.set()
+            if op == 'count':
+                self._count_job = job
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            job.waiters -= 1
+            if job.waiters == 0:
+                self._cancel(job)
+            raise
+
+    def _cancel(self, job):
+        if job in self._pending:
+            self._pending.remove(job)
+            job.future.cancel()
+        elif job.task is not None:
+            job.task.cancel()
+        if job is self._count_job:
+            self._count_job = None
+
+    def _next_job(self):
+        now = time.monotonic()
+        job = min(self._pending, key=lambda j: (j.priority - (now - j.enqueued_at) / self.aging, j.seq))
+        self._pending.remove(job)
+        return job
+
+    async def run(self):
+        # Atende a fila, um pedido por vez no sensor
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            job = self._next_job()
+            metrics.record_span('broker_queue_wait', time.monotonic() - job.enqueued_at)
+            self._current = job
+            job.task = asyncio.ensure_future(self._execute(job))
+            try:
+                await asyncio.wait({job.task})
+            except asyncio.CancelledError:
+                job.task.cancel()
+                raise
+            finally:
+                self._current = None
+                if job is self._count_job:
+                    self._count_job = None
+            self.served += 1
+            metrics.record_span(f'broker_{job.op}', time.monotonic() - job.enqueued_at)
+            if job.future.done():
+                continue
+            if job.task.cancelled():
+                job.future.cancel()
+            elif job.task.exception() is not None:
+                job.future.set_exception(job.task.exception())
+            else:
+                job.future.set_result(job.task.result())
+
+    async def _execute(self, job):
+        if self.client is None:
+            if self._opener is None:
+                raise ConnectionError("Sensor desconectado")
+            self.client = await self._opener()
+        try:
+            return await self._dispatch(job.op, job.args, job.on_event)
+        except ConnectionError:
+            # Serial caiu: o próximo pedido reabre a porta
+            client, self.client = self.client, None
+            if self._opener is not None:
+                await client.close()
+            raise
+
+    async def _dispatch(self, op, args, on_event):
+        client = self.client
+        if op == 'identify':
+            flow = client.identify_auto if args.get('auto', True) else client.identify
+            match = await flow(on_event)
+            return None if match is None else {'sensor_id': match[0], 'confidence': match[1]}
+        if op == 'count':
+            return await client.count()
+        if op == 'enroll':
+            user_id = int(args['user_id'])
+            store = args.get('store', True)
+            if not args.get('download', False):
+                await client.enroll_auto(user_id, on_event, store)
+                return None
+            return (await client.enroll(user_id, on_event, store, download=True)).hex()
+        if op == 'download_template':
+            return (await client.download_template_b1()).hex()
+        raise ValueError(f"Operação desconhecida: {op}")
+
+    def status(self):
+        return {
+            'connected': self.client is not None,
+            'capacity': self.client.capacity if self.client is not None else None,
+            'busy': self._current.op if self._current is not None else None,
+            'queued': [job.op for job in sorted(self._pending, key=lambda j: j.seq)],
+            'served': self.served,
+            'coalesced': self.coalesced,
+            'uptime_s': round(time.monotonic() - self._started_at, 1),
+        }
+
+    # --- Socket ---
+
+    async def serve(self, path=SOCKET_PATH):
+        if os.path.exists(path):
+            try:
+                _, writer = await asyncio.open_unix_connection(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path) # Socket de uma execução anterior, sem ninguém atendendo
+            else:
+                writer.close()
+                raise RuntimeError(f"Já existe um broker atendendo em {path}")
+        server = await asyncio.start_unix_server(self._handle_connection, path, limit=MAX_REQUEST_LINE)
+        worker = asyncio.ensure_future(self.run())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    async def _handle_connection(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break # Linha maior que MAX_REQUEST_LINE ou conexão caiu
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    _send(writer, {'id': None, 'ok': False, 'error': "JSON inválido"})
+                    continue
+                task = asyncio.ensure_future(self._handle_request(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except asyncio.CancelledError:
+            pass # Broker encerrando; a tarefa da conexão é a raiz, não há quem propagar
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _handle_request(self, request, writer):
+        # Todo pedido recebe uma resposta: qualquer erro volta como ok False (o cliente
+        # esperaria para sempre por uma resposta que não vem)
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Pedido deve ser um objeto JSON")
+            op = request.get('op')
+            args = request.get('args')
+            priority = request.get('priority')
+            if args is not None and not isinstance(args, dict):
+                raise ValueError("args deve ser um objeto JSON")
+            if priority is not None and (isinstance(priority, bool) or not isinstance(priority, (int, float))):
+                raise ValueError("priority deve ser um número")
+            if op == 'status':
+                result = self.status()
+            else:
+                result = await self.submit(op, args, priority,
+                                           on_event=lambda message: _send(writer, {'id': request_id, 'event': message}))
+        except Exception as e:
+            _send(writer, {'id': request_id, 'ok': False, 'error': str(e) or type(e).__name__})
+            return
+        _send(writer, {'id': request_id, 'ok': True, 'result': result})
+
+
+def _send(writer, message):
+    if not writer.is_closing():
+        writer.write(json.dumps(message).encode('utf-8') + b'\n')
+
+
+class BrokerClient:
+    # Cliente do broker. Os métodos espelham os do AsyncFingerprintClient; erros do sensor
+    # voltam como SensorError e o broker fora do ar como ConnectionError.
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._pending = {} # id -> (future, on_event)
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, path=SOCKET_PATH):
+        reader, writer = await asyncio.open_unix_connection(path, limit=MAX_REQUEST_LINE)
+        return cls(reader, writer)
+
+    async def close(self):
+        self._reader_task.cancel()
+        try:
+            await self._reader_task
+        except asyncio.CancelledError:
+            pass
+        self._writer.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                future, on_event = self._pending.get(message.get('id'), (None, None))
+                if future is None:
+                    continue
+                if 'event' in message:
+                    if on_event is not None:
+                        result = on_event(message['event'])
+                        if asyncio.iscoroutine(result):
+                            await result
+                    continue
+                del self._pending[message['id']]
+                if not future.done():
+                    future.set_result(message)
+        finally:
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Broker desconectado"))
+            self._pending.clear()
+
+    async def request(self, op, args=None, priority=None, on_event=None):
+        if self._reader_task.done():
+            raise ConnectionError("Broker desconectado")
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, on_event)
+        request = {'id': request_id, 'op': op, 'args': args or {}}
+        if priority is not None:
+            request['priority'] = priority
+        self._writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        try:
+            await self._writer.drain()
+            response = await future
+        finally:
+            self._pending.pop(request_id, None)
+        if not response['ok']:
+            raise SensorError(response['error'], op)
+        return response['result']
+
+    async def status(self):
+        return await self.request('status')
+
+    async def count(self):
+        return await self.request('count')
+
+    async def identify(self, on_event=None, auto=True, priority=None):
+        # (ID, confiança) ou None
+        match = await self.request('identify', {'auto': auto}, priority, on_event)
+        return None if match is None else (match['sensor_id'], match['confidence'])
+
+    async def enroll(self, user_id, on_event=None, store=True, download=False, priority=None):
+        # Template (bytes) se download=True, senão None
+        template = await self.request('enroll', {'user_id': user_id, 'store': store, 'download': download},
+                                      priority, on_event)
+        return bytes.fromhex(template) if template else None
+
+    async def download_template(self, priority=None):
+        return bytes.fromhex(await self.request('download_template', priority=priority))
+
+
+async def _run_command(args):
+    client = await BrokerClient.open(args.socket)
+    try:
+        if args.command == 'status':
+            print(json.dumps(await client.status()))
+        elif args.command == 'count':
+            print(f"Templates armazenados no sensor: {await client.count()}")
+        elif args.command == 'identify':
+            match = await client.identify(on_event=print)
+            print(f"Digital encontrada: ID {match[0]}, confiança {match[1]}" if match else "Digital não encontrada.")
+        elif args.command == 'enroll':
+            await client.enroll(args.user_id, on_event=print)
+            print(f"Digital armazenada no ID {args.user_id}.")
+        elif args.command == 'download':
+            print((await client.download_template()).hex())
+    finally:
+        await client.close()
+
+
+async def _serve(args):
+    broker = await Broker.open(args.port, args.baud)
+    print(f"Broker do sensor em {args.socket} ({args.port}, capacidade {broker.client.capacity}). Ctrl+C para sair.")
+    await broker.serve(args.socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Broker local do leitor biométrico")
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="Abre a serial e atende pelo socket")
+    serve.add_argument('port', nargs='?', default='COM3')
+    serve.add_argument('--baud', type=int, default=9600)
+    for name in ('status', 'count', 'identify', 'download'):
+        commands.add_parser(name)
+    enroll = commands.add_parser('enroll')
+    enroll.add_argument('user_id', type=int)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args) if args.command == 'serve' else _run_command(args))
+    except KeyboardInterrupt:
+        print("Broker encerrado.")
+    except (SensorError, ConnectionError, FileNotFoundError, RuntimeError) as e:
+        print(f"Erro: {e}")
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from async_client import DEFAULT_SENSOR_CAPACITY, AsyncFingerprintClient, SensorError
+from template_store import TemplateStore
+
+# Exportação e importação em lote dos templates do flash do sensor, com checkpoint.
+#
+#   python bulk_transfer.py export COM3            flash do sensor -> banco do PC
+#   python bulk_transfer.py import COM4 [--ids 1-40,57]   banco do PC -> flash do sensor
+#   python bulk_transfer.py migrate COM3 COM4      as duas coisas, de um sensor para outro
+#
+# Exportar: a tabela INDEX diz quais slots estão ocupados; cada um é carregado no CharBuffer1
+# (LOAD_B1) e baixado (DOWNLOAD_TPL_B1) para o banco do PC (template_store.py) com o mesmo
+# ID. Importar: UPLOAD_TPL_B1 + STORE_B1 de cada template do banco no slot do mesmo ID.
+#
+# O link não para entre os slots: o LOAD_B1 do próximo vai para a serial assim que chega o
+# último chunk do atual (o sketch encurta a limpeza pós-download quando acha um comando na
+# fila) e a gravação no banco e no checkpoint roda numa thread enquanto o próximo template
+# já está vindo. Na importação o UPLOAD_TPL_B1 do próximo vai junto com o STORE_B1 do atual.
+#
+# O checkpoint (CHECKPOINT_FILE) guarda os slots já concluídos de cada tarefa ("export:COM3",
+# "import:COM4") e é gravado a cada slot; rodar o mesmo comando de novo depois de uma
+# interrupção continua de onde parou. Tarefa terminada sem falhas sai do checkpoint.
+
+CHECKPOINT_FILE = 'bulk_checkpoint.json'
+TEMPLATE_STORE_DIR = 'template_store' # Mesmo TEMPLATE_STORE_DIR do main.py
+
+
+class Checkpoint:
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self._jobs = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._jobs = {job: set(slots) for job, slots in json.load(f).items()}
+
+    def done(self, job):
+        return set(self._jobs.get(job, ()))
+
+    def add(self, job, slot):
+        self._jobs.setdefault(job, set()).add(slot)
+        self._save()
+
+    def finish(self, job):
+        if self._jobs.pop(job, None) is not None:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({job: sorted(slots) for job, slots in self._jobs.items()}, f)
+        os.replace(tmp_path, self.path)
+
+
+class TransferStats:
+
+    def __init__(self, operation, slots, pending):
+        self.operation = operation
+        self.slots = slots # Todos os slots da tarefa
+        self.total = len(pending) # A transferir nesta execução
+        self.skipped = len(slots) - len(pending) # Já concluídos numa execução anterior (checkpoint)
+        self.done = []
+        self.failed = [] # (slot, erro)
+        self.start_time = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.start_time
+        return self
+
+    def rate(self):
+        return len(self.done) / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        print(f"{self.operation}: {len(self.done)}/{self.total} templates em {self.elapsed:.1f} s "
+              f"({self.rate():.2f} templates/s), {self.skipped} já feitos antes, {len(self.failed)} falhas")
+        for slot, error in self.failed:
+            print(f"   slot {slot}: {error}")
+
+
+async def export_templates(client, store, checkpoint, job=None):
+    # Flash do sensor -> banco do PC, com os slots ocupados segundo a tabela INDEX
+    job = job or f"export:{client.name}"
+    occupied = (await client.occupied_slots()).occupied()
+    done = checkpoint.done(job)
+    slots = [slot for slot in occupied if slot not in done]
+    stats = TransferStats(job, occupied, slots)
+    queue = asyncio.Queue()
+
+    def save(slot, template):
+        store.put(slot, template, port=client.name)
+        checkpoint.add(job, slot)
+
+    async def writer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            slot, result = item
+            if isinstance(result, Exception):
+                stats.failed.append((slot, result))
+                continue
+            await asyncio.to_thread(save, slot, result)
+            stats.done.append(slot)
+
+    writer_task = asyncio.ensure_future(writer())
+    try:
+        await client.download_slots(slots, lambda slot, result: queue.put_nowait((slot, result)))
+    finally:
+        queue.put_nowait(None)
+        await writer_task
+    if not stats.failed:
+        checkpoint.finish(job)
+    return stats.finish()
+
+
+async def import_templates(client, store, checkpoint, ids=None, job=None):
+    # Banco do PC -> flash do sensor, cada template no slot do mesmo ID
+    job = job or f"import:{client.name}"
+    capacity = client.capacity or DEFAULT_SENSOR_CAPACITY
+    wanted = sorted(set(store.ids()) if ids is None else set(ids) & set(store.ids()))
+    too_big = [slot for slot in wanted if not 0 < slot <= capacity]
+    if too_big:
+        print(f"{len(too_big)} IDs do banco fora da capacidade do sensor ({capacity}) ficam de fora: {too_big[:10]}...")
+        wanted = [slot for slot in wanted if 0 < slot <= capacity]
+    done = checkpoint.done(job)
+    slots = [slot for slot in wanted if slot not in done]
+    stats = TransferStats(job, wanted, slots)
+
+    def on_stored(slot, error):
+        if error is not None:
+            stats.failed.append((slot, error))
+            return
+        checkpoint.add(job, slot)
+        stats.done.append(slot)
+
+    await client.upload_slots(((slot, store.get(slot)) for slot in slots), on_stored)
+    if not stats.failed:
+        checkpoint.finish(job)
+    return stats.finish()
+
+
+def parse_ids(text):
+    # "1-40,57" -> {1, ..., 40, 57}
+    ids = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        ids.update(range(int(first), int(last or first) + 1))
+    return ids
+
+
+async def _main(args):
+    store = TemplateStore(args.store)
+    checkpoint = Checkpoint(args.checkpoint)
+    clients = []
+    try:
+        for port in args.ports:
+            clients.append(await AsyncFingerprintClient.connect(port, args.baud)) # Espera o boot (DTR ao abrir)
+        if args.command == 'import':
+            (await import_templates(clients[0], store, checkpoint, parse_ids(args.ids) if args.ids else None)).report()
+            return
+        exported = await export_templates(clients[0], store, checkpoint)
+        exported.report()
+        if args.command == 'migrate':
+            if exported.failed:
+                print("Exportação incompleta: rode de novo para continuar antes de importar.")
+                return
+            (await import_templates(clients[1], store, checkpoint, exported.slots)).report()
+    finally:
+        for client in clients:
+            await client.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exportação/importação em lote dos templates do sensor")
+    parser.add_argument('--store', default=TEMPLATE_STORE_DIR)
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE)
+    parser.add_argument('--baud', type=int, default=9600)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('export').add_argument('ports', nargs=1, metavar='port')
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('ports', nargs=1, metavar='port')
+    import_parser.add_argument('--ids', help="Ex.: 1-40,57 (padrão: todos os IDs do banco)")
+    commands.add_parser('migrate').add_argument('ports', nargs=2, metavar='port', help="origem e destino")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print("Interrompido: rode o mesmo comando para continuar do checkpoint.")
+    except (SensorError, ConnectionError, RuntimeError) as e:
+        print(f"Erro: {e}")
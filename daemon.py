@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+from async_client import AsyncFingerprintClient, SensorError
+from event_log import EventLog
+from metrics import metrics
+
+# Identificação contínua sem operador (ex.: fechadura).
+#
+# O daemon fica em loop fazendo polling do sensor com GET_IMAGE (uma tentativa de
+# captura por comando, resposta NO_FINGER:POLL quando não há dedo). Parado, o intervalo
+# entre polls cresce até POLL_INTERVAL_MAX, então o processo passa quase todo o tempo
+# dormindo; depois de uma leitura o intervalo volta para POLL_INTERVAL_MIN.
+#
+# Cada decisão vira um evento (dict) entregue ao callback on_event e/ou à asyncio.Queue:
+#
+#   {'type': 'match', 'sensor_id': 12, 'confidence': 150, 'timestamp': ..., 'latency_ms': ..., ...}
+#   {'type': 'no_match', ...}   {'type': 'error', 'error': '...', ...}
+#
+# latency_ms é o tempo estimado da colocação do dedo até a decisão: o dedo foi colocado
+# em algum momento entre o último poll vazio e o poll que o detectou, e a estimativa usa
+# o meio desse intervalo (detect_window_ms diz o tamanho dele).
+#
+# Com metrics_path, as métricas por comando (metrics.py) são gravadas no formato do
+# Prometheus junto com cada resumo de latência. Com event_log (event_log.EventLog), cada
+# decisão e erro também vai para o log de eventos.
+
+POLL_INTERVAL_MIN = 0.05 # s, logo depois de uma leitura
+POLL_INTERVAL_MAX = 0.3  # s, parado há bastante tempo
+POLL_BACKOFF = 1.5       # Multiplica o intervalo a cada poll vazio
+REMOVE_POLL_INTERVAL = 0.1 # s, esperando o dedo sair antes de identificar de novo
+ERROR_RETRY_DELAY = 2.0  # s, depois de um erro do sensor/serial
+STATS_EVERY = 20         # Imprime p50/p95 da latência (e grava as métricas) a cada 20 decisões
+LATENCY_WINDOW = 1000    # p50/p95/máx das últimas 1000 decisões (o histograma do metrics.py tem o total)
+
+
+class IdentifyDaemon:
+
+    def __init__(self, client, on_event=None, queue=None, min_confidence=0, metrics_path=None, event_log=None):
+        self.client = client
+        self.on_event = on_event
+        self.queue = queue
+        self.min_confidence = min_confidence
+        self.metrics_path = metrics_path
+        self.event_log = event_log
+        self.latencies_ms = deque(maxlen=LATENCY_WINDOW)
+        self.decisions = 0
+        self._poll_interval = POLL_INTERVAL_MIN
+        self._stopped = asyncio.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _sleep(self, seconds):
+        # Dorme sem ocupar CPU, mas acorda na hora se stop() for chamado
+        try:
+            await asyncio.wait_for(self._stopped.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        last_empty_poll = time.perf_counter()
+        while not self._stopped.is_set():
+            try:
+                poll_sent = time.perf_counter()
+                if not await self.client.poll_finger():
+                    last_empty_poll = time.perf_counter()
+                    await self._sleep(self._poll_interval)
+                    self._poll_interval = min(self._poll_interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
+                    continue
+                await self._identify(last_empty_poll, poll_sent)
+                self._poll_interval = POLL_INTERVAL_MIN
+                await self._wait_finger_removed()
+                last_empty_poll = time.perf_counter()
+            except (SensorError, asyncio.TimeoutError, ConnectionError) as e:
+                await self._emit({'type': 'error', 'error': str(e) or type(e).__name__, 'timestamp': time.time()})
+                if isinstance(e, ConnectionError):
+                    raise
+                await self._sleep(ERROR_RETRY_DELAY)
+
+    async def _identify(self, last_empty_poll, poll_sent):
+        detected_at = time.perf_counter()
+        match = await self.client.identify_captured()
+        decided_at = time.perf_counter()
+        # O dedo chegou entre o último poll vazio e o envio do GET_IMAGE que o achou
+        placed_at = (last_empty_poll + poll_sent) / 2
+        latency_ms = (decided_at - placed_at) * 1000
+        event = {
+            'type': 'no_match',
+            'sensor': self.client.name,
+            'timestamp': time.time(),
+            'latency_ms': round(latency_ms, 1),
+            'decision_ms': round((decided_at - detected_at) * 1000, 1),
+            'detect_window_ms': round((poll_sent - last_empty_poll) * 1000, 1),
+        }
+        if match is not None and match[1] >= self.min_confidence:
+            event.update(type='match', sensor_id=match[0], confidence=match[1])
+        self.latencies_ms.append(latency_ms)
+        self.decisions += 1
+        metrics.record_span('daemon_placement_to_decision', latency_ms / 1000)
+        await self._emit(event)
+        if self.decisions % STATS_EVERY == 0:
+            self._print_stats()
+
+    async def _wait_finger_removed(self):
+        # Sem isso o mesmo dedo seria identificado de novo a cada poll
+        while not self._stopped.is_set() and await self.client.poll_finger():
+            await self._sleep(REMOVE_POLL_INTERVAL)
+
+    async def _emit(self, event):
+        if self.event_log is not None:
+            if event['type'] == 'match':
+                self.event_log.record('identify', 'FOUND', event['sensor_id'], event['confidence'], event['timestamp'])
+            else:
+                self.event_log.record('identify', 'NOT_FOUND' if event['type'] == 'no_match' else 'FAIL',
+                                      timestamp=event['timestamp'])
+        if self.queue is not None:
+            await self.queue.put(event)
+        if self.on_event is not None:
+            result = self.on_event(event)
+            if asyncio.iscoroutine(result):
+                await result
+
+    def latency_stats(self):
+        # (p50, p95, máx) em ms das últimas LATENCY_WINDOW decisões, ou None
+        if not self.latencies_ms:
+            return None
+        ordered = sorted(self.latencies_ms)
+        return (ordered[len(ordered) // 2], ordered[int(len(ordered) * 0.95)], ordered[-1])
+
+    def _print_stats(self):
+        p50, p95, worst = self.latency_stats()
+        print(f"Latência dedo -> decisão (últimas {len(self.latencies_ms)} de {self.decisions} leituras): "
+              f"p50 {p50:.0f} ms, p95 {p95:.0f} ms, máx {worst:.0f} ms")
+        if self.metrics_path:
+            metrics.write_prometheus(self.metrics_path)
+
+
+async def run_daemon(port, baudrate, min_confidence, metrics_path=None, event_log_dir=None):
+    client = await AsyncFingerprintClient.connect(port, baudrate) # Espera o boot da placa (DTR ao abrir)
+    print(f"Daemon de identificação em {port} (capacidade {client.capacity}). Ctrl+C para sair.")
+    event_log = EventLog(event_log_dir) if event_log_dir else None
+    daemon = IdentifyDaemon(client, on_event=lambda event: print(json.dumps(event)), min_confidence=min_confidence,
+                            metrics_path=metrics_path, event_log=event_log)
+    try:
+        await daemon.run()
+    finally:
+        if daemon.latencies_ms:
+            daemon._print_stats()
+        if event_log is not None:
+            event_log.close()
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Identificação contínua (uma linha JSON por evento)")
+    parser.add_argument('port', nargs='?', default='COM3')
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--min-confidence', type=int, default=0)
+    parser.add_argument('--metrics', help="Arquivo .prom para as métricas de latência")
+    parser.add_argument('--event-log', help="Diretório do log de eventos (ex.: event_log, o mesmo do main.py)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_daemon(args.port, args.baud, args.min_confidence, args.metrics, args.event_log))
+    except KeyboardInterrupt:
+        print("Daemon encerrado.")
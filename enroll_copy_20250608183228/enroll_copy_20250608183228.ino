@@ -28,6 +28,25 @@ const char* CMD_STORE_MODEL = "STORE_MODEL";
 const char* CMD_REMOVE_FINGER_ACK = "REMOVE_FINGER_ACK";
 const char* CMD_DOWNLOAD_TEMPLATE_B1 = "DOWNLOAD_TPL_B1";
 // const char* CMD_DOWNLOAD_TEMPLATE_B2 = "DOWNLOAD_TPL_B2";
+const char* CMD_ENROLL_AUTO = "ENROLL_AUTO";     // <ENROLL_AUTO,ID[,NOSTORE]>: cadastro inteiro sem subcomandos
+const char* CMD_IDENTIFY_AUTO = "IDENTIFY_AUTO"; // Identificação inteira sem subcomandos
+const char* AUTO_MODE_NOSTORE = "NOSTORE";       // Deixa o modelo pendente (STORE_MODEL depois)
+const char* CMD_UPLOAD_TEMPLATE_B1 = "UPLOAD_TPL_B1"; // Python -> CharBuffer1 (inverso do DOWNLOAD_TPL_B1)
+const char* CMD_SEARCH_B1 = "SEARCH_B1"; // Busca o conteúdo do CharBuffer1 no flash do sensor
+const char* CMD_STORE_B1 = "STORE_B1";   // <STORE_B1,ID>: grava o CharBuffer1 no ID (sem passar pelo ENROLL)
+const char* CMD_PING = "PING";         // <PING,TOKEN> -> <RESP:PONG:TOKEN,INIT:0|1,BAUD:N[,CAP:N]>
+const char* CMD_BAUD = "BAUD";         // <BAUD,115200>: troca a taxa da serial com o Python
+const char* CMD_BAUD_OK = "BAUD_OK";   // Python confirma que a nova taxa funciona
+const char* CMD_HEARTBEAT = "HEARTBEAT"; // <HEARTBEAT,250>: manda <RESP:HB> a cada 250 ms (0 desliga)
+const char* CMD_DELETE = "DELETE"; // <DELETE,ID>: apaga o template do ID no flash do sensor
+const char* CMD_INDEX = "INDEX";   // <INDEX,PAGINA>: tabela de ocupação de 256 IDs (32 bytes em HEX)
+const char* CMD_LOAD_B1 = "LOAD_B1"; // <LOAD_B1,ID>: carrega o template do ID no CharBuffer1 (para o DOWNLOAD_TPL_B1)
+const char* CMD_UPLOAD_TEMPLATE_B2 = "UPLOAD_TPL_B2"; // Python -> CharBuffer2 (o CharBuffer1 fica intacto, para o MATCH_B2)
+const char* CMD_MATCH_B2 = "MATCH_B2"; // Compara o CharBuffer1 com o CharBuffer2 no sensor (OK:MATCHED:PONTOS / NO_MATCH)
+const char* TPL_MODE_BIN = "BIN"; // <DOWNLOAD_TPL_B1,BIN>: transferência binária em vez de HEX
+const char* FRAMING_MODE = "FRAMED"; // <INIT_SENSOR,FRAMED>: protocolo v2 (sequência + CRC) depois do SENSOR_READY
+const char* CMD_NAK = "NAK";         // <SS:NAK,XX*CCCC>: o Python pede de novo o nosso quadro XX
+const char* IDENTIFY_MODE_HOST = "HOST"; // <IDENTIFY,HOST>: só captura o probe no CharBuffer1, a busca é no PC
 
 // Respostas do Arduino para Python
 const char* RESP_PREFIX = "RESP:"; // Este ainda é usado para construir a string de resposta
@@ -46,6 +65,7 @@ const char* RESP_ENROLL_MISMATCH = "ENROLL_MISMATCH";
 const char* RESP_BAD_LOCATION = "BAD_LOCATION";
 const char* RESP_FLASH_ERROR = "FLASH_ERROR";
 const char* RESP_NOT_FOUND = "NOT_FOUND";
+const char* RESP_NO_MATCH = "NO_MATCH";
 const char* RESP_ASK_PLACE_FINGER = "ASK_PLACE_FINGER";
 const char* RESP_ASK_REMOVE_FINGER = "ASK_REMOVE_FINGER";
 const char* RESP_ASK_PLACE_AGAIN = "ASK_PLACE_AGAIN";
@@ -53,6 +73,11 @@ const char* RESP_FINGER_REMOVED = "FINGER_REMOVED";
 const char* RESP_ID_FOUND = "ID_FOUND";
 const char* RESP_COUNT_RESULT = "COUNT_RESULT";
 const char* RESP_TIMEOUT_PY_CMD = "TIMEOUT_WAITING_FOR_CMD";
+const char* RESP_PONG = "PONG";
+const char* RESP_HEARTBEAT = "HB"; // Sem sequência nem CRC, mesmo no v2: o Python só olha se bytes estão chegando
+const char* RESP_EVENT = "EVT"; // <RESP:EVT:...>: progresso dos comandos *_AUTO
+const char* RESP_TEMPLATE_BIN = "TEMPLATE_BIN"; // <RESP:TEMPLATE_BIN:LEN> + LEN bytes crus + soma (2 bytes)
+const char* RESP_NAK = "NAK"; // Quadro do Python corrompido (v2): ele manda o mesmo comando de novo
 
 // Constantes baseadas no manual ZFM-20
 const uint8_t ZFM_PID_COMMAND = 0x01;
@@ -61,19 +86,53 @@ const uint8_t ZFM_PID_ACK = 0x07;
 const uint8_t ZFM_PID_ENDDATA = 0x08;
 const int TEMPLATE_SIZE = 512; // bytes
 const int DATA_PACKET_PAYLOAD_SIZE = 128; // bytes (conteúdo de dados por pacote)
+const uint8_t ZFM_CMD_DOWNCHAR = 0x09; // DownChar: PC -> CharBuffer (não existe na lib da Adafruit)
+const uint8_t ZFM_CMD_READ_INDEX = 0x1F; // ReadIndexTable: 1 bit por ID, 256 IDs por página (idem)
+const uint8_t ZFM_CMD_MATCH = 0x03; // Match: CharBuffer1 x CharBuffer2, devolve a pontuação (idem)
+const unsigned long DOWNLOAD_QUIET_MS = 50; // Com o próximo comando já na fila, a limpeza pós-download só espera o sensor ficar quieto isso
+const unsigned long UPLOAD_CHUNK_TIMEOUT = 1000; // ms para o Python mandar cada chunk do upload
+const unsigned long AUTO_FINGER_TIMEOUT = 15000; // ms esperando o dedo nos comandos *_AUTO (sem Enter no PC)
 int pendingEnrollID = -1; // Para armazenar o ID do usuário quando um modelo é criado mas ainda não armazenado
 
+// Taxa da serial com o Python. Começa sempre em 9600 e pode ser aumentada com <BAUD,N>.
+const long HOST_BAUD_DEFAULT = 9600;
+const unsigned long BAUD_CONFIRM_TIMEOUT = 1000; // ms para o Python confirmar a nova taxa
+long hostBaud = HOST_BAUD_DEFAULT;
+unsigned long heartbeatIntervalMs = 0; // 0 até o Python pedir <HEARTBEAT,ms>
+unsigned long lastHeartbeatAt = 0;
+
+// Protocolo v2: cada quadro vira <SS:conteúdo*CCCC>, SS = sequência (hex, uma por sentido),
+// CCCC = CRC-16/CCITT (0x1021, início 0xFFFF) de "SS:conteúdo". No TEMPLATE_BIN os 2 bytes
+// depois do bloco cru são a CRC do payload. Guardamos a última resposta e os chunks do último
+// download para reenviar só o quadro que o Python pedir (NAK), sem refazer o comando.
+const uint8_t FRAMING_V1 = 1;
+const uint8_t FRAMING_V2 = 2;
+const uint8_t MAX_TEMPLATE_CHUNKS = TEMPLATE_SIZE / 32; // Pacotes de 32 bytes no pior caso
+uint8_t framingVersion = FRAMING_V1;
+uint8_t txSeq = 0;
+int lastHostSeq = -1;
+String lastResponse = "";
+uint8_t lastResponseSeq = 0;
+String previousResponse = "";                   // Penúltima resposta (o ACK do download, antes dos chunks)
+uint8_t previousResponseSeq = 0;
+uint8_t lastTemplate[TEMPLATE_SIZE];            // Template do último download (também no v1, como buffer)
+uint8_t templateChunkSeq[MAX_TEMPLATE_CHUNKS];
+uint8_t templateChunkLen[MAX_TEMPLATE_CHUNKS];
+uint8_t templateChunkCount = 0;
+bool templateChunksBinary = false;
+
 
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(HOST_BAUD_DEFAULT);
   while (!Serial && (millis() < 3000)); 
   
   inputString.reserve(100); 
   
   Serial.println(F("Arduino: Setup básico concluído. Aguardando comando de inicialização do sensor do Python."));
+  sendResponse(RESP_ARDUINO_READY_FOR_INIT); // O Python começa o handshake assim que lê isto
 }
 
-bool initializeSensor() {
+bool initializeSensor(bool framed) {
   Serial.println(F("Arduino: Recebido comando para inicializar sensor."));
   Serial.println(F("Arduino: Chamando mySensorSerial.begin(57600)..."));
   mySensorSerial.begin(57600);
@@ -89,8 +148,7 @@ bool initializeSensor() {
         Serial.print(F("Arduino: Capacidade do sensor lida: "));
         Serial.println(finger.capacity);
         
-        String successMsg = String(RESP_SENSOR_READY) + F(",CAP:") + String(finger.capacity);
-        sendResponse(successMsg);
+        sendSensorReady(framed);
         return true;
     } else {
         Serial.print(F("Arduino: finger.getParameters() FALHOU com código: 0x"));
@@ -107,8 +165,31 @@ bool initializeSensor() {
   }
 }
 
+// SENSOR_READY do INIT_SENSOR. Também responde a um INIT_SENSOR com o sensor já
+// inicializado (Python reiniciado sem reset da placa), sem mexer no sensor.
+void sendSensorReady(bool framed) {
+  String successMsg = String(RESP_SENSOR_READY) + F(",CAP:") + String(finger.capacity);
+  if (framed) {
+    successMsg += F(",FRAMING:");
+    successMsg += String(FRAMING_V2);
+  }
+  sendResponse(successMsg); // Ainda no v1: o Python só muda depois de ler isto
+  if (framed) enableFraming();
+}
+
+// PONG com o estado da placa: o Python pula o INIT_SENSOR (e a troca de taxa) se já foram feitos
+void sendPong(const String& token) {
+  String pong = String(RESP_PONG) + F(":") + token + F(",INIT:") + String(sensorInitialized ? 1 : 0) + F(",BAUD:") + String(hostBaud);
+  if (sensorInitialized) {
+    pong += F(",CAP:");
+    pong += String(finger.capacity);
+  }
+  sendResponse(pong);
+}
+
 void loop() {
   serialEvent(); 
+  serviceHeartbeat();
 
   if (stringComplete) {
     String commandPart = inputString; // inputString é o payload
@@ -135,9 +216,16 @@ void loop() {
     // Serial.print(F("] (int: ")); Serial.print(value); Serial.println(F(")"));
 
 
-    if (!sensorInitialized) {
+    if (command.equals(CMD_PING)) {
+      sendPong(valueStr); // Responde mesmo antes do INIT_SENSOR
+    } else if (command.equals(CMD_HEARTBEAT)) {
+      heartbeatIntervalMs = value > 0 ? value : 0;
+      sendResponse(String(RESP_OK) + F(":HEARTBEAT:") + String(heartbeatIntervalMs));
+    } else if (command.equals(CMD_BAUD)) {
+      handleBaudChange(valueStr.toInt());
+    } else if (!sensorInitialized) {
       if (command.equals(CMD_INIT_SENSOR)) {
-        sensorInitialized = initializeSensor();
+        sensorInitialized = initializeSensor(valueStr.equals(FRAMING_MODE));
         if (!sensorInitialized) {
           Serial.println(F("Arduino: Falha na inicialização do sensor. Aguardando novo comando INIT_SENSOR ou reset."));
         } else {
@@ -147,18 +235,71 @@ void loop() {
         sendResponse(String(RESP_SENSOR_ERROR) + F(":NOT_INITIALIZED_YET"));
       }
     } else { 
-      if (command.equals(CMD_ENROLL)) {
+      if (command.equals(CMD_INIT_SENSOR)) {
+        sendSensorReady(valueStr.equals(FRAMING_MODE)); // Início a quente do Python
+      } else if (command.equals(CMD_ENROLL)) {
         if (value > 0 && value <= finger.capacity) {
           enrollFingerProcess(value);
         } else {
           sendResponse(String(RESP_FAIL) + F(":INVALID_ID:") + String(value) + F(",CAP:") + String(finger.capacity));
         }
+      } else if (command.equals(CMD_ENROLL_AUTO)) {
+        if (value > 0 && value <= finger.capacity) {
+          enrollAutoProcess(value, !valueStr.endsWith(AUTO_MODE_NOSTORE));
+        } else {
+          sendResponse(String(RESP_FAIL) + F(":INVALID_ID:") + String(value) + F(",CAP:") + String(finger.capacity));
+        }
+      } else if (command.equals(CMD_IDENTIFY_AUTO)) {
+        identifyAutoProcess();
       } else if (command.equals(CMD_IDENTIFY)) {
-        identifyFingerProcess();
+        identifyFingerProcess(valueStr.equals(IDENTIFY_MODE_HOST));
       } else if (command.equals(CMD_COUNT)) {
         getTemplateCount();
       } else if (command.equals(CMD_DOWNLOAD_TEMPLATE_B1)) {
-        handleTemplateDownload(0x01); // Passa o ID do buffer (0x01 para CharBuffer1)
+        handleTemplateDownload(0x01, valueStr.equals(TPL_MODE_BIN)); // Passa o ID do buffer (0x01 para CharBuffer1)
+      } else if (command.equals(CMD_UPLOAD_TEMPLATE_B1)) {
+        handleTemplateUpload(0x01);
+      } else if (command.equals(CMD_UPLOAD_TEMPLATE_B2)) {
+        handleTemplateUpload(0x02);
+      } else if (command.equals(CMD_MATCH_B2)) {
+        matchCharBuffers();
+      } else if (command.equals(CMD_SEARCH_B1)) {
+        searchCharBuffer1();
+      } else if (command.equals(CMD_STORE_B1)) {
+        if (value > 0 && value <= finger.capacity) {
+          int p = finger.storeModel(value); // Grava o CharBuffer1
+          if (p == FINGERPRINT_OK) {
+            sendResponse(String(RESP_OK) + F(":STORED:") + String(value));
+          } else {
+            handleFingerprintError(p, F("STORE_B1_FAIL"));
+          }
+        } else {
+          sendResponse(String(RESP_FAIL) + F(":INVALID_ID:") + String(value) + F(",CAP:") + String(finger.capacity));
+        }
+      } else if (command.equals(CMD_DELETE)) {
+        if (value > 0 && value <= finger.capacity) {
+          int p = finger.deleteModel(value);
+          if (p == FINGERPRINT_OK) {
+            sendResponse(String(RESP_OK) + F(":DELETED:") + String(value));
+          } else {
+            handleFingerprintError(p, F("DELETE_FAIL"));
+          }
+        } else {
+          sendResponse(String(RESP_FAIL) + F(":INVALID_ID:") + String(value) + F(",CAP:") + String(finger.capacity));
+        }
+      } else if (command.equals(CMD_LOAD_B1)) {
+        if (value > 0 && value <= finger.capacity) {
+          int p = finger.loadModel(value); // Flash -> CharBuffer1
+          if (p == FINGERPRINT_OK) {
+            sendResponse(String(RESP_OK) + F(":LOADED:") + String(value));
+          } else {
+            handleFingerprintError(p, F("LOAD_B1_FAIL"));
+          }
+        } else {
+          sendResponse(String(RESP_FAIL) + F(":INVALID_ID:") + String(value) + F(",CAP:") + String(finger.capacity));
+        }
+      } else if (command.equals(CMD_INDEX)) {
+        sendIndexTable(value);
       } else if (command.equals(CMD_STORE_MODEL)) {
         if (pendingEnrollID != -1) {
           // Serial.print(F("Arduino: Recebido comando para armazenar modelo para ID pendente: "));
@@ -173,9 +314,16 @@ void loop() {
         }else {
             sendResponse(String(RESP_FAIL) + F(":NO_PENDING_MODEL_TO_STORE"));
           }
-      }else if (command.equals(CMD_GET_IMAGE) || 
-               command.equals(CMD_IMAGE_TO_TZ1) ||
-               command.equals(CMD_IMAGE_TO_TZ2) ||
+      } else if (command.equals(CMD_GET_IMAGE)) {
+        pollFingerImage();
+      } else if (command.equals(CMD_IMAGE_TO_TZ1)) {
+        int p = finger.image2Tz(1); // Imagem do último GET_IMAGE -> CharBuffer1 (depois SEARCH_B1)
+        if (p == FINGERPRINT_OK) {
+          sendResponse(String(RESP_OK) + F(":CONVERT_DONE"));
+        } else {
+          handleFingerprintError(p, F("POLL_CONV"));
+        }
+      }else if (command.equals(CMD_IMAGE_TO_TZ2) ||
                command.equals(CMD_CREATE_MODEL) ||
                command.equals(CMD_REMOVE_FINGER_ACK) ) {
         sendResponse(String(RESP_FAIL) + F(":UNEXPECTED_SUB_COMMAND:") + command);
@@ -192,6 +340,14 @@ void loop() {
 
 // Passar por referência constante para economizar SRAM
 void sendResponse(const String& message) {
+  if (framingVersion == FRAMING_V2) {
+    previousResponse = lastResponse;
+    previousResponseSeq = lastResponseSeq;
+    lastResponse = message;
+    lastResponseSeq = nextTxSeq();
+    sendFramedResponse(lastResponseSeq, message);
+    return;
+  }
   Serial.print(START_MARKER);
   Serial.print(RESP_PREFIX); 
   Serial.print(message);      
@@ -200,6 +356,50 @@ void sendResponse(const String& message) {
   Serial.flush(); 
 }
 
+bool isSupportedHostBaud(long baud) {
+  return baud == 9600 || baud == 19200 || baud == 38400 || baud == 57600 || baud == 115200 || baud == 230400;
+}
+
+// Troca a taxa da serial com o Python. O OK sai na taxa antiga; depois disso o Python tem
+// BAUD_CONFIRM_TIMEOUT ms para mandar PING (respondido normalmente) e BAUD_OK na taxa nova.
+// Sem BAUD_OK (quadros corrompidos, taxa não suportada pelo adaptador USB...) voltamos para a taxa antiga.
+void handleBaudChange(long newBaud) {
+  if (!isSupportedHostBaud(newBaud)) {
+    sendResponse(String(RESP_FAIL) + F(":BAUD_UNSUPPORTED:") + String(newBaud));
+    return;
+  }
+  long previousBaud = hostBaud;
+  sendResponse(String(RESP_OK) + F(":BAUD:") + String(newBaud));
+  Serial.end();
+  Serial.begin(newBaud);
+  inputString = "";
+  stringComplete = false;
+
+  unsigned long startTime = millis();
+  while (millis() - startTime < BAUD_CONFIRM_TIMEOUT) {
+    serialEvent();
+    if (stringComplete) {
+      String payload = inputString;
+      inputString = "";
+      stringComplete = false;
+      int commaPos = payload.indexOf(',');
+      String cmd = (commaPos != -1) ? payload.substring(0, commaPos) : payload;
+      if (cmd.equals(CMD_PING)) {
+        sendPong((commaPos != -1) ? payload.substring(commaPos + 1) : String(""));
+      } else if (cmd.equals(CMD_BAUD_OK)) {
+        hostBaud = newBaud;
+        sendResponse(String(RESP_OK) + F(":BAUD_CONFIRMED:") + String(newBaud));
+        return;
+      }
+      // Qualquer outra coisa é lixo de uma taxa errada: ignora
+    }
+  }
+  Serial.end();
+  Serial.begin(previousBaud);
+  inputString = "";
+  stringComplete = false;
+}
+
 void serialEvent() {
   while (Serial.available()) {
     char inChar = (char)Serial.read();
@@ -208,7 +408,7 @@ void serialEvent() {
       stringComplete = false;
     } else if (inChar == END_MARKER) {
       if (inputString.length() > 0) {
-          stringComplete = true;
+          stringComplete = (framingVersion == FRAMING_V1) || acceptFrame();
       }
     } else if (inChar == '\n' || inChar == '\r') {
       // Ignora
@@ -222,6 +422,178 @@ void serialEvent() {
 }
 
 
+// --- Protocolo v2 ---
+
+uint16_t crc16Update(uint16_t crc, uint8_t data) {
+  crc ^= (uint16_t)data << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+// Imprime o texto e devolve a CRC atualizada com ele
+uint16_t printWithCrc(uint16_t crc, const char* text) {
+  while (*text) {
+    crc = crc16Update(crc, (uint8_t)*text);
+    Serial.print(*text++);
+  }
+  return crc;
+}
+
+// "<SS:" de um quadro v2; devolve a CRC até aqui
+uint16_t beginFrame(uint8_t seq) {
+  char head[4];
+  sprintf(head, "%02X:", seq);
+  Serial.print(START_MARKER);
+  return printWithCrc(0xFFFF, head);
+}
+
+// "*CCCC>" (o '\n' fica para depois do bloco cru no TEMPLATE_BIN)
+void endFrame(uint16_t crc, bool newline) {
+  char tail[6];
+  sprintf(tail, "*%04X", crc);
+  Serial.print(tail);
+  Serial.print(END_MARKER);
+  if (newline) {
+    Serial.print('\n');
+    Serial.flush();
+  }
+}
+
+uint8_t nextTxSeq() {
+  uint8_t seq = txSeq++;
+  // Número reaproveitado depois de dar a volta: os chunks antigos não podem mais ser pedidos
+  if (templateChunkCount > 0 && (uint8_t)(seq - templateChunkSeq[0]) >= 128) templateChunkCount = 0;
+  return seq;
+}
+
+void sendFramedResponse(uint8_t seq, const String& message) {
+  uint16_t crc = beginFrame(seq);
+  crc = printWithCrc(crc, RESP_PREFIX);
+  crc = printWithCrc(crc, message.c_str());
+  endFrame(crc, true);
+}
+
+void enableFraming() {
+  framingVersion = FRAMING_V2;
+  txSeq = 0;
+  lastHostSeq = -1;
+  lastResponse = "";
+  previousResponse = "";
+  templateChunkCount = 0;
+}
+
+// Chunk index do último download, do buffer lastTemplate (primeira vez ou retransmissão)
+void sendTemplateChunk(uint8_t index) {
+  uint16_t offset = 0;
+  for (uint8_t i = 0; i < index; i++) offset += templateChunkLen[i];
+  const uint8_t* data = lastTemplate + offset;
+  uint8_t length = templateChunkLen[index];
+  char number[6];
+  uint16_t crc = beginFrame(templateChunkSeq[index]);
+  crc = printWithCrc(crc, RESP_PREFIX);
+  if (templateChunksBinary) {
+    crc = printWithCrc(crc, RESP_TEMPLATE_BIN);
+    sprintf(number, ":%u", length);
+    crc = printWithCrc(crc, number);
+    endFrame(crc, false);
+    uint16_t payloadCrc = 0xFFFF;
+    for (uint8_t i = 0; i < length; i++) {
+      Serial.write(data[i]);
+      payloadCrc = crc16Update(payloadCrc, data[i]);
+    }
+    Serial.write((uint8_t)(payloadCrc >> 8));
+    Serial.write((uint8_t)(payloadCrc & 0xFF));
+    Serial.print('\n');
+    Serial.flush();
+  } else {
+    crc = printWithCrc(crc, "TEMPLATE_CHUNK:");
+    for (uint8_t i = 0; i < length; i++) {
+      sprintf(number, "%02X", data[i]);
+      crc = printWithCrc(crc, number);
+    }
+    endFrame(crc, true);
+  }
+}
+
+void retransmitFrame(uint8_t seq) {
+  if (lastResponse.length() > 0 && seq == lastResponseSeq) {
+    sendFramedResponse(seq, lastResponse);
+    return;
+  }
+  if (previousResponse.length() > 0 && seq == previousResponseSeq) {
+    sendFramedResponse(seq, previousResponse);
+    return;
+  }
+  for (uint8_t i = 0; i < templateChunkCount; i++) {
+    if (templateChunkSeq[i] == seq) {
+      sendTemplateChunk(i);
+      return;
+    }
+  }
+  // Quadro antigo demais: o Python desiste dele depois do FRAME_RETRANSMIT_TIMEOUT
+}
+
+int hexDigit(char c) {
+  if (c >= '0' && c <= '9') return c - '0';
+  if (c >= 'A' && c <= 'F') return c - 'A' + 10;
+  return -1;
+}
+
+// Lê o número hex de 'digits' dígitos em text[start]; -1 se não for hex
+long parseHex(const String& text, int start, int digits) {
+  long value = 0;
+  for (int i = start; i < start + digits; i++) {
+    int d = hexDigit(text.charAt(i));
+    if (d < 0) return -1;
+    value = value * 16 + d;
+  }
+  return value;
+}
+
+// Confere e tira o envelope "SS:...*CCCC" de inputString. Retorna false se o quadro já foi
+// tratado aqui (NAK do Python, comando repetido ou corrompido).
+bool acceptFrame() {
+  int length = inputString.length();
+  bool enveloped = length >= 8 && inputString.charAt(2) == ':' && inputString.charAt(length - 5) == '*';
+  long seq = enveloped ? parseHex(inputString, 0, 2) : -1;
+  long crc = enveloped ? parseHex(inputString, length - 4, 4) : -1;
+  uint16_t calculated = 0xFFFF;
+  for (int i = 0; enveloped && i < length - 5; i++) calculated = crc16Update(calculated, (uint8_t)inputString.charAt(i));
+
+  if (seq < 0 || crc < 0 || (uint16_t)crc != calculated) {
+    if (inputString.startsWith(CMD_INIT_SENSOR) || inputString.startsWith(CMD_PING)) {
+      framingVersion = FRAMING_V1; // Python novo falando v1 (porta reaberta sem reset da placa)
+      return true;
+    }
+    sendFramedResponse(nextTxSeq(), RESP_NAK); // Fora de lastResponse: não é uma resposta que vale reenviar
+    inputString = "";
+    return false;
+  }
+  String payload = inputString.substring(3, length - 5);
+  inputString = "";
+  if (payload.startsWith(CMD_NAK) && payload.charAt(strlen(CMD_NAK)) == ',') {
+    long requested = parseHex(payload, strlen(CMD_NAK) + 1, 2);
+    if (requested >= 0) retransmitFrame(requested);
+    return false;
+  }
+  if (seq == lastHostSeq) {
+    // O Python repetiu o comando (a resposta se perdeu): reenvia a resposta em vez de executar de novo
+    retransmitFrame(lastResponseSeq);
+    return false;
+  }
+  lastHostSeq = seq;
+  inputString = payload;
+  return true;
+}
+
+// Nas esperas longas (dedo, limpeza do download) o v2 continua atendendo os NAK do Python
+void serveRetransmissions() {
+  if (framingVersion == FRAMING_V2 && !stringComplete) serialEvent();
+}
+
+
 void getTemplateCount() {
   // Serial.println(F("Arduino: Executando getTemplateCount()..."));
   uint8_t p = finger.getTemplateCount();
@@ -245,7 +617,7 @@ void enrollFingerProcess(int id) {
   while(millis() - getImageStartTime < 7000) { 
     p = finger.getImage();
     if (p == FINGERPRINT_OK) { fingerPresent = true; break; }
-    if (p == FINGERPRINT_NOFINGER) { delay(50); } 
+    if (p == FINGERPRINT_NOFINGER) { serviceHeartbeat(); delay(50); } 
     else { handleFingerprintError(p, F("ENROLL_IMG1_ATTEMPT")); return; }
   }
   if (!fingerPresent) { sendResponse(String(RESP_NO_FINGER) + F(":ENROLL_IMG1")); return; }
@@ -271,6 +643,7 @@ void enrollFingerProcess(int id) {
         sendResponse(String(RESP_FAIL) + F(":TIMEOUT_REMOVE_FINGER"));
         return;
     }
+    serviceHeartbeat();
     delay(50); 
   }
   // Serial.println(F("Arduino (Enroll): Dedo removido."));
@@ -286,7 +659,7 @@ void enrollFingerProcess(int id) {
   while(millis() - getImageStartTime < 7000) {
     p = finger.getImage();
     if (p == FINGERPRINT_OK) { fingerPresent = true; break; }
-     if (p == FINGERPRINT_NOFINGER) { delay(50); } 
+     if (p == FINGERPRINT_NOFINGER) { serviceHeartbeat(); delay(50); } 
      else { handleFingerprintError(p, F("ENROLL_IMG2_ATTEMPT")); return; }
   }
   if (!fingerPresent) { sendResponse(String(RESP_NO_FINGER) + F(":ENROLL_IMG2")); return; }
@@ -313,7 +686,7 @@ void enrollFingerProcess(int id) {
   pendingEnrollID = id;
 }
 
-void identifyFingerProcess() {
+void identifyFingerProcess(bool hostSearch) {
   // Serial.println(F("Arduino: Iniciando processo de identificação..."));
   sendResponse(RESP_ASK_PLACE_FINGER);
 
@@ -326,7 +699,7 @@ void identifyFingerProcess() {
   while(millis() - getImageStartTime < 7000) { 
     p = finger.getImage();
     if (p == FINGERPRINT_OK) { fingerPresent = true; break; }
-    if (p == FINGERPRINT_NOFINGER) { delay(50); }
+    if (p == FINGERPRINT_NOFINGER) { serviceHeartbeat(); delay(50); }
     else { handleFingerprintError(p, F("IDENTIFY_IMG_ATTEMPT")); return; }
   }
 
@@ -341,8 +714,15 @@ void identifyFingerProcess() {
   // Serial.println(F("Arduino (Identify): Conversão OK."));
   sendResponse(String(RESP_OK) + F(":CONVERT_DONE"));
 
+  // Busca no PC: o probe fica no CharBuffer1 para o DOWNLOAD_TPL_B1
+  if (hostSearch) return;
+
+  searchCharBuffer1();
+}
+
+void searchCharBuffer1() {
   // Serial.println(F("Arduino (Identify): Procurando digital..."));
-  p = finger.fingerFastSearch(); 
+  int p = finger.fingerFastSearch(); 
   if (p == FINGERPRINT_OK) {
     // Serial.print(F("Arduino (Identify): Digital encontrada! ID: ")); Serial.print(finger.fingerID);
     // Serial.print(F(", Confiança: ")); Serial.println(finger.confidence);
@@ -355,6 +735,120 @@ void identifyFingerProcess() {
   }
 }
 
+// GET_IMAGE fora de um fluxo: uma única tentativa de captura, sem esperar o dedo.
+// Usado pelo daemon do PC para fazer polling (OK:IMAGE_TAKEN ou NO_FINGER:POLL).
+void pollFingerImage() {
+  int p = finger.getImage();
+  if (p == FINGERPRINT_OK) {
+    sendResponse(String(RESP_OK) + F(":IMAGE_TAKEN"));
+  } else if (p == FINGERPRINT_NOFINGER) {
+    sendResponse(String(RESP_NO_FINGER) + F(":POLL"));
+  } else {
+    handleFingerprintError(p, F("POLL_IMG"));
+  }
+}
+
+// <RESP:HB> a cada heartbeatIntervalMs, só entre quadros (loop() e esperas longas; nunca
+// no meio de um bloco binário). Fora de sequência: não é guardado para retransmissão.
+void serviceHeartbeat() {
+  if (heartbeatIntervalMs == 0 || millis() - lastHeartbeatAt < heartbeatIntervalMs) return;
+  lastHeartbeatAt = millis();
+  Serial.print(START_MARKER);
+  Serial.print(RESP_PREFIX);
+  Serial.print(RESP_HEARTBEAT);
+  Serial.print(END_MARKER);
+  Serial.print('\n');
+}
+
+void sendEvent(const String& event) {
+  sendResponse(String(RESP_EVENT) + F(":") + event);
+}
+
+// Espera um dedo e captura a imagem. Retorna FINGERPRINT_OK, FINGERPRINT_NOFINGER (timeout)
+// ou o erro do sensor.
+int waitForFingerImage(unsigned long timeoutMs) {
+  unsigned long startTime = millis();
+  while (millis() - startTime < timeoutMs) {
+    int p = finger.getImage();
+    if (p != FINGERPRINT_NOFINGER) return p;
+    serveRetransmissions();
+    serviceHeartbeat();
+    delay(50);
+  }
+  return FINGERPRINT_NOFINGER;
+}
+
+bool waitForFingerRemoved(unsigned long timeoutMs) {
+  unsigned long startTime = millis();
+  while (millis() - startTime < timeoutMs) {
+    if (finger.getImage() == FINGERPRINT_NOFINGER) return true;
+    serveRetransmissions();
+    serviceHeartbeat();
+    delay(50);
+  }
+  return false;
+}
+
+// Cadastro em um comando só: o Arduino avança sozinho conforme o sensor detecta o dedo
+// e manda eventos EVT: de progresso; a resposta final é OK:STORED:ID (ou OK:MODEL_PENDING:ID
+// com NOSTORE) ou a falha.
+void enrollAutoProcess(int id, bool storeAfterModel) {
+  sendEvent(RESP_ASK_PLACE_FINGER);
+  int p = waitForFingerImage(AUTO_FINGER_TIMEOUT);
+  if (p == FINGERPRINT_NOFINGER) { sendResponse(String(RESP_NO_FINGER) + F(":ENROLL_IMG1")); return; }
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("ENROLL_IMG1_ATTEMPT")); return; }
+  sendEvent(F("IMAGE1_TAKEN"));
+
+  p = finger.image2Tz(1);
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("ENROLL_CONV1")); return; }
+  sendEvent(F("CONVERT1_DONE"));
+
+  sendEvent(RESP_ASK_REMOVE_FINGER);
+  if (!waitForFingerRemoved(AUTO_FINGER_TIMEOUT)) { sendResponse(String(RESP_FAIL) + F(":TIMEOUT_REMOVE_FINGER")); return; }
+  sendEvent(RESP_FINGER_REMOVED);
+
+  sendEvent(RESP_ASK_PLACE_AGAIN);
+  p = waitForFingerImage(AUTO_FINGER_TIMEOUT);
+  if (p == FINGERPRINT_NOFINGER) { sendResponse(String(RESP_NO_FINGER) + F(":ENROLL_IMG2")); return; }
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("ENROLL_IMG2_ATTEMPT")); return; }
+  sendEvent(F("IMAGE2_TAKEN"));
+
+  p = finger.image2Tz(2);
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("ENROLL_CONV2")); return; }
+  sendEvent(F("CONVERT2_DONE"));
+
+  p = finger.createModel();
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("ENROLL_MODEL")); return; }
+  sendEvent(F("MODEL_CREATED"));
+
+  if (!storeAfterModel) {
+    pendingEnrollID = id; // Python pode baixar/conferir o modelo e mandar STORE_MODEL depois
+    sendResponse(String(RESP_OK) + F(":MODEL_PENDING:") + String(id));
+    return;
+  }
+  p = finger.storeModel(id);
+  if (p == FINGERPRINT_OK) {
+    sendResponse(String(RESP_OK) + F(":STORED:") + String(id));
+  } else {
+    handleFingerprintError(p, F("STORE_MODEL_FAIL"));
+  }
+}
+
+// Identificação em um comando só (eventos EVT: e depois ID_FOUND / NOT_FOUND / falha)
+void identifyAutoProcess() {
+  sendEvent(RESP_ASK_PLACE_FINGER);
+  int p = waitForFingerImage(AUTO_FINGER_TIMEOUT);
+  if (p == FINGERPRINT_NOFINGER) { sendResponse(String(RESP_NO_FINGER) + F(":IDENTIFY_IMG")); return; }
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("IDENTIFY_IMG_ATTEMPT")); return; }
+  sendEvent(F("IMAGE_TAKEN"));
+
+  p = finger.image2Tz(1);
+  if (p != FINGERPRINT_OK) { handleFingerprintError(p, F("IDENTIFY_CONV")); return; }
+  sendEvent(F("CONVERT_DONE"));
+
+  searchCharBuffer1();
+}
+
 // Passar expectedCommand por referência constante
 bool waitForPythonCommand(const String& expectedCommand) {
   String receivedCmdPayload = ""; 
@@ -390,6 +884,7 @@ bool waitForPythonCommand(const String& expectedCommand) {
         // Serial.print(expectedCommand); Serial.println(F("'. Continuando a esperar...")); 
       }
     }
+    serviceHeartbeat();
     delay(10); 
   }
   
@@ -674,7 +1169,7 @@ void handleTemplateDownload3(uint8_t bufferId_to_upload_from) {
 }
 
 
-void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode ser 0x01 ou 0x02
+void handleTemplateDownload(uint8_t bufferId_to_upload_from, bool binaryMode) { // bufferId pode ser 0x01 ou 0x02
     // Serial.println(F("Arduino: Solicitando upload de template do sensor..."));
 
     // 1. Enviar comando UpChar (0x08) para o sensor
@@ -687,11 +1182,21 @@ void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode
         return;
     }
     // Se chegou aqui, o sensor respondeu OK e VAI começar a enviar pacotes de dados.
-    sendResponse(String(RESP_OK) + F(":TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED"));
+    // No modo binário o ACK termina em _BIN; um Python antigo (ou um sketch antigo) continua no HEX.
+    if (binaryMode) {
+        sendResponse(String(RESP_OK) + F(":TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED_") + TPL_MODE_BIN);
+    } else {
+        sendResponse(String(RESP_OK) + F(":TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED"));
+    }
 
     uint8_t sensorPacketBuffer[DATA_PACKET_PAYLOAD_SIZE + 12]; // Suficiente para cabeçalho + payload + checksum
     int totalTemplateBytesReceived = 0;
     bool downloadError = false;
+    // v1 repassa cada byte ao Python enquanto o sensor manda; v2 guarda o template inteiro em
+    // lastTemplate e só depois manda os chunks (numerados, para poder reenviar um deles)
+    bool framed = framingVersion == FRAMING_V2;
+    templateChunkCount = 0;
+    templateChunksBinary = binaryMode;
 
   while (totalTemplateBytesReceived < TEMPLATE_SIZE && !downloadError) {
           unsigned long packetStartTime = millis();
@@ -723,18 +1228,29 @@ void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode
           }
 
           uint16_t payloadLength = packetLength - 2; // -2 para o checksum
-          if (payloadLength > DATA_PACKET_PAYLOAD_SIZE || payloadLength == 0 || payloadLength > TEMPLATE_SIZE) { // Checagem extra
+          if (payloadLength > DATA_PACKET_PAYLOAD_SIZE || payloadLength == 0 ||
+              totalTemplateBytesReceived + payloadLength > TEMPLATE_SIZE || templateChunkCount >= MAX_TEMPLATE_CHUNKS) { // Checagem extra
               sendResponse(String(RESP_FAIL) + F(":INVALID_PAYLOAD_LENGTH_") + String(payloadLength));
               downloadError = true; break;
           }
 
           // --- Etapa 2: Ler o Payload (payloadLength bytes) ---
-          Serial.print(START_MARKER); Serial.print(RESP_PREFIX);
-          Serial.print(F("TEMPLATE_CHUNK:"));
+          // Binário: <RESP:TEMPLATE_BIN:LEN> seguido de LEN bytes crus e da soma do payload (2 bytes, big-endian).
+          // HEX: <RESP:TEMPLATE_CHUNK:AABB...>, o dobro de bytes na serial.
+          if (!framed) {
+              Serial.print(START_MARKER); Serial.print(RESP_PREFIX);
+              if (binaryMode) {
+                  Serial.print(RESP_TEMPLATE_BIN); Serial.print(':');
+                  Serial.print(payloadLength); Serial.print(END_MARKER);
+              } else {
+                  Serial.print(F("TEMPLATE_CHUNK:"));
+              }
+          }
 
           uint16_t calculatedChecksum = pid + header[7] + header[8]; // Soma PID + high(len) + low(len)
+          uint16_t payloadSum = 0; // Soma só do payload, enviada ao Python no modo binário
           
-          uint8_t payloadBuffer[DATA_PACKET_PAYLOAD_SIZE]; // Temporário para debug e checksum
+          uint8_t* payloadBuffer = lastTemplate + totalTemplateBytesReceived; // Fica guardado para o v2
           bytesRead = 0;
           packetStartTime = millis(); // Resetar timeout para o payload
           while(bytesRead < payloadLength && (millis() - packetStartTime < 1000)) { // Timeout para todo o payload
@@ -742,18 +1258,38 @@ void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode
                   uint8_t templateByte = mySensorSerial.read();
                   payloadBuffer[bytesRead++] = templateByte; // Guarda para debug, se necessário
                   
-                  if (templateByte < 0x10) Serial.print('0');
-                  Serial.print(templateByte, HEX);
+                  if (framed) {
+                      // Só guarda; os chunks vão depois do último pacote
+                  } else if (binaryMode) {
+                      Serial.write(templateByte);
+                  } else {
+                      if (templateByte < 0x10) Serial.print('0');
+                      Serial.print(templateByte, HEX);
+                  }
                   calculatedChecksum += templateByte;
+                  payloadSum += templateByte;
               }
           }
-          Serial.print(END_MARKER); Serial.print('\n'); Serial.flush();
+          if (framed) {
+              // Nada foi enviado ainda
+          } else if (binaryMode) {
+              // O Python espera exatamente LEN bytes: completa com zeros se o sensor parou no meio
+              // (o FAIL abaixo avisa que o chunk não vale)
+              for (int i = bytesRead; i < payloadLength; i++) Serial.write((uint8_t)0);
+              Serial.write((uint8_t)(payloadSum >> 8));
+              Serial.write((uint8_t)(payloadSum & 0xFF));
+              Serial.print('\n'); Serial.flush();
+          } else {
+              Serial.print(END_MARKER);
+              Serial.print('\n'); Serial.flush();
+          }
 
           if (bytesRead < payloadLength) {
               sendResponse(String(RESP_FAIL) + F(":TIMEOUT_READING_PAYLOAD_DATA"));
               downloadError = true; break;
           }
           totalTemplateBytesReceived += payloadLength;
+          templateChunkLen[templateChunkCount++] = payloadLength;
 
           // --- Etapa 3: Ler o Checksum do Sensor (2 bytes) ---
           uint8_t checksumBytes[2];
@@ -777,7 +1313,7 @@ void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode
           debugMsg += String(F(",PktL(raw)=0x")) + String(packetLength, HEX);
           debugMsg += String(F(",CalcSum=0x") )+ String(calculatedChecksum, HEX);
           debugMsg += String(F(",SensSum=0x")) + String(sensorChecksum, HEX);
-          sendResponse(debugMsg); 
+          if (!framed) sendResponse(debugMsg); // No v2 o Python não precisa (e seria um quadro a mais para proteger)
           // --- FIM DEBUG ---
 
           if (calculatedChecksum != sensorChecksum) {
@@ -792,6 +1328,12 @@ void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode
       } // Fim do while (totalTemplateBytesReceived < TEMPLATE_SIZE && !downloadError)
 
     if (!downloadError && totalTemplateBytesReceived == TEMPLATE_SIZE) {
+        if (framed) {
+            for (uint8_t i = 0; i < templateChunkCount; i++) {
+                templateChunkSeq[i] = nextTxSeq();
+                sendTemplateChunk(i);
+            }
+        }
         sendResponse(String(RESP_OK) + F(":TEMPLATE_DOWNLOAD_COMPLETE:") + String(totalTemplateBytesReceived));
     } else if (!downloadError && totalTemplateBytesReceived != TEMPLATE_SIZE && totalTemplateBytesReceived > 0) {
         // Chegou aqui se o loop terminou por timeout/condição antes de receber todos os bytes,
@@ -806,14 +1348,129 @@ void handleTemplateDownload(uint8_t bufferId_to_upload_from) { // bufferId pode
     }
 
     unsigned long finalCleanupStartTime = millis();
+    unsigned long lastSensorByteTime = finalCleanupStartTime;
     while (millis() - finalCleanupStartTime < 500) { // Dê 500ms para o sensor "calar a boca"
       if (mySensorSerial.available()) {
           mySensorSerial.read(); // Descarta
+          lastSensorByteTime = millis();
       }
+      serveRetransmissions(); // v2: chunks pedidos de novo saem já, sem esperar a limpeza
+      serviceHeartbeat();
+      // Exportação em lote: o Python já mandou o próximo comando (LOAD_B1), então basta o
+      // sensor estar quieto. No v1 o comando ainda está no buffer da serial, não no inputString.
+      if ((stringComplete || (!framed && Serial.available())) && millis() - lastSensorByteTime >= DOWNLOAD_QUIET_MS) break;
       delay(10); // Pequenas pausas para não bloquear totalmente
     }
-    inputString = "";
-    stringComplete = false;
+    if (!framed) {
+      inputString = "";
+      stringComplete = false;
+    }
     Serial.flush();
 
 }
+
+
+// Monta um pacote de dados do sensor (EF01, endereço, PID, tamanho, payload, checksum)
+void writeSensorDataPacket(uint8_t pid, const uint8_t* payload, uint16_t payloadLength) {
+    uint16_t packetLength = payloadLength + 2; // + checksum
+    uint16_t checksum = pid + (packetLength >> 8) + (packetLength & 0xFF);
+    mySensorSerial.write((uint8_t)(FINGERPRINT_STARTCODE >> 8));
+    mySensorSerial.write((uint8_t)(FINGERPRINT_STARTCODE & 0xFF));
+    for (int i = 0; i < 4; i++) mySensorSerial.write((uint8_t)0xFF); // Endereço padrão
+    mySensorSerial.write(pid);
+    mySensorSerial.write((uint8_t)(packetLength >> 8));
+    mySensorSerial.write((uint8_t)(packetLength & 0xFF));
+    for (int i = 0; i < payloadLength; i++) {
+        mySensorSerial.write(payload[i]);
+        checksum += payload[i];
+    }
+    mySensorSerial.write((uint8_t)(checksum >> 8));
+    mySensorSerial.write((uint8_t)(checksum & 0xFF));
+}
+
+// Tabela de ocupação do flash do sensor (ReadIndexTable): bit i do byte j = ID página*256 + j*8 + i.
+// Responde OK:INDEX:PAGINA:HEX (32 bytes); o Python a usa para reconciliar o mapa local de IDs.
+void sendIndexTable(int page) {
+  if (page < 0 || page > 3) {
+    sendResponse(String(RESP_FAIL) + F(":INVALID_PAGE:") + String(page));
+    return;
+  }
+  uint8_t cmd[2] = {ZFM_CMD_READ_INDEX, (uint8_t)page};
+  Adafruit_Fingerprint_Packet packet(FINGERPRINT_COMMANDPACKET, sizeof(cmd), cmd);
+  finger.writeStructuredPacket(packet);
+  if (finger.getStructuredPacket(&packet) != FINGERPRINT_OK || packet.type != FINGERPRINT_ACKPACKET) {
+    sendResponse(String(RESP_FAIL) + F(":INDEX_NO_ACK"));
+    return;
+  }
+  if (packet.data[0] != FINGERPRINT_OK) {
+    handleFingerprintError(packet.data[0], F("INDEX_CMD"));
+    return;
+  }
+  String message = String(RESP_OK) + F(":INDEX:") + String(page) + F(":");
+  char number[3];
+  for (int i = 1; i <= 32; i++) {
+    sprintf(number, "%02X", packet.data[i]);
+    message += number;
+  }
+  sendResponse(message);
+}
+
+// Compara o CharBuffer1 (probe do IDENTIFY,HOST ou modelo pendente do cadastro) com o
+// CharBuffer2 (template do PC mandado pelo UPLOAD_TPL_B2): o Python confirma no sensor os
+// candidatos da busca no banco do PC antes de dar o resultado.
+void matchCharBuffers() {
+  uint8_t cmd[1] = {ZFM_CMD_MATCH};
+  Adafruit_Fingerprint_Packet packet(FINGERPRINT_COMMANDPACKET, sizeof(cmd), cmd);
+  finger.writeStructuredPacket(packet);
+  if (finger.getStructuredPacket(&packet) != FINGERPRINT_OK || packet.type != FINGERPRINT_ACKPACKET) {
+    sendResponse(String(RESP_FAIL) + F(":MATCH_NO_ACK"));
+    return;
+  }
+  if (packet.data[0] == FINGERPRINT_OK) {
+    uint16_t score = ((uint16_t)packet.data[1] << 8) | packet.data[2];
+    sendResponse(String(RESP_OK) + F(":MATCHED:") + String(score));
+  } else if (packet.data[0] == FINGERPRINT_NOMATCH) {
+    sendResponse(RESP_NO_MATCH);
+  } else {
+    handleFingerprintError(packet.data[0], F("MATCH_CMD"));
+  }
+}
+
+// Upload de um template do Python para o CharBuffer (DownChar).
+// Depois do OK:UPLOAD_READY o Python manda, para cada pacote, DATA_PACKET_PAYLOAD_SIZE bytes crus
+// + soma do payload (2 bytes, big-endian), e espera OK:UPLOAD_CHUNK_ACK antes do próximo.
+void handleTemplateUpload(uint8_t bufferId_to_download_to) {
+    uint8_t cmd[2] = {ZFM_CMD_DOWNCHAR, bufferId_to_download_to};
+    Adafruit_Fingerprint_Packet packet(FINGERPRINT_COMMANDPACKET, sizeof(cmd), cmd);
+    finger.writeStructuredPacket(packet);
+    if (finger.getStructuredPacket(&packet) != FINGERPRINT_OK || packet.type != FINGERPRINT_ACKPACKET) {
+        sendResponse(String(RESP_FAIL) + F(":DOWNCHAR_NO_ACK"));
+        return;
+    }
+    if (packet.data[0] != FINGERPRINT_OK) {
+        handleFingerprintError(packet.data[0], F("DOWNCHAR_CMD"));
+        return;
+    }
+    sendResponse(String(RESP_OK) + F(":UPLOAD_READY"));
+
+    uint8_t payloadBuffer[DATA_PACKET_PAYLOAD_SIZE];
+    uint8_t sumBytes[2];
+    Serial.setTimeout(UPLOAD_CHUNK_TIMEOUT);
+    for (int offset = 0; offset < TEMPLATE_SIZE; offset += DATA_PACKET_PAYLOAD_SIZE) {
+        if (Serial.readBytes(payloadBuffer, DATA_PACKET_PAYLOAD_SIZE) != (size_t)DATA_PACKET_PAYLOAD_SIZE ||
+            Serial.readBytes(sumBytes, 2) != 2) {
+            sendResponse(String(RESP_FAIL) + F(":") + RESP_TIMEOUT_PY_CMD + F(":UPLOAD_CHUNK"));
+            return;
+        }
+        uint16_t payloadSum = 0;
+        for (int i = 0; i < DATA_PACKET_PAYLOAD_SIZE; i++) payloadSum += payloadBuffer[i];
+        if (payloadSum != (uint16_t)((sumBytes[0] << 8) | sumBytes[1])) {
+            sendResponse(String(RESP_FAIL) + F(":UPLOAD_CHUNK_CHECKSUM_MISMATCH:") + String(offset));
+            return;
+        }
+        bool lastPacket = offset + DATA_PACKET_PAYLOAD_SIZE >= TEMPLATE_SIZE;
+        writeSensorDataPacket(lastPacket ? ZFM_PID_ENDDATA : ZFM_PID_DATA, payloadBuffer, DATA_PACKET_PAYLOAD_SIZE);
+        sendResponse(String(RESP_OK) + F(":UPLOAD_CHUNK_ACK:") + String(offset + DATA_PACKET_PAYLOAD_SIZE));
+    }
+    sendResponse(String(RESP_OK) + F(":TEMPLATE_UPLOAD_COMPLETE:") + String(TEMPLATE_SIZE));
+}
@@ -0,0 +1,375 @@
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# Log append-only dos resultados de identificação e cadastro, para consultas como "quem
+# entrou entre T1 e T2" ou "todos os eventos do ID 42".
+#
+#   event_log/2026-10-17/<timestamp do 1º evento em µs>-<pid>-<seq>.evl
+#
+# Partições por dia (UTC), cada uma com segmentos imutáveis. Um segmento é colunar:
+#
+#   cabeçalho (32 bytes)  magic, eventos, IDs distintos, timestamp mínimo e máximo
+#   timestamp  float64    em ordem crescente
+#   user_id    int32      -1 = sem ID (NOT_FOUND, NO_FINGER...)
+#   confidence uint16     do sensor (no modo host, score x 1000)
+#   kind       uint8      índice em KINDS
+#   outcome    uint8      índice em OUTCOMES
+#   ids        int32      IDs distintos, em ordem
+#   starts     uint32     (IDs + 1) posições em postings
+#   postings   uint32     linhas de cada ID, agrupadas por ID (as do ID ids[i] estão em starts[i]:starts[i+1])
+#
+# Tudo na ordem de bytes nativa (como o templates.idx do template_store.py).
+#
+# record() só acrescenta o evento nas colunas em memória (alguns µs); uma thread grava um
+# segmento a cada FLUSH_INTERVAL segundos ou FLUSH_EVENTS eventos. Eventos ainda em memória
+# aparecem nas consultas, mas se perdem se o processo morrer antes da gravação.
+#
+# Em memória fica só um índice pequeno por segmento (intervalo de tempo e a tabela
+# ids/starts). Uma consulta por tempo pula as partições e segmentos fora do intervalo e acha
+# as linhas com busca binária na coluna de timestamps; uma por ID pula os segmentos sem o ID
+# e lê só as linhas dele. Os arquivos são lidos por mmap, só nas linhas que interessam.
+#
+# Segmentos pequenos (menos de FLUSH_EVENTS eventos, o normal numa porta com pouco
+# movimento) gravados por este processo são fundidos em um quando chegam a
+# COMPACT_SEGMENTS na mesma partição. Outro processo lendo no mesmo instante pode ver os
+# eventos fundidos em dobro até os segmentos antigos serem apagados, logo em seguida.
+
+KINDS = ('identify', 'enroll', 'identify_host')
+OUTCOMES = ('FOUND', 'NOT_FOUND', 'NO_FINGER', 'FAIL', 'STORED', 'MISMATCH', 'DUPLICATE')
+NO_ID = -1
+FLUSH_EVENTS = 8192
+FLUSH_INTERVAL = 5.0 # s
+COMPACT_SEGMENTS = 32
+PARTITION_SECONDS = 86400
+SEGMENT_SUFFIX = '.evl'
+
+_MAGIC = b'EVL1'
+_HEADER = struct.Struct('=4sIIIdd') # magic, eventos, IDs distintos, reservado, ts mínimo, ts máximo
+_COLUMNS = (('timestamp', 'd'), ('user_id', 'i'), ('confidence', 'H'), ('kind', 'B'), ('outcome', 'B'))
+_ROW_SIZE = sum(struct.calcsize(code) for _, code in _COLUMNS) # 16 bytes; mantém os blocos seguintes alinhados
+_KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+_OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+Event = namedtuple('Event', 'timestamp user_id confidence kind outcome')
+
+
+def partition_name(timestamp):
+    return datetime.fromtimestamp(timestamp - timestamp % PARTITION_SECONDS, timezone.utc).strftime('%Y-%m-%d')
+
+
+def partition_start(name):
+    # Início (epoch) da partição, ou None se o nome não é de uma partição
+    try:
+        return datetime.strptime(name, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def _new_columns():
+    return [array(code) for _, code in _COLUMNS]
+
+
+class _Segment:
+    # Índice em memória de um segmento; as colunas ficam no arquivo
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, self.count, distinct, _, self.min_ts, self.max_ts = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} não é um segmento do event log")
+            f.seek(self._ids_offset())
+            ids = array('i', f.read(4 * distinct))
+            starts = array('I', f.read(4 * (distinct + 1)))
+        self.ids = {user_id: (starts[i], starts[i + 1]) for i, user_id in enumerate(ids)}
+        self._offsets = []
+        offset = _HEADER.size
+        for _, code in _COLUMNS:
+            self._offsets.append(offset)
+            offset += struct.calcsize(code) * self.count
+
+    def _ids_offset(self):
+        return _HEADER.size + _ROW_SIZE * self.count
+
+    def between(self, start, end):
+        # Eventos com start <= timestamp < end
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            timestamps = _ColumnView(mm, self._offsets[0], 'd', self.count)
+            first = bisect.bisect_left(timestamps, start)
+            last = bisect.bisect_left(timestamps, end, first)
+            columns = [array(code, mm[offset + first * size:offset + last * size])
+                       for offset, (_, code), size in zip(self._offsets, _COLUMNS, _column_sizes())]
+        return _events(columns)
+
+    def for_id(self, user_id):
+        first, last = self.ids.get(user_id, (0, 0))
+        if first == last:
+            return []
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            postings_offset = self._ids_offset() + 4 * (2 * len(self.ids) + 1)
+            rows = array('I', mm[postings_offset + 4 * first:postings_offset + 4 * last])
+            columns = [array(code, b''.join(mm[offset + row * size:offset + (row + 1) * size] for row in rows))
+                       for offset, (_, code), size in zip(self._offsets, _COLUMNS, _column_sizes())]
+        return _events(columns)
+
+    def read_all(self):
+        with open(self.path, 'rb') as f:
+            f.seek(_HEADER.size)
+            return [array(code, f.read(struct.calcsize(code) * self.count)) for _, code in _COLUMNS]
+
+
+class _ColumnView:
+    # Sequência sobre uma coluna do mmap, para o bisect sem copiar a coluna
+
+    def __init__(self, mm, offset, code, count):
+        self._mm = mm
+        self._offset = offset
+        self._struct = struct.Struct(code)
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, row):
+        return self._struct.unpack_from(self._mm, self._offset + row * self._struct.size)[0]
+
+
+def _column_sizes():
+    return [struct.calcsize(code) for _, code in _COLUMNS]
+
+
+def _events(columns):
+    timestamps, user_ids, confidences, kinds, outcomes = columns
+    return [Event(timestamp, user_id, confidence, KINDS[kind], OUTCOMES[outcome])
+            for timestamp, user_id, confidence, kind, outcome in zip(timestamps, user_ids, confidences, kinds, outcomes)]
+
+
+class EventLog:
+
+    def __init__(self, directory, flush_events=FLUSH_EVENTS, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock() # Protege o buffer (record() só espera por ele)
+        self._flush_lock = threading.RLock() # Gravação de segmentos e consultas
+        self._buffer = _new_columns()
+        self._segments = {} # partição -> {caminho: _Segment}
+        self._scanned = {} # partição -> mtime do diretório na última listagem
+        self._small = {} # partição -> segmentos pequenos gravados por este processo
+        self._seq = 0
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name='event-log-flush', daemon=True)
+        self._flusher.start()
+
+    def record(self, kind, outcome, user_id=NO_ID, confidence=0, timestamp=None):
+        # Caminho quente: só acrescenta nas colunas em memória
+        timestamp = time.time() if timestamp is None else timestamp
+        kind_code = _KIND_CODES[kind]
+        outcome_code = _OUTCOME_CODES[outcome]
+        confidence = min(max(int(confidence), 0), 0xFFFF)
+        with self._lock:
+            timestamps, user_ids, confidences, kinds, outcomes = self._buffer
+            timestamps.append(timestamp)
+            user_ids.append(user_id)
+            confidences.append(confidence)
+            kinds.append(kind_code)
+            outcomes.append(outcome_code)
+            if len(timestamps) >= self.flush_events:
+                self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                columns, self._buffer = self._buffer, _new_columns()
+            if not columns[0]:
+                return
+            # Um segmento por partição, com as linhas em ordem de tempo
+            by_partition = {}
+            for row in sorted(range(len(columns[0])), key=columns[0].__getitem__):
+                by_partition.setdefault(partition_name(columns[0][row]), []).append(row)
+            for partition, rows in by_partition.items():
+                self._write_segment(partition, [array(column.typecode, (column[row] for row in rows)) for column in columns])
+
+    def _write_segment(self, partition, columns, merged=()):
+        timestamps, user_ids = columns[0], columns[1]
+        count = len(timestamps)
+        postings = array('I', sorted(range(count), key=user_ids.__getitem__)) # Estável: linhas em ordem dentro do ID
+        ids, starts = array('i'), array('I')
+        for position, row in enumerate(postings):
+            if not ids or user_ids[row] != ids[-1]:
+                ids.append(user_ids[row])
+                starts.append(position)
+        starts.append(count)
+
+        directory = os.path.join(self.directory, partition)
+        os.makedirs(directory, exist_ok=True)
+        self._seq += 1
+        path = os.path.join(directory, f"{int(timestamps[0] * 1e6):016d}-{os.getpid()}-{self._seq}{SEGMENT_SUFFIX}")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, count, len(ids), 0, timestamps[0], timestamps[-1]))
+            for column in columns:
+                f.write(column.tobytes())
+            f.write(ids.tobytes())
+            f.write(starts.tobytes())
+            f.write(postings.tobytes())
+        os.replace(tmp_path, path)
+
+        segments = self._segments.setdefault(partition, {})
+        segments[path] = _Segment(path)
+        for old_path in merged:
+            os.remove(old_path)
+            segments.pop(old_path, None)
+        if count < self.flush_events:
+            small = self._small.setdefault(partition, [])
+            small.append(path)
+            if len(small) >= COMPACT_SEGMENTS:
+                self._small[partition] = []
+                self._merge(partition, small)
+
+    def _merge(self, partition, paths):
+        # Funde segmentos da mesma partição num só (as linhas continuam em ordem de tempo)
+        columns = _new_columns()
+        for path in paths:
+            for column, part in zip(columns, self._segments[partition][path].read_all()):
+                column.extend(part)
+        rows = sorted(range(len(columns[0])), key=columns[0].__getitem__)
+        self._write_segment(partition, [array(column.typecode, (column[row] for row in rows)) for column in columns], paths)
+
+    def _partitions(self, start, end):
+        names = []
+        for name in os.listdir(self.directory):
+            first = partition_start(name)
+            if first is not None and first < end and first + PARTITION_SECONDS > start:
+                names.append(name)
+        return sorted(names)
+
+    def _segments_of(self, partition):
+        # Relista o diretório só se ele mudou (segmentos de outros processos, fusões)
+        directory = os.path.join(self.directory, partition)
+        mtime = os.stat(directory).st_mtime_ns
+        segments = self._segments.setdefault(partition, {})
+        if self._scanned.get(partition) != mtime:
+            paths = {os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)}
+            for path in set(segments) - paths:
+                del segments[path]
+            for path in paths - set(segments):
+                try:
+                    segments[path] = _Segment(path)
+                except (OSError, ValueError, struct.error):
+                    continue # Apagado por uma fusão no meio da listagem, ou ilegível
+            self._scanned[partition] = mtime
+        return list(segments.values())
+
+    def _buffered(self):
+        with self._lock:
+            return _events([array(column.typecode, column) for column in self._buffer])
+
+    def between(self, start, end, outcome=None, kind=None):
+        # Eventos com start <= timestamp < end, em ordem de tempo
+        events = []
+        with self._flush_lock:
+            for partition in self._partitions(start, end):
+                for segment in self._segments_of(partition):
+                    if segment.max_ts >= start and segment.min_ts < end:
+                        events.extend(segment.between(start, end))
+            events.extend(event for event in self._buffered() if start <= event.timestamp < end)
+        return _filtered(events, outcome, kind)
+
+    def for_id(self, user_id, start=0.0, end=float('inf'), outcome=None, kind=None):
+        # Eventos de um ID (opcionalmente só entre start e end), em ordem de tempo
+        events = []
+        with self._flush_lock:
+            for partition in self._partitions(start, end):
+                for segment in self._segments_of(partition):
+                    if user_id in segment.ids and segment.max_ts >= start and segment.min_ts < end:
+                        events.extend(event for event in segment.for_id(user_id) if start <= event.timestamp < end)
+            events.extend(event for event in self._buffered()
+                          if event.user_id == user_id and start <= event.timestamp < end)
+        return _filtered(events, outcome, kind)
+
+    def entered(self, start, end):
+        # IDs identificados pelo sensor entre start e end, com o horário da primeira identificação
+        first_seen = {}
+        for event in self.between(start, end, outcome='FOUND', kind='identify'):
+            first_seen.setdefault(event.user_id, event.timestamp)
+        return first_seen
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+
+
+def _filtered(events, outcome, kind):
+    if outcome is not None:
+        events = [event for event in events if event.outcome == outcome]
+    if kind is not None:
+        events = [event for event in events if event.kind == kind]
+    events.sort(key=lambda event: event.timestamp)
+    return events
+
+
+def _parse_time(text):
+    # "2026-10-17 08:00" (horário local) ou segundos desde a época
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def _print_events(events):
+    for event in events:
+        when = datetime.fromtimestamp(event.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        user = event.user_id if event.user_id != NO_ID else '-'
+        print(f"{when}  {event.kind:<13} {event.outcome:<10} ID {user:<5} confiança {event.confidence}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Consultas no log de identificações e cadastros")
+    parser.add_argument('--dir', default='event_log') # Mesmo EVENT_LOG_DIR do main.py
+    commands = parser.add_subparsers(dest='command', required=True)
+    between_parser = commands.add_parser('between', help="eventos entre dois horários")
+    between_parser.add_argument('start')
+    between_parser.add_argument('end')
+    between_parser.add_argument('--outcome', choices=OUTCOMES)
+    entered_parser = commands.add_parser('entered', help="IDs identificados entre dois horários")
+    entered_parser.add_argument('start')
+    entered_parser.add_argument('end')
+    id_parser = commands.add_parser('id', help="eventos de um ID")
+    id_parser.add_argument('user_id', type=int)
+    args = parser.parse_args()
+
+    log = EventLog(args.dir)
+    t0 = time.perf_counter()
+    if args.command == 'between':
+        result = log.between(_parse_time(args.start), _parse_time(args.end), outcome=args.outcome)
+    elif args.command == 'entered':
+        result = log.entered(_parse_time(args.start), _parse_time(args.end))
+    else:
+        result = log.for_id(args.user_id)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if args.command == 'entered':
+        for user_id, timestamp in sorted(result.items(), key=lambda item: item[1]):
+            print(f"{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}  ID {user_id}")
+    else:
+        _print_events(result)
+    print(f"{len(result)} resultados em {elapsed_ms:.1f} ms")
+    log.close()
@@ -0,0 +1,708 @@
+import asyncio
+import os
+import random
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+from protocol import *
+
+# Arduino falso: faz o papel do sketch (enroll_copy_20250608183228.ino) numa pty, para
+# rodar o main.py, o cliente asyncio e os benchmarks sem placa nem sensor.
+#
+#   fake = FakeArduino()
+#   fake.start()
+#   main.SERIAL_PORT = fake.port   # /dev/pts/N
+#
+# Fala o mesmo protocolo <...>/<RESP:...> do sketch, com os mesmos fluxos passo a passo
+# (waitForPythonCommand), os comandos *_AUTO, PING/BAUD, downloads em HEX e binário,
+# upload de templates (CharBuffer1 e CharBuffer2), MATCH_B2, o protocolo v2 (sequência + CRC, NAK/retransmissão), o heartbeat
+# (<HEARTBEAT,ms>, de uma thread própria), DELETE e a tabela de ocupação (INDEX).
+# O sensor é simulado:
+#   - tempos de cada operação do sensor (delays, multiplicados por time_scale)
+#   - vazão da serial com o PC conforme a taxa atual (10 bits por byte)
+#   - ruído: cada byte enviado ao PC tem probabilidade noise_rate de ter um bit trocado
+#   - dedos: cada "dedo" é um número; o template dele é determinístico (template_for).
+#     Com auto_finger=True o dedo aparece sempre que o sketch espera um e sai quando ele
+#     espera a remoção; senão use place_finger()/remove_finger().
+#   - falhas do link: hung=True trava o "sketch" (não lê comandos nem manda heartbeat);
+#     reset() volta ao estado do setup(), como a placa reiniciada ao reabrir a porta
+#
+# Só funciona onde existe pty (Linux, macOS).
+
+DEFAULT_DELAYS = {
+    'init': 0.2,              # verifyPassword + getParameters
+    'get_image': 0.15,
+    'image2tz': 0.25,
+    'create_model': 0.1,
+    'store': 0.05,
+    'search': 0.3,
+    'match': 0.05,
+    'count': 0.02,
+    'template_packet': 0.025, # Um pacote de 128 bytes do sensor a 57600 bps
+    'download_cleanup': 0.5,  # O sketch espera 500 ms o sensor "calar a boca" depois do download...
+    'download_quiet': 0.05,   # ...ou só 50 ms se o próximo comando já estiver na fila (DOWNLOAD_QUIET_MS)
+    'load': 0.05,             # LoadChar: flash -> CharBuffer
+    'baud_switch': 0.005,
+}
+DEFAULT_CAPACITY = 127
+WAIT_COMMAND_TIMEOUT = 10.0 # waitForPythonCommand
+FINGER_WAIT_TIMEOUT = 7.0   # Espera pelo dedo nos fluxos passo a passo
+AUTO_FINGER_TIMEOUT = 15.0
+BAUD_CONFIRM_TIMEOUT = 1.0
+UPLOAD_CHUNK_TIMEOUT = 1.0
+SUPPORTED_BAUDS = (9600, 19200, 38400, 57600, 115200, 230400)
+MAX_INPUT_LENGTH = 98 # inputString do sketch
+MATCH_CONFIDENCE = 150
+_START_BYTE = START_MARKER.encode('ascii')
+_END_BYTE = END_MARKER.encode('ascii')
+_BOOT_MESSAGE = b"Arduino: Setup basico concluido. Aguardando comando de inicializacao do sensor do Python.\r\n"
+
+
+def template_for(finger_id):
+    # Template (TEMPLATE_SIZE bytes) que o sensor falso gera para um dedo
+    return random.Random(finger_id).randbytes(TEMPLATE_SIZE)
+
+
+class FakeArduino:
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, delays=None, time_scale=1.0, noise_rate=0.0,
+                 max_baud=230400, command_latency=0.0, auto_finger=True, finger=1, seed=0):
+        self.capacity = capacity
+        self.delays = {**DEFAULT_DELAYS, **(delays or {})}
+        self.time_scale = time_scale
+        self.noise_rate = noise_rate
+        self.max_baud = max_baud # Acima disso o "adaptador" corrompe tudo (BAUD volta sozinho)
+        self.command_latency = command_latency # Ida e volta do link USB, somada a cada comando recebido
+        self.auto_finger = auto_finger
+        self.finger = finger # Dedo que está (ou vai estar) no sensor
+        self.finger_present = auto_finger
+        self.library = {}    # Flash do sensor: slot -> template
+        self.char_buffers = {1: None, 2: None}
+        self.image = None    # Dedo da última imagem capturada
+        self.baud = 9600
+        self.sensor_initialized = False
+        self.pending_enroll_id = -1
+        self.commands_received = 0
+        self.bytes_sent = 0
+        self.framing = 1 # 2 depois de um <INIT_SENSOR,FRAMED>
+        self.retransmissions = 0
+        self._tx_seq = 0
+        self._last_host_seq = None
+        self._recent_responses = deque(maxlen=2) # (seq, mensagem): o que dá para reenviar além dos chunks
+        self._template_chunks = {} # seq -> (binário?, payload) do último download (v2)
+        self._pending_command = None # Comando que chegou durante a limpeza do download (v2)
+        self.heartbeat_interval = 0.0 # s; ligado pelo <HEARTBEAT,ms>
+        self.hung = False
+        self._random = random.Random(seed)
+        self._rx = bytearray()
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._heartbeat_thread = None
+        self._write_lock = threading.Lock() # O heartbeat só sai entre dois envios inteiros, como no sketch
+        self._stopped = threading.Event()
+        self.port = None
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave) # Sem eco nem tradução de \n: bytes passam como numa serial
+        self.port = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._run, name='fake-arduino', daemon=True)
+        self._thread.start()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='fake-arduino-hb', daemon=True)
+        self._heartbeat_thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for thread in (self._thread, self._heartbeat_thread):
+            if thread:
+                thread.join(timeout=2)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    async def open_streams(self):
+        # (StreamReader, StreamWriter) sobre a pty, para o AsyncFingerprintClient sem o pyserial-asyncio
+        loop = asyncio.get_running_loop()
+        fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', buffering=0))
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                            os.fdopen(os.dup(fd), 'wb', buffering=0))
+        return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Dedos ---
+
+    def place_finger(self, finger=None):
+        if finger is not None:
+            self.finger = finger
+        self.finger_present = True
+
+    def remove_finger(self):
+        self.finger_present = False
+
+    # --- Serial ---
+
+    def _sleep(self, key):
+        time.sleep(self.delays[key] * self.time_scale)
+
+    def _write(self, data, busy_time=0.0):
+        # Envia respeitando a taxa atual; busy_time é o tempo do sensor que corre em paralelo
+        with self._write_lock:
+            if self.noise_rate:
+                data = bytearray(data)
+                for i in range(len(data)):
+                    if self._random.random() < self.noise_rate:
+                        data[i] ^= 1 << self._random.randrange(8)
+            time.sleep(max(len(data) * 10 / self.baud, busy_time))
+            os.write(self._master, data)
+            self.bytes_sent += len(data)
+
+    def _heartbeat_loop(self):
+        heartbeat = f"{START_MARKER}{RESP_PREFIX}{RESP_HEARTBEAT}{END_MARKER}\n".encode('ascii')
+        while not self._stopped.is_set():
+            interval = self.heartbeat_interval
+            time.sleep(interval or 0.05)
+            if interval and not self.hung and not self._stopped.is_set():
+                self._write(heartbeat)
+
+    def reset(self):
+        # Placa reiniciada (DTR ao reabrir a porta, cabo recolocado): estado do setup(); o flash do sensor fica
+        self.sensor_initialized = False
+        self.pending_enroll_id = -1
+        self.baud = 9600
+        self.framing = 1
+        self.heartbeat_interval = 0.0
+        self._pending_command = None
+        self._rx.clear()
+        self.hung = False
+        self._boot()
+
+    def _boot(self):
+        # Fim do setup() do sketch
+        self._write(_BOOT_MESSAGE)
+        self.send_response(RESP_ARDUINO_READY_FOR_INIT)
+
+    def _frame_bytes(self, seq, payload):
+        if self.framing == FRAMING_VERSION:
+            payload = encode_frame(seq, payload)
+        return f"{START_MARKER}{payload}{END_MARKER}".encode('utf-8')
+
+    def _next_seq(self):
+        seq = self._tx_seq
+        self._tx_seq = (seq + 1) % FRAME_SEQ_MODULO
+        self._template_chunks.pop(seq, None) # Número reaproveitado: o chunk antigo não vale mais
+        return seq
+
+    def send_response(self, message):
+        seq = self._next_seq() if self.framing == FRAMING_VERSION else None
+        self._recent_responses.append((seq, message))
+        self._write(self._frame_bytes(seq, f"{RESP_PREFIX}{message}") + b'\n')
+
+    def send_event(self, event):
+        self.send_response(f"{RESP_EVENT}:{event}")
+
+    def _fill(self, timeout):
+        # Espera bytes do PC por até timeout segundos; False se nada chegou
+        readable, _, _ = select.select([self._master], [], [], max(timeout, 0))
+        if not readable:
+            return False
+        try:
+            self._rx += os.read(self._master, 4096)
+        except OSError:
+            return False
+        return True
+
+    def read_command(self, timeout):
+        # Próximo <...> do PC, com as mesmas regras do serialEvent() do sketch, ou None
+        deadline = time.monotonic() + timeout
+        while not self._stopped.is_set():
+            end = self._rx.find(_END_BYTE)
+            if end >= 0:
+                start = self._rx.rfind(_START_BYTE, 0, end)
+                payload = bytes(self._rx[start + 1:end]) if start >= 0 else b''
+                del self._rx[:end + 1]
+                while self._rx[:1] in (b'\n', b'\r'): # O serialEvent() lê e ignora o fim de linha
+                    del self._rx[:1]
+                payload = payload.replace(b'\r', b'').replace(b'\n', b'')[:MAX_INPUT_LENGTH]
+                if start >= 0 and payload:
+                    self.commands_received += 1
+                    if self.command_latency:
+                        time.sleep(self.command_latency)
+                    command = payload.decode('utf-8', errors='replace')
+                    if self.framing == FRAMING_VERSION:
+                        command = self._accept_frame(command)
+                    if command is not None:
+                        return command
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._fill(min(remaining, 0.1))
+        return None
+
+    def _read_exact(self, size, timeout):
+        deadline = time.monotonic() + timeout
+        while len(self._rx) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopped.is_set():
+                return None
+            self._fill(remaining)
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    # --- Protocolo v2 ---
+
+    def _accept_frame(self, frame):
+        # Confere o quadro do PC; NAK, repetidos e corrompidos são tratados aqui (retorna None)
+        seq, payload = decode_frame(frame)
+        if seq is None:
+            if frame.split(',', 1)[0] in (CMD_INIT_SENSOR, CMD_PING):
+                self.framing = 1 # PC novo, falando v1 (sem reset da placa)
+                return frame
+            seq = self._next_seq()
+            self._write(self._frame_bytes(seq, f"{RESP_PREFIX}{RESP_NAK}") + b'\n')
+            return None
+        if payload.startswith(f"{CMD_NAK},"):
+            try:
+                self._retransmit(int(payload[len(CMD_NAK) + 1:], 16))
+            except ValueError:
+                pass
+            return None
+        if seq == self._last_host_seq:
+            # Comando repetido (a resposta se perdeu): reenvia a resposta em vez de executar de novo
+            if self._recent_responses:
+                self._retransmit(self._recent_responses[-1][0])
+            return None
+        self._last_host_seq = seq
+        return payload
+
+    def _retransmit(self, seq):
+        # As duas últimas respostas: a penúltima é o ACK do download, seguido pelos chunks
+        for response_seq, message in self._recent_responses:
+            if response_seq == seq:
+                self.retransmissions += 1
+                self._write(self._frame_bytes(seq, f"{RESP_PREFIX}{message}") + b'\n')
+                return
+        if seq in self._template_chunks:
+            self.retransmissions += 1
+            self._write(self._template_chunk(seq, *self._template_chunks[seq]))
+        # Senão o quadro é antigo demais: o PC desiste dele depois do FRAME_RETRANSMIT_TIMEOUT
+
+    def _enable_framing(self):
+        self.framing = FRAMING_VERSION
+        self._tx_seq = 0
+        self._last_host_seq = None
+        self._recent_responses.clear()
+        self._template_chunks.clear()
+
+    def wait_for_python_command(self, expected):
+        deadline = time.monotonic() + WAIT_COMMAND_TIMEOUT
+        while True:
+            command = self.read_command(deadline - time.monotonic())
+            if command is None:
+                self.send_response(f"{RESP_FAIL}:TIMEOUT_WAITING_FOR_CMD:{expected}")
+                return False
+            if command.split(',', 1)[0] == expected:
+                return True
+            # Outros comandos são ignorados, como no sketch
+
+    # --- Sensor ---
+
+    def _get_image(self):
+        self._sleep('get_image')
+        if self.finger_present:
+            self.image = self.finger
+            return True
+        return False
+
+    def _wait_finger_image(self, timeout):
+        if self.auto_finger:
+            self.finger_present = True
+        deadline = time.monotonic() + timeout
+        while not self._get_image():
+            if time.monotonic() >= deadline or self._stopped.is_set():
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _wait_finger_removed(self, timeout):
+        if self.auto_finger:
+            self.finger_present = False
+        deadline = time.monotonic() + timeout
+        while self._get_image():
+            if time.monotonic() >= deadline or self._stopped.is_set():
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _image_to_tz(self, buffer_id):
+        self._sleep('image2tz')
+        if self.image is None:
+            return False
+        self.char_buffers[buffer_id] = template_for(self.image)
+        return True
+
+    def _create_model(self):
+        self._sleep('create_model')
+        return self.char_buffers[1] is not None and self.char_buffers[1] == self.char_buffers[2]
+
+    def _search(self):
+        self._sleep('search')
+        for slot, template in self.library.items():
+            if template == self.char_buffers[1]:
+                self.send_response(f"{RESP_ID_FOUND}:{slot},CONFIDENCE:{MATCH_CONFIDENCE}")
+                return
+        self.send_response(RESP_NOT_FOUND)
+
+    def _match(self):
+        # Mesmo critério do _search: o template do mesmo dedo é sempre idêntico
+        self._sleep('match')
+        if self.char_buffers[1] is not None and self.char_buffers[1] == self.char_buffers[2]:
+            self.send_response(f"{RESP_OK}:MATCHED:{MATCH_CONFIDENCE}")
+        else:
+            self.send_response(RESP_NO_MATCH)
+
+    def _store(self, slot):
+        self._sleep('store')
+        self.library[slot] = self.char_buffers[1]
+        self.send_response(f"{RESP_OK}:STORED:{slot}")
+
+    # --- Loop principal (loop() do sketch) ---
+
+    def _run(self):
+        self._boot()
+        while not self._stopped.is_set():
+            if self.hung:
+                time.sleep(0.05)
+                continue
+            command = self._pending_command or self.read_command(0.2)
+            self._pending_command = None
+            if command is not None and not self.hung:
+                self.handle_command(command)
+
+    def handle_command(self, payload):
+        command, _, value_str = payload.partition(',')
+        try:
+            value = int(value_str.split(',')[0]) if value_str else -1
+        except ValueError:
+            value = 0
+
+        if command == CMD_PING:
+            self._pong(value_str)
+        elif command == CMD_HEARTBEAT:
+            self.heartbeat_interval = max(value, 0) / 1000
+            self.send_response(f"{RESP_OK}:HEARTBEAT:{max(value, 0)}")
+        elif command == CMD_BAUD:
+            self._handle_baud_change(value)
+        elif not self.sensor_initialized:
+            if command == CMD_INIT_SENSOR:
+                self._write(b"Arduino: Recebido comando para inicializar sensor.\r\n")
+                self._sleep('init')
+                self.sensor_initialized = True
+                self._sensor_ready(value_str == FRAMING_MODE)
+            else:
+                self.send_response(f"{RESP_SENSOR_ERROR}:NOT_INITIALIZED_YET")
+        elif command == CMD_INIT_SENSOR:
+            self._sensor_ready(value_str == FRAMING_MODE) # Início a quente: o sensor não é tocado
+        elif command in (CMD_ENROLL, CMD_ENROLL_AUTO, CMD_STORE_B1, CMD_DELETE, CMD_LOAD_B1) and not 0 < value <= self.capacity:
+            self.send_response(f"{RESP_FAIL}:INVALID_ID:{value},CAP:{self.capacity}")
+        elif command == CMD_ENROLL:
+            self._enroll(value)
+        elif command == CMD_ENROLL_AUTO:
+            self._enroll_auto(value, not value_str.endswith(AUTO_MODE_NOSTORE))
+        elif command == CMD_IDENTIFY_AUTO:
+            self._identify_auto()
+        elif command == CMD_IDENTIFY:
+            self._identify(value_str == IDENTIFY_MODE_HOST)
+        elif command == CMD_COUNT:
+            self._sleep('count')
+            self.send_response(f"{RESP_COUNT_RESULT}:{len(self.library)}")
+        elif command == CMD_DOWNLOAD_TEMPLATE_B1:
+            self._download_template(value_str == TPL_MODE_BIN)
+        elif command == CMD_UPLOAD_TEMPLATE_B1:
+            self._upload_template(1)
+        elif command == CMD_UPLOAD_TEMPLATE_B2:
+            self._upload_template(2)
+        elif command == CMD_MATCH_B2:
+            self._match()
+        elif command == CMD_SEARCH_B1:
+            self._search()
+        elif command == CMD_STORE_B1:
+            self._store(value)
+        elif command == CMD_DELETE:
+            self._sleep('store')
+            self.library.pop(value, None)
+            self.send_response(f"{RESP_OK}:DELETED:{value}")
+        elif command == CMD_LOAD_B1:
+            self._sleep('load')
+            if value in self.library:
+                self.char_buffers[1] = self.library[value]
+                self.send_response(f"{RESP_OK}:LOADED:{value}")
+            else:
+                self.send_response(f"{RESP_FAIL}:LOAD_B1_FAIL:UNKNOWN_SENSOR_ERR_0x0C") # Slot vazio
+        elif command == CMD_INDEX:
+            self._index_table(value)
+        elif command == CMD_STORE_MODEL:
+            if self.pending_enroll_id != -1:
+                self._store(self.pending_enroll_id)
+                self.pending_enroll_id = -1
+            else:
+                self.send_response(f"{RESP_FAIL}:NO_PENDING_MODEL_TO_STORE")
+        elif command == CMD_GET_IMAGE:
+            if self._get_image():
+                self.send_response(f"{RESP_OK}:IMAGE_TAKEN")
+            else:
+                self.send_response(f"{RESP_NO_FINGER}:POLL")
+        elif command == CMD_IMAGE_TO_TZ1:
+            if self._image_to_tz(1):
+                self.send_response(f"{RESP_OK}:CONVERT_DONE")
+            else:
+                self.send_response(f"{RESP_FAIL}:POLL_CONV:{RESP_IMAGE_FAIL}")
+        elif command in (CMD_IMAGE_TO_TZ2, CMD_CREATE_MODEL, CMD_REMOVE_FINGER_ACK):
+            self.send_response(f"{RESP_FAIL}:UNEXPECTED_SUB_COMMAND:{command}")
+        else:
+            self.send_response(f"{RESP_UNKNOWN_COMMAND}:{command}")
+
+    def _sensor_ready(self, framed):
+        if framed:
+            self.send_response(f"{RESP_SENSOR_READY},CAP:{self.capacity},FRAMING:{FRAMING_VERSION}")
+            self._enable_framing()
+        else:
+            self.send_response(f"{RESP_SENSOR_READY},CAP:{self.capacity}")
+
+    def _index_table(self, page):
+        if not 0 <= page <= 3:
+            self.send_response(f"{RESP_FAIL}:INVALID_PAGE:{page}")
+            return
+        self._sleep('count')
+        table = bytearray(INDEX_PAGE_SLOTS // 8)
+        for slot in self.library:
+            if slot // INDEX_PAGE_SLOTS == page:
+                table[slot % INDEX_PAGE_SLOTS // 8] |= 1 << (slot % 8)
+        self.send_response(f"{RESP_OK}:INDEX:{page}:{table.hex().upper()}")
+
+    def _pong(self, token):
+        pong = f"{RESP_PONG}:{token},INIT:{int(self.sensor_initialized)},BAUD:{self.baud}"
+        if self.sensor_initialized:
+            pong += f",CAP:{self.capacity}"
+        self.send_response(pong)
+
+    def _handle_baud_change(self, new_baud):
+        if new_baud not in SUPPORTED_BAUDS:
+            self.send_response(f"{RESP_FAIL}:BAUD_UNSUPPORTED:{new_baud}")
+            return
+        previous_baud = self.baud
+        self.send_response(f"{RESP_OK}:BAUD:{new_baud}")
+        self._sleep('baud_switch')
+        self.baud = new_baud
+        deadline = time.monotonic() + BAUD_CONFIRM_TIMEOUT
+        while True:
+            command = self.read_command(deadline - time.monotonic())
+            if command is None:
+                break
+            if new_baud > self.max_baud:
+                continue # Taxa que o "adaptador" não aguenta: só chega lixo
+            name, _, token = command.partition(',')
+            if name == CMD_PING:
+                self._pong(token)
+            elif name == CMD_BAUD_OK:
+                self.send_response(f"{RESP_OK}:BAUD_CONFIRMED:{new_baud}")
+                return
+        self.baud = previous_baud
+
+    # --- Fluxos ---
+
+    def _enroll(self, user_id):
+        self.send_response(RESP_ASK_PLACE_FINGER)
+        if not self.wait_for_python_command(CMD_GET_IMAGE): return
+        if not self._wait_finger_image(FINGER_WAIT_TIMEOUT):
+            self.send_response(f"{RESP_NO_FINGER}:ENROLL_IMG1")
+            return
+        self.send_response(f"{RESP_OK}:IMAGE1_TAKEN")
+        if not self.wait_for_python_command(CMD_IMAGE_TO_TZ1): return
+        self._image_to_tz(1)
+        self.send_response(f"{RESP_OK}:CONVERT1_DONE")
+
+        self.send_response(RESP_ASK_REMOVE_FINGER)
+        if not self.wait_for_python_command(CMD_REMOVE_FINGER_ACK): return
+        if not self._wait_finger_removed(FINGER_WAIT_TIMEOUT):
+            self.send_response(f"{RESP_FAIL}:TIMEOUT_REMOVE_FINGER")
+            return
+        self.send_response(RESP_FINGER_REMOVED)
+
+        self.send_response(RESP_ASK_PLACE_AGAIN)
+        if not self.wait_for_python_command(CMD_GET_IMAGE): return
+        if not self._wait_finger_image(FINGER_WAIT_TIMEOUT):
+            self.send_response(f"{RESP_NO_FINGER}:ENROLL_IMG2")
+            return
+        self.send_response(f"{RESP_OK}:IMAGE2_TAKEN")
+        if not self.wait_for_python_command(CMD_IMAGE_TO_TZ2): return
+        self._image_to_tz(2)
+        self.send_response(f"{RESP_OK}:CONVERT2_DONE")
+
+        if not self.wait_for_python_command(CMD_CREATE_MODEL): return
+        if not self._create_model():
+            self.pending_enroll_id = -1
+            self.send_response(f"{RESP_FAIL}:ENROLL_MODEL:{RESP_ENROLL_MISMATCH}")
+            return
+        self.send_response(f"{RESP_OK}:MODEL_CREATED")
+        self.pending_enroll_id = user_id
+
+    def _identify(self, host_search):
+        self.send_response(RESP_ASK_PLACE_FINGER)
+        if not self.wait_for_python_command(CMD_GET_IMAGE): return
+        if not self._wait_finger_image(FINGER_WAIT_TIMEOUT):
+            self.send_response(f"{RESP_NO_FINGER}:IDENTIFY_IMG")
+            return
+        self.send_response(f"{RESP_OK}:IMAGE_TAKEN")
+        if not self.wait_for_python_command(CMD_IMAGE_TO_TZ1): return
+        if not self._image_to_tz(1):
+            self.send_response(f"{RESP_FAIL}:IDENTIFY_CONV:{RESP_IMAGE_FAIL}")
+            return
+        self.send_response(f"{RESP_OK}:CONVERT_DONE")
+        if not host_search:
+            self._search()
+
+    def _enroll_auto(self, user_id, store_after_model):
+        self.send_event(RESP_ASK_PLACE_FINGER)
+        if not self._wait_finger_image(AUTO_FINGER_TIMEOUT):
+            self.send_response(f"{RESP_NO_FINGER}:ENROLL_IMG1")
+            return
+        self.send_event("IMAGE1_TAKEN")
+        self._image_to_tz(1)
+        self.send_event("CONVERT1_DONE")
+        self.send_event(RESP_ASK_REMOVE_FINGER)
+        if not self._wait_finger_removed(AUTO_FINGER_TIMEOUT):
+            self.send_response(f"{RESP_FAIL}:TIMEOUT_REMOVE_FINGER")
+            return
+        self.send_event(RESP_FINGER_REMOVED)
+        self.send_event(RESP_ASK_PLACE_AGAIN)
+        if not self._wait_finger_image(AUTO_FINGER_TIMEOUT):
+            self.send_response(f"{RESP_NO_FINGER}:ENROLL_IMG2")
+            return
+        self.send_event("IMAGE2_TAKEN")
+        self._image_to_tz(2)
+        self.send_event("CONVERT2_DONE")
+        if not self._create_model():
+            self.send_response(f"{RESP_FAIL}:ENROLL_MODEL:{RESP_ENROLL_MISMATCH}")
+            return
+        self.send_event("MODEL_CREATED")
+        if not store_after_model:
+            self.pending_enroll_id = user_id
+            self.send_response(f"{RESP_OK}:MODEL_PENDING:{user_id}")
+            return
+        self._store(user_id)
+
+    def _identify_auto(self):
+        self.send_event(RESP_ASK_PLACE_FINGER)
+        if not self._wait_finger_image(AUTO_FINGER_TIMEOUT):
+            self.send_response(f"{RESP_NO_FINGER}:IDENTIFY_IMG")
+            return
+        self.send_event("IMAGE_TAKEN")
+        self._image_to_tz(1)
+        self.send_event("CONVERT_DONE")
+        self._search()
+
+    def _download_template(self, binary_mode):
+        template = self.char_buffers[1]
+        if template is None:
+            self.send_response(f"{RESP_FAIL}:GETMODEL_CMD_FAIL_CODE_0x1")
+            return
+        if binary_mode:
+            self.send_response(f"{RESP_OK}:TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED_{TPL_MODE_BIN}")
+        else:
+            self.send_response(f"{RESP_OK}:TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED")
+        packet_time = self.delays['template_packet'] * self.time_scale
+        if self.framing == FRAMING_VERSION:
+            # v2: o sketch guarda o template inteiro (para poder reenviar chunks) e só depois manda
+            time.sleep(packet_time * (TEMPLATE_SIZE // DATA_PACKET_PAYLOAD_SIZE))
+            self._template_chunks.clear()
+            for offset in range(0, TEMPLATE_SIZE, DATA_PACKET_PAYLOAD_SIZE):
+                seq = self._next_seq()
+                self._template_chunks[seq] = (binary_mode, template[offset:offset + DATA_PACKET_PAYLOAD_SIZE])
+                self._write(self._template_chunk(seq, *self._template_chunks[seq]))
+            self.send_response(f"{RESP_OK}:TEMPLATE_DOWNLOAD_COMPLETE:{TEMPLATE_SIZE}")
+            self._download_cleanup()
+            return
+        for offset in range(0, TEMPLATE_SIZE, DATA_PACKET_PAYLOAD_SIZE):
+            payload = template[offset:offset + DATA_PACKET_PAYLOAD_SIZE]
+            # O sketch repassa os bytes enquanto o sensor manda
+            self._write(self._template_chunk(None, binary_mode, payload), busy_time=packet_time)
+            self.send_response(f"DBG:PayL={len(payload)},PID=0x{8 if offset + len(payload) >= TEMPLATE_SIZE else 2:x}")
+        self.send_response(f"{RESP_OK}:TEMPLATE_DOWNLOAD_COMPLETE:{TEMPLATE_SIZE}")
+        self._download_cleanup()
+
+    def _download_cleanup(self):
+        # Espera do sketch depois do download. Com o próximo comando já na fila termina quando
+        # o sensor fica quieto; no v2 os NAK do PC são atendidos durante a espera.
+        start = time.monotonic()
+        deadline = start + self.delays['download_cleanup'] * self.time_scale
+        quiet = start + self.delays['download_quiet'] * self.time_scale
+        while True:
+            remaining = deadline - time.monotonic()
+            if self.framing == FRAMING_VERSION:
+                if self._pending_command is None and remaining > 0:
+                    self._pending_command = self.read_command(remaining)
+                queued = self._pending_command is not None
+            else:
+                queued = _END_BYTE in self._rx # No v1 o comando fica no buffer da serial
+                if not queued and remaining > 0:
+                    self._fill(remaining)
+                    continue
+            if queued:
+                time.sleep(max(quiet - time.monotonic(), 0))
+                return
+            if remaining <= 0:
+                return
+
+    def _template_chunk(self, seq, binary_mode, payload):
+        if not binary_mode:
+            return self._frame_bytes(seq, f"{RESP_PREFIX}{RESP_TEMPLATE_CHUNK}:{payload.hex().upper()}") + b'\n'
+        # v2: CRC do payload em vez da soma
+        checksum = frame_crc(payload) if self.framing == FRAMING_VERSION else sum(payload) & 0xFFFF
+        return (self._frame_bytes(seq, f"{RESP_PREFIX}{RESP_TEMPLATE_BIN}:{len(payload)}")
+                + payload + checksum.to_bytes(TEMPLATE_BIN_CHECKSUM_SIZE, 'big') + b'\n')
+
+    def _upload_template(self, buffer_id):
+        self.send_response(f"{RESP_OK}:UPLOAD_READY")
+        template = bytearray()
+        for offset in range(0, TEMPLATE_SIZE, DATA_PACKET_PAYLOAD_SIZE):
+            chunk = self._read_exact(DATA_PACKET_PAYLOAD_SIZE + TEMPLATE_BIN_CHECKSUM_SIZE, UPLOAD_CHUNK_TIMEOUT)
+            if chunk is None:
+                self.send_response(f"{RESP_FAIL}:TIMEOUT_WAITING_FOR_CMD:UPLOAD_CHUNK")
+                return
+            payload = chunk[:DATA_PACKET_PAYLOAD_SIZE]
+            if sum(payload) & 0xFFFF != int.from_bytes(chunk[DATA_PACKET_PAYLOAD_SIZE:], 'big'):
+                self.send_response(f"{RESP_FAIL}:UPLOAD_CHUNK_CHECKSUM_MISMATCH:{offset}")
+                return
+            time.sleep(self.delays['template_packet'] * self.time_scale)
+            template += payload
+            self.send_response(f"{RESP_OK}:UPLOAD_CHUNK_ACK:{offset + DATA_PACKET_PAYLOAD_SIZE}")
+        self.char_buffers[buffer_id] = bytes(template)
+        self.send_response(f"{RESP_OK}:TEMPLATE_UPLOAD_COMPLETE:{TEMPLATE_SIZE}")
+
+
+if __name__ == '__main__':
+    # Deixa um Arduino falso rodando para testar o main.py à mão (SERIAL_PORT = porta impressa)
+    with FakeArduino() as fake:
+        print(f"Arduino falso em {fake.port}. Ctrl+C para sair.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -1,94 +1,154 @@
+import json
+import os
 import serial
 import time
 
+from event_log import NO_ID, EventLog
+from metrics import CommandTracker, metrics
+from protocol import *
+from slot_map import SlotMap
+from template_store import StoreLockedError, TemplateStore
+from wire_trace import TRACE_ERRORS, WireTracer
+
 # --- Configurações ---
 SERIAL_PORT = 'COM3'  # MUDE PARA A SUA PORTA SERIAL CORRETA
-BAUD_RATE_ARDUINO = 9600
+BAUD_RATE_ARDUINO = 9600 # Taxa segura usada na abertura da porta e no INIT_SENSOR
+BAUD_RATE_CANDIDATES = [230400, 115200, 57600] # Negociadas após o INIT_SENSOR, da maior para a menor
+BAUD_CONFIRM_TIMEOUT = 1.0 # Mesmo BAUD_CONFIRM_TIMEOUT do Arduino (ms lá, s aqui)
 # ARDUINO_INIT_TIMEOUT = 5 # Tempo para o Arduino inicializar e enviar SENSOR_READY (após INIT_SENSOR)
 ARDUINO_SENSOR_INIT_TIMEOUT = 10 # Tempo maior para o Arduino inicializar o sensor
+RESET_BOARD_ON_CONNECT = False # True: abre a porta com DTR (reinicia a placa) como antes; False tenta o início a quente
+WARM_START_TIMEOUT = 3.0 # s de PING na abertura antes de desistir e reiniciar a placa pelo DTR
+WARM_PROBE_INTERVAL = 0.25 # s entre os PING da abertura
+ARDUINO_BOOT_TIMEOUT = 2.5 # s esperando o ARDUINO_READY_FOR_INIT depois de um reset (sketch antigo: sempre isso)
+SESSION_CACHE_PATH = 'arduino_session.json' # Taxa, capacidade e protocolo da última conexão; None desliga
+SLOT_MAP_MAX_AGE = 300 # s; o mapa local de IDs ocupados (slot_map.py) é reconciliado com o INDEX do sensor a cada conexão e depois disso; 0 desliga
+DEFAULT_SENSOR_CAPACITY = 127 # Sketch que não informa CAP no SENSOR_READY
 RESPONSE_TIMEOUT = 15    # Timeout geral para respostas do Arduino
+USE_AUTO_COMMANDS = True # ENROLL_AUTO/IDENTIFY_AUTO: um comando só por fluxo (cai no passo a passo se o sketch não suportar)
+AUTO_EVENT_TIMEOUT = 20 # s entre eventos nos comandos *_AUTO (AUTO_FINGER_TIMEOUT do Arduino + folga)
+TEMPLATE_TRANSFER_BINARY = True # Pede o template em binário (cai no HEX se o sketch não suportar)
+FRAMED_PROTOCOL = True # Pede no INIT_SENSOR o protocolo v2 (sequência + CRC, NAK e retransmissão); sketch antigo fica no v1
+FRAME_RETRANSMIT_TIMEOUT = 0.5 # s esperando um quadro pedido de novo (NAK) antes de pedir outra vez
+FRAME_MAX_RESENDS = 3 # NAKs por quadro perdido antes de desistir dele; e reenvios de um comando recusado pelo Arduino
+ADAPTIVE_TIMEOUTS = True # Timeout de cada comando aprendido das latências dele (metrics.py); False = sempre RESPONSE_TIMEOUT
+ADAPTIVE_TIMEOUT_QUANTILE = 0.99 # Quantil de envio -> último quadro usado como base
+ADAPTIVE_TIMEOUT_MARGIN = 2.0 # Multiplica o quantil
+ADAPTIVE_TIMEOUT_MIN = 1.0 # s; o timeout aprendido nunca fica abaixo disso
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20 # Antes de 20 respostas de um comando vale RESPONSE_TIMEOUT
+HEARTBEAT_INTERVAL_MS = 250 # <HEARTBEAT,250> no fim do handshake; 0 desliga (sketch antigo: só os timeouts)
+HEARTBEAT_DEAD_AFTER = 1.5 # s sem nenhum byte do Arduino, com heartbeat ligado = link morto
+AUTO_RECONNECT = True # Link morto: reabre a porta e refaz o handshake
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY = 1.0 # s entre tentativas de reconexão
+
+TEMPLATE_STORE_DIR = 'template_store' # Banco de templates no PC (ver template_store.py)
+HOST_MATCH_TOP_K = 5 # Quantos candidatos da busca no PC são conferidos no sensor (identificação e duplicados)
+HOST_MATCH_WORKERS = 0 # Processos extras para a busca 1:N (0 = só o processo atual)
+DUPLICATE_CHECK = True # No cadastro, procura a mesma digital em outro ID (flash e banco do PC) antes do STORE_MODEL; o sensor confirma
+DUPLICATE_MIN_SCORE = 0.9 # Pré-filtro: score (ver matcher.py) para um template do PC ir para a conferência no sensor (não validado com templates reais)
+EVENT_LOG_DIR = 'event_log' # Resultados de identificação e cadastro (ver event_log.py); None desliga
+METRICS_EXPORT_PATH = 'metrics.prom' # Métricas de latência gravadas ao sair (formato Prometheus); None desliga
+WIRE_TRACE_LEVEL = TRACE_ERRORS # TRACE_FRAMES imprime cada quadro; TRACE_OFF desliga (ver wire_trace.py)
+WIRE_TRACE_DUMP_BYTES = 4096 # Quanto do rastro mostrar em timeout/erro de protocolo
+SESSION_LOG_PATH = None # Ex.: 'sessao.log' grava todos os bytes da serial com horário (ver session_log.py)
 
 arduino_serial = None # Variável global para a conexão serial
+sensor_capacity = None # Do ,CAP: do SENSOR_READY ou do PONG
+slot_map = None # IDs ocupados no flash do sensor (ver slot_map.py), criado no handshake
+template_store = None # Aberto na primeira vez que for usado (get_template_store)
+template_matcher = None # Idem, para a busca 1:N no PC (precisa do NumPy)
+similarity_index = None # Idem, para a checagem de cadastro duplicado (ver similarity_index.py, precisa do NumPy)
+event_log = None # Aberto no primeiro evento (log_event)
 
-# Delimitadores
-START_MARKER = '<'
-END_MARKER = '>'
-
-# --- Constantes para Comandos (Python para Arduino) ---
-CMD_INIT_SENSOR = "INIT_SENSOR" # Novo comando
-CMD_ENROLL = "ENROLL"
-CMD_IDENTIFY = "IDENTIFY"
-CMD_DELETE = "DELETE" # Não implementado no Arduino ainda
-CMD_COUNT = "COUNT"
-CMD_EMPTY = "EMPTY"   # Não implementado no Arduino ainda
-CMD_GET_IMAGE = "GET_IMAGE"
-CMD_IMAGE_TO_TZ1 = "IMAGE_TO_TZ1"
-CMD_IMAGE_TO_TZ2 = "IMAGE_TO_TZ2"
-CMD_CREATE_MODEL = "CREATE_MODEL"
-CMD_STORE_MODEL = "STORE_MODEL"
-CMD_REMOVE_FINGER_ACK = "REMOVE_FINGER_ACK"
-CMD_DOWNLOAD_TEMPLATE_B1 = "DOWNLOAD_TPL_B1"
-
-# --- Constantes para Respostas (Arduino para Python) ---
-RESP_PREFIX = "RESP:" # O Python irá remover isso ao ler
-RESP_ARDUINO_READY_FOR_INIT = "ARDUINO_READY_FOR_INIT" # Arduino pronto para receber INIT_SENSOR
-RESP_SENSOR_READY = "SENSOR_READY"
-RESP_SENSOR_ERROR = "SENSOR_ERROR"
-RESP_UNKNOWN_COMMAND = "UNKNOWN_COMMAND"
-RESP_OK = "OK"
-RESP_FAIL = "FAIL"
-RESP_COMM_ERROR = "COMM_ERROR"
-RESP_IMAGE_FAIL = "IMAGE_FAIL"
-RESP_IMAGE_MESSY = "IMAGE_MESSY"
-RESP_FEATURE_FAIL = "FEATURE_FAIL"
-RESP_NO_FINGER = "NO_FINGER"
-RESP_ENROLL_MISMATCH = "ENROLL_MISMATCH"
-RESP_BAD_LOCATION = "BAD_LOCATION"
-RESP_FLASH_ERROR = "FLASH_ERROR"
-RESP_NOT_FOUND = "NOT_FOUND"
-RESP_ASK_PLACE_FINGER = "ASK_PLACE_FINGER"
-RESP_ASK_REMOVE_FINGER = "ASK_REMOVE_FINGER"
-RESP_ASK_PLACE_AGAIN = "ASK_PLACE_AGAIN"
-RESP_FINGER_REMOVED = "FINGER_REMOVED"
-RESP_ID_FOUND = "ID_FOUND"
-RESP_COUNT_RESULT = "COUNT_RESULT"
-# Adicione outras respostas conforme necessário
+# Leitor de quadros reutilizável (buffer + fila de quadros extras)
+_frame_parser = FrameParser()
+# Latência, bytes e timeouts por comando (ver metrics.py)
+_command_tracker = CommandTracker(metrics)
+# Últimos bytes da serial (memória fixa), despejados em timeout/erro de protocolo
+_wire_tracer = WireTracer(SERIAL_PORT, level=WIRE_TRACE_LEVEL)
+# Protocolo v2: ordem dos quadros recebidos, sequência dos enviados e o que pode ser reenviado
+_frame_sequencer = FrameSequencer()
+_tx_seq = 0
+_last_command = (None, b'') # (comando, bytes) do último send_to_arduino, reenviado se o Arduino mandar NAK
+_framed_raw = bytearray() # Bloco cru do último TEMPLATE_BIN entregue (no v2 o FrameParser já o leu)
+# Heartbeat do Arduino (pedido no handshake): sem bytes por HEARTBEAT_DEAD_AFTER o link caiu
+_heartbeat_enabled = False
+_reconnecting = False
 
+@metrics.span('connect', _command_tracker)
 def connect_arduino():
-    global arduino_serial
+    global arduino_serial, _heartbeat_enabled
+    _heartbeat_enabled = False
     try:
-        print(f"Tentando conectar ao Arduino na porta {SERIAL_PORT} a {BAUD_RATE_ARDUINO} bps...")
-        arduino_serial = serial.Serial(SERIAL_PORT, BAUD_RATE_ARDUINO, timeout=0.1) 
-        
-        print("Aguardando Arduino reiniciar e estabilizar...")
-        time.sleep(2.5) # Aumentar um pouco para garantir que o Arduino esteja no loop()
-        arduino_serial.reset_input_buffer()
-        arduino_serial.reset_output_buffer()
-        print("Buffers de serial limpos.")
-
-        # Enviar comando para o Arduino inicializar o sensor
-        print(f"Enviando comando {CMD_INIT_SENSOR} para o Arduino...")
-        if not send_to_arduino(CMD_INIT_SENSOR):
-            print("Falha ao enviar comando de inicialização do sensor para o Arduino.")
-            if arduino_serial and arduino_serial.is_open:
-                arduino_serial.close()
-            arduino_serial = None
-            return False
+        # Sem reset a placa continua na taxa da última sessão, então a porta abre nela
+        cache = {} if RESET_BOARD_ON_CONNECT else _load_session_cache()
+        rate = cache.get('baud', BAUD_RATE_ARDUINO)
+        print(f"Tentando conectar ao Arduino na porta {SERIAL_PORT} a {rate} bps...")
+        arduino_serial = _open_serial_port(rate)
+        if SESSION_LOG_PATH:
+            from session_log import RecordingSerial
+            arduino_serial = RecordingSerial(arduino_serial, SESSION_LOG_PATH)
+            print(f"Gravando a sessão serial em {SESSION_LOG_PATH}.")
+        _frame_parser.reset()
+        _frame_parser.framed = False
 
-        # Esperar pela mensagem SENSOR_READY ou SENSOR_ERROR do Arduino
-        print(f"Aguardando confirmação de inicialização do sensor do Arduino (timeout: {ARDUINO_SENSOR_INIT_TIMEOUT}s)...")
-        full_response_content = read_arduino_response(timeout_seconds=ARDUINO_SENSOR_INIT_TIMEOUT)
+        state = None
+        if RESET_BOARD_ON_CONNECT:
+            print("Aguardando Arduino reiniciar e estabilizar...")
+            _wait_for_boot()
+        else:
+            state = _probe_arduino()
+            if state is None:
+                print(f"Arduino não respondeu ao PING em {WARM_START_TIMEOUT}s.")
+                _reset_board()
+
+        if state and state.get('INIT'):
+            print(f"Sensor já inicializado (início a quente, {arduino_serial.baudrate} bps).")
+            if not FRAMED_PROTOCOL:
+                return _finish_handshake(state.get('CAP', cache.get('capacity')))
+
+        # Enviar comando para o Arduino inicializar o sensor (e pedir o protocolo v2); com o
+        # sensor já inicializado o sketch só responde SENSOR_READY e volta para o v2
+        init_command = f"{CMD_INIT_SENSOR},{FRAMING_MODE}" if FRAMED_PROTOCOL else CMD_INIT_SENSOR
+        print(f"Enviando comando {init_command} para o Arduino...")
+        for attempt in range(1 + FRAME_MAX_RESENDS):
+            if attempt:
+                # Resposta ilegível (ruído no v1): o INIT_SENSOR pode ser repetido, com o sensor
+                # já inicializado o sketch só responde SENSOR_READY de novo
+                print(f"Resposta ilegível ('{full_response_content}'), repetindo o {CMD_INIT_SENSOR}...")
+                _command_tracker.retry(CMD_INIT_SENSOR)
+            if not send_to_arduino(init_command):
+                print("Falha ao enviar comando de inicialização do sensor para o Arduino.")
+                if arduino_serial and arduino_serial.is_open:
+                    arduino_serial.close()
+                arduino_serial = None
+                return False
+
+            # Esperar pela mensagem SENSOR_READY ou SENSOR_ERROR do Arduino
+            print(f"Aguardando confirmação de inicialização do sensor do Arduino (timeout: {ARDUINO_SENSOR_INIT_TIMEOUT}s)...")
+            full_response_content = read_arduino_response(timeout_seconds=ARDUINO_SENSOR_INIT_TIMEOUT)
+            while full_response_content.startswith(f"{RESP_PONG}:") or full_response_content == RESP_ARDUINO_READY_FOR_INIT:
+                # PONG atrasado de um PING da abertura (ou o aviso do setup() depois dele)
+                full_response_content = read_arduino_response(timeout_seconds=ARDUINO_SENSOR_INIT_TIMEOUT)
+            if RESP_SENSOR_READY in full_response_content or RESP_SENSOR_ERROR in full_response_content \
+                    or full_response_content.startswith(f"{RESP_FAIL}:"):
+                break
 
         if full_response_content and RESP_SENSOR_READY in full_response_content:
             print(f"Arduino (inicialização do sensor): {full_response_content}")
+            capacity = None
             if ",CAP:" in full_response_content:
                 try:
-                    capacity_str = full_response_content.split(",CAP:")[1].split(END_MARKER)[0].split('>')[0] # Limpa qualquer resquício
+                    capacity_str = full_response_content.split(",CAP:")[1].split(END_MARKER)[0].split(',')[0] # Limpa qualquer resquício
                     print(f"Capacidade do sensor detectada: {capacity_str}")
-                except IndexError:
+                    capacity = int(capacity_str)
+                except (IndexError, ValueError):
                     print("Não foi possível extrair a capacidade, mas o sensor está pronto.")
-            print("Conexão com Arduino e inicialização do sensor bem-sucedidas!")
-            return True
+            if f",FRAMING:{FRAMING_VERSION}" in full_response_content:
+                _enable_framing()
+                print("Protocolo v2 (sequência + CRC) ativo.")
+            return _finish_handshake(capacity)
         elif full_response_content and RESP_SENSOR_ERROR in full_response_content:
             print(f"Erro na inicialização do sensor pelo Arduino: {full_response_content}")
             if arduino_serial and arduino_serial.is_open:
@@ -113,12 +173,356 @@ def connect_arduino():
         arduino_serial = None
         return False
 
+
+def _finish_handshake(capacity):
+    global sensor_capacity
+    sensor_capacity = capacity
+    negotiate_baud_rate() # Já na taxa mais alta (início a quente) só mede o RTT
+    _enable_heartbeat()
+    _restore_slot_map()
+    _save_session_cache()
+    print("Conexão com Arduino e inicialização do sensor bem-sucedidas!")
+    return True
+
+
+def _open_serial_port(rate):
+    # Com DTR desligado na abertura a placa (Uno, Nano...) não reinicia; o sketch continua
+    # com o sensor inicializado e a taxa negociada
+    port = serial.Serial()
+    port.port = SERIAL_PORT
+    port.baudrate = rate
+    port.timeout = 0.1
+    port.dtr = RESET_BOARD_ON_CONNECT
+    port.open()
+    return port
+
+
+def _probe_arduino():
+    # PING até WARM_START_TIMEOUT. Retorna o estado do PONG ({} no sketch antigo) ou None se
+    # ninguém respondeu. O primeiro PING vai na taxa da abertura (a da última sessão); os outros
+    # na taxa do setup(). Um ARDUINO_READY_FOR_INIT (placa reiniciando) adianta o próximo PING.
+    deadline = time.monotonic() + WARM_START_TIMEOUT
+    attempt = 0
+    while time.monotonic() < deadline:
+        attempt += 1
+        if attempt > 1:
+            _command_tracker.retry(CMD_PING)
+            if arduino_serial.baudrate != BAUD_RATE_ARDUINO:
+                _switch_host_baud_rate(BAUD_RATE_ARDUINO)
+        token = f"W{attempt}"
+        if not send_to_arduino(f"{CMD_PING},{token}"):
+            return None
+        probe_deadline = min(time.monotonic() + WARM_PROBE_INTERVAL, deadline)
+        while time.monotonic() < probe_deadline:
+            response = read_arduino_response(timeout_seconds=probe_deadline - time.monotonic(), quiet=True)
+            if response == RESP_ARDUINO_READY_FOR_INIT:
+                break # O PING pode ter chegado durante o boot e se perdido
+            if response == f"{RESP_SENSOR_ERROR}:NOT_INITIALIZED_YET":
+                return {} # Sketch sem PING, esperando o INIT_SENSOR
+            state = parse_pong(response, token)
+            if state is not None:
+                return state
+    return None
+
+
+def _wait_for_boot():
+    # Espera o ARDUINO_READY_FOR_INIT do setup() em vez de um sleep fixo; sketch antigo não
+    # manda: aí vale o ARDUINO_BOOT_TIMEOUT inteiro, como antes
+    deadline = time.monotonic() + ARDUINO_BOOT_TIMEOUT
+    while time.monotonic() < deadline:
+        response = read_arduino_response(timeout_seconds=deadline - time.monotonic(), quiet=True)
+        if response == RESP_ARDUINO_READY_FOR_INIT:
+            return True
+    arduino_serial.reset_input_buffer()
+    _frame_parser.reset()
+    return False
+
+
+def _reset_board():
+    # Pulso no DTR (o reset que a abertura da porta fazia sempre) e volta para a taxa do setup()
+    print("Reiniciando o Arduino pelo DTR...")
+    try:
+        arduino_serial.dtr = True
+        time.sleep(0.05)
+        arduino_serial.dtr = False
+    except (OSError, serial.SerialException) as e:
+        print(f"Porta sem controle de DTR ({e}): esperando a placa mesmo assim.")
+    if arduino_serial.baudrate != BAUD_RATE_ARDUINO:
+        _switch_host_baud_rate(BAUD_RATE_ARDUINO)
+    _wait_for_boot()
+
+
+def _load_session_cache():
+    # Fatos da última conexão nesta porta (taxa, capacidade, protocolo); {} sem cache
+    if not SESSION_CACHE_PATH or not os.path.exists(SESSION_CACHE_PATH):
+        return {}
+    try:
+        with open(SESSION_CACHE_PATH, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if cache.get('port') == SERIAL_PORT else {}
+
+
+def _save_session_cache():
+    if not SESSION_CACHE_PATH:
+        return
+    cache = {
+        'port': SERIAL_PORT,
+        'baud': arduino_serial.baudrate,
+        'capacity': sensor_capacity,
+        'framing': FRAMING_VERSION if _frame_parser.framed else 1,
+        'heartbeat_ms': HEARTBEAT_INTERVAL_MS if _heartbeat_enabled else 0,
+        'slots': slot_map.to_dict() if slot_map is not None else None,
+        'saved_at': time.time(),
+    }
+    tmp_path = SESSION_CACHE_PATH + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, SESSION_CACHE_PATH)
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar {SESSION_CACHE_PATH}: {e}")
+
+def _restore_slot_map():
+    # O mapa (em memória numa reconexão, senão do cache da sessão) sempre volta como velho:
+    # com a porta fechada outro programa (bulk_transfer, broker, daemon) pode ter gravado no
+    # flash, e um ID "livre" errado deixaria o cadastro sobrescrever a digital de alguém.
+    # O primeiro uso depois de cada conexão reconcilia com o INDEX do sensor.
+    global slot_map
+    capacity = sensor_capacity or DEFAULT_SENSOR_CAPACITY
+    if not SLOT_MAP_MAX_AGE:
+        slot_map = None
+        return
+    if slot_map is None or slot_map.capacity != capacity:
+        slot_map = SlotMap.from_dict(_load_session_cache().get('slots'), capacity, SLOT_MAP_MAX_AGE)
+    slot_map.invalidate()
+
+
+def reconcile_slot_map():
+    # Lê a tabela de ocupação do sensor (<INDEX,PAGINA>) para o mapa local. Sketch sem INDEX
+    # responde UNKNOWN_COMMAND: o mapa é desligado e COUNT/IDs voltam a ser perguntados ao Arduino.
+    global slot_map
+    if slot_map is None or not arduino_serial:
+        return False
+    for page in range(slot_map.pages):
+        if not send_to_arduino(f"{CMD_INDEX},{page}"):
+            return False
+        response = read_arduino_response()
+        prefix = f"{RESP_OK}:INDEX:{page}:"
+        if RESP_UNKNOWN_COMMAND in response:
+            print("Sketch sem INDEX: contagem e IDs livres continuam vindo do Arduino.")
+            slot_map = None
+            _save_session_cache()
+            return False
+        try:
+            if not response.startswith(prefix):
+                raise ValueError(response)
+            slot_map.load_page(page, bytes.fromhex(response[len(prefix):]))
+        except ValueError:
+            print(f"Falha ao ler a tabela de ocupação do sensor: {response}")
+            return False
+    slot_map.mark_synced()
+    _save_session_cache()
+    return True
+
+
+def _slot_map_ready():
+    # Mapa local em dia (reconciliado se passou de SLOT_MAP_MAX_AGE), ou None sem ele
+    if slot_map is None or not (slot_map.fresh() or reconcile_slot_map()):
+        return None
+    return slot_map
+
+
+def _enable_framing():
+    # A partir daqui os dois lados falam <SS:...*CCCC>, com a sequência começando em 0
+    global _tx_seq
+    _frame_parser.framed = True
+    _frame_sequencer.reset()
+    _tx_seq = 0
+
+
+def _enable_heartbeat():
+    # Pede o <RESP:HB> periódico. Sketch antigo responde UNKNOWN_COMMAND: link morto só aparece no timeout.
+    global _heartbeat_enabled
+    if not HEARTBEAT_INTERVAL_MS or not send_to_arduino(f"{CMD_HEARTBEAT},{HEARTBEAT_INTERVAL_MS}"):
+        return
+    response = read_arduino_response(timeout_seconds=2)
+    _heartbeat_enabled = f"{RESP_OK}:HEARTBEAT:{HEARTBEAT_INTERVAL_MS}" in response
+    if _heartbeat_enabled:
+        print(f"Heartbeat do Arduino a cada {HEARTBEAT_INTERVAL_MS} ms.")
+    else:
+        print(f"Sketch sem heartbeat ({response}): link morto só será detectado pelo timeout.")
+
+
+def reconnect_arduino():
+    # Reabre a porta e refaz o handshake inteiro (INIT_SENSOR, v2, taxa, heartbeat)
+    global _reconnecting
+    _reconnecting = True
+    try:
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            print(f"Reconectando ao Arduino (tentativa {attempt} de {RECONNECT_ATTEMPTS})...")
+            _command_tracker.retry(CMD_INIT_SENSOR)
+            if connect_arduino():
+                return True
+            time.sleep(RECONNECT_DELAY)
+        print("Não foi possível reconectar ao Arduino.")
+        return False
+    finally:
+        _reconnecting = False
+
+
+def _link_down(reason):
+    # Cabo solto, placa travada ou reiniciada: fecha a porta e, com AUTO_RECONNECT, refaz o
+    # handshake. O comando em andamento se perde; quem chamou recebe FAIL:LINK_DOWN_PY.
+    global arduino_serial, _heartbeat_enabled
+    print(f"Link com o Arduino caiu: {reason}.")
+    _command_tracker.timeout()
+    _wire_tracer.dump("link caiu", WIRE_TRACE_DUMP_BYTES)
+    _heartbeat_enabled = False
+    if slot_map is not None:
+        slot_map.invalidate() # Um STORED/DELETED pode ter se perdido com o link
+    try:
+        if arduino_serial is not None:
+            arduino_serial.close()
+    except serial.SerialException:
+        pass
+    arduino_serial = None
+    if AUTO_RECONNECT and not _reconnecting:
+        reconnect_arduino()
+    return f"{RESP_FAIL}:LINK_DOWN_PY"
+
+
+def _response_timeout():
+    # Timeout do comando em andamento: quantil da latência envio -> último quadro dele vezes a
+    # margem, entre ADAPTIVE_TIMEOUT_MIN e RESPONSE_TIMEOUT (que vale enquanto há poucas amostras)
+    name = _command_tracker.current
+    if not ADAPTIVE_TIMEOUTS or name is None:
+        return RESPONSE_TIMEOUT
+    quantile = metrics.latency_quantile(name, ADAPTIVE_TIMEOUT_QUANTILE, ADAPTIVE_TIMEOUT_MIN_SAMPLES)
+    if quantile is None:
+        return RESPONSE_TIMEOUT
+    return min(max(quantile * ADAPTIVE_TIMEOUT_MARGIN, ADAPTIVE_TIMEOUT_MIN), RESPONSE_TIMEOUT)
+
+
+def ping_arduino(timeout_seconds=0.5):
+    # Troca rápida PING/PONG. Retorna o tempo de ida e volta em segundos, ou None se falhar.
+    token = str(int(time.monotonic() * 1000) % 100000)
+    start_time = time.perf_counter()
+    if not send_to_arduino(f"{CMD_PING},{token}"):
+        return None
+    response = read_arduino_response(timeout_seconds=timeout_seconds)
+    if parse_pong(response, token) is not None:
+        return time.perf_counter() - start_time
+    return None
+
+
+def _switch_host_baud_rate(rate):
+    arduino_serial.flush()
+    arduino_serial.baudrate = rate
+    arduino_serial.reset_input_buffer()
+    _frame_parser.reset()
+
+
+def _confirm_baud_rate(rate):
+    # Na taxa nova: PING até 3 vezes dentro da janela do Arduino e depois BAUD_OK
+    for attempt in range(3):
+        if attempt:
+            _command_tracker.retry(CMD_PING)
+        if ping_arduino(timeout_seconds=BAUD_CONFIRM_TIMEOUT / 4) is not None:
+            break
+    else:
+        return False
+    if not send_to_arduino(CMD_BAUD_OK):
+        return False
+    response = read_arduino_response(timeout_seconds=BAUD_CONFIRM_TIMEOUT / 2)
+    return f"{RESP_OK}:BAUD_CONFIRMED:{rate}" in response
+
+
+@metrics.span('negotiate_baud', _command_tracker)
+def negotiate_baud_rate():
+    # Sobe a taxa da serial depois do INIT_SENSOR. Cada tentativa é confirmada com PING/BAUD_OK;
+    # se os quadros voltarem corrompidos os dois lados voltam para a taxa anterior e tentamos a próxima.
+    previous_rate = arduino_serial.baudrate
+    negotiated_rate = previous_rate
+    for rate in BAUD_RATE_CANDIDATES:
+        if rate <= previous_rate:
+            break
+        if rate != BAUD_RATE_CANDIDATES[0]:
+            _command_tracker.retry(CMD_BAUD) # Tentativa com a próxima taxa da lista
+        if not send_to_arduino(f"{CMD_BAUD},{rate}"):
+            break
+        response = read_arduino_response(timeout_seconds=2)
+        if f"{RESP_OK}:BAUD:{rate}" not in response:
+            print(f"Arduino não aceitou {rate} bps: {response}")
+            continue
+        try:
+            _switch_host_baud_rate(rate)
+        except (ValueError, serial.SerialException) as e:
+            # O adaptador USB-serial do PC não suporta a taxa: o Arduino volta sozinho após o timeout
+            print(f"Porta serial não suporta {rate} bps: {e}")
+            time.sleep(BAUD_CONFIRM_TIMEOUT)
+            _switch_host_baud_rate(previous_rate)
+            continue
+        if _confirm_baud_rate(rate):
+            negotiated_rate = rate
+            break
+
+        print(f"Falha ao confirmar {rate} bps, voltando para {previous_rate} bps...")
+        time.sleep(BAUD_CONFIRM_TIMEOUT) # Deixa a janela do Arduino expirar para ele voltar também
+        _switch_host_baud_rate(previous_rate)
+        if ping_arduino() is None:
+            # O BAUD_OK pode ter chegado mesmo sem a confirmação voltar: o Arduino ficou na taxa nova
+            _switch_host_baud_rate(rate)
+            if ping_arduino() is None:
+                print("Aviso: Arduino não responde em nenhuma das taxas após a negociação.")
+                return previous_rate
+            negotiated_rate = rate
+            break
+
+    round_trips = [rtt for rtt in (ping_arduino() for _ in range(5)) if rtt is not None]
+    if round_trips:
+        print(f"Taxa negociada: {negotiated_rate} bps, RTT médio (PING): {sum(round_trips) / len(round_trips) * 1000:.1f} ms")
+    else:
+        print(f"Taxa negociada: {negotiated_rate} bps (PING sem resposta após a negociação)")
+    return negotiated_rate
+
+
+def _encode_command(command_payload):
+    global _tx_seq
+    if _frame_parser.framed:
+        command_payload = encode_frame(_tx_seq, command_payload)
+        _tx_seq = (_tx_seq + 1) % FRAME_SEQ_MODULO
+    return f"{START_MARKER}{command_payload}{END_MARKER}\n".encode('utf-8')
+
+
+def _send_control_frame(data):
+    # NAK e reenvios do protocolo v2: não contam como um comando novo nas métricas
+    try:
+        _command_tracker.sent_raw(len(data))
+        if _wire_tracer.level:
+            _wire_tracer.tx(data)
+        arduino_serial.write(data)
+        arduino_serial.flush()
+    except serial.SerialException as e:
+        print(f"Erro ao enviar para o Arduino: {e}")
+
+
+def _request_retransmit(seqs):
+    for seq in seqs:
+        _send_control_frame(_encode_command(f"{CMD_NAK},{seq:02X}"))
+
+
 def send_to_arduino(command_payload):
+    global _last_command
     if arduino_serial and arduino_serial.is_open:
-        full_command = f"{START_MARKER}{command_payload}{END_MARKER}\n"
-        print(f"PYTHON -> ARDUINO: {full_command.strip()}")
         try:
-            arduino_serial.write(full_command.encode('utf-8'))
+            encoded_command = _encode_command(command_payload)
+            _command_tracker.sent(command_payload, len(encoded_command))
+            _last_command = (command_payload, encoded_command)
+            if _wire_tracer.level:
+                _wire_tracer.tx(encoded_command)
+            arduino_serial.write(encoded_command)
             arduino_serial.flush() # Espera que todos os dados sejam escritos
             return True
         except serial.SerialTimeoutException:
@@ -132,92 +536,493 @@ def send_to_arduino(command_payload):
         return False
 
 
-def read_arduino_response(timeout_seconds=RESPONSE_TIMEOUT):
+def _next_frame():
+    # Próximo quadro completo ou None. No v2 os quadros passam pela CRC e pelo FrameSequencer:
+    # corrompidos ou faltando são pedidos de novo na hora e os seguintes esperam na ordem.
+    if not _frame_parser.framed:
+        return _frame_parser.pop_frame()
+    now = time.monotonic()
+    while _frame_parser.frames:
+        seq, *item = _frame_parser.pop_frame()
+        if item[0] is None:
+            _request_retransmit(_frame_sequencer.reject(seq, now)) # Bloco cru com CRC errada
+        else:
+            _request_retransmit(_frame_sequencer.push(seq, item, now))
+    _request_retransmit(_frame_sequencer.expire(now, FRAME_RETRANSMIT_TIMEOUT, FRAME_MAX_RESENDS))
+    if not _frame_sequencer.ready:
+        return None
+    _, (payload, *raw) = _frame_sequencer.ready.popleft()
+    if raw:
+        _framed_raw[:] = raw[0]
+    return payload
+
+
+def read_arduino_response(timeout_seconds=None, quiet=False):
+    # Sem timeout_seconds vale o timeout aprendido do comando (_response_timeout). Com heartbeat,
+    # a espera passa dele (até RESPONSE_TIMEOUT) enquanto o Arduino der sinal de vida, e
+    # termina em HEARTBEAT_DEAD_AFTER se nenhum byte chegar. quiet: timeout esperado (placa
+    # reiniciando), sem mensagem, rastro nem contagem nas métricas.
     if arduino_serial and arduino_serial.is_open:
-        raw_message_inside_markers = ""
-        message_started = False
-        buffer_debug = "" # Para ver o que está chegando cru
-        
-        start_time = time.time()
-        while time.time() - start_time < timeout_seconds:
-            if arduino_serial.in_waiting > 0:
-                try:
-                    byte = arduino_serial.read(1)
-                    char = byte.decode('utf-8', errors='ignore') # Usar 'ignore' para caracteres problemáticos
-                    buffer_debug += char # Acumula tudo para debug se necessário
-
-                    if char == START_MARKER:
-                        raw_message_inside_markers = ""
-                        message_started = True
-                        continue 
-                    
-                    if message_started:
-                        if char == END_MARKER:
-                            # Mensagem completa recebida
-                            print(f"ARDUINO -> PYTHON (RAW): <{raw_message_inside_markers}>")
-                            if raw_message_inside_markers.startswith(RESP_PREFIX):
-                                clean_response = raw_message_inside_markers[len(RESP_PREFIX):]
-                                print(f"ARDUINO -> PYTHON (CONTEÚDO): {clean_response}")
-                                return clean_response
-                            else:
-                                # Pode ser uma mensagem de debug do Arduino não formatada
-                                print(f"ARDUINO -> PYTHON (SEM PREFIXO RESP): {raw_message_inside_markers}")
-                                return raw_message_inside_markers 
-                        
-                        # Adiciona à mensagem APENAS se não for newline/cr (a menos que sejam parte válida da mensagem)
-                        # O Arduino envia <RESP:MSG>\n. O \n é o terminador da linha, não da mensagem encapsulada.
-                        # Esta lógica deve capturar apenas o que está entre < e >.
-                        # O \n após o END_MARKER é consumido pela próxima iteração do read(1) e ignorado
-                        # se message_started for resetado ou se o char for \n.
-                        # Não precisamos mais do `char not in ['\r', '\n']` aqui se o Arduino
-                        # só envia \n APÓS o END_MARKER.
-                        raw_message_inside_markers += char
-
-                except UnicodeDecodeError:
-                    # print(f"UnicodeDecodeError: byte problemático: {byte}") # Debug
-                    pass # Ignora bytes que não podem ser decodificados
-                except Exception as e:
-                    print(f"Erro durante leitura da serial: {e}")
-                    # return f"{RESP_FAIL}:READ_ERROR_PY" # Pode ser melhor continuar tentando até o timeout
-            
-            time.sleep(0.005) # Pequena pausa para não sobrecarregar CPU e dar tempo para mais bytes chegarem
+        adaptive = timeout_seconds is None
+        if adaptive:
+            timeout_seconds = _response_timeout()
+        start_time = time.monotonic()
+        last_rx_time = start_time
+        resends = 0
+        while True:
+            # Quadros extras que chegaram no mesmo bloco ficam na fila para as próximas chamadas
+            raw_message_inside_markers = _next_frame()
+            if raw_message_inside_markers is not None:
+                _command_tracker.frame()
+                if _wire_tracer.level:
+                    _wire_tracer.frame(raw_message_inside_markers)
+                if raw_message_inside_markers == f"{RESP_PREFIX}{RESP_NAK}" and resends < FRAME_MAX_RESENDS:
+                    # O comando chegou corrompido no Arduino: manda os mesmos bytes de novo
+                    resends += 1
+                    _command_tracker.retry(_last_command[0])
+                    _send_control_frame(_last_command[1])
+                    continue
+                if raw_message_inside_markers.startswith(RESP_PREFIX):
+                    response = raw_message_inside_markers[len(RESP_PREFIX):]
+                    if slot_map is not None and slot_map.observe(response):
+                        _save_session_cache() # STORED/DELETED: o mapa de IDs gravado acompanha o sensor
+                    return response
+                # Pode ser uma mensagem de debug do Arduino não formatada
+                return raw_message_inside_markers
+
+            now = time.monotonic()
+            if _heartbeat_enabled and now - last_rx_time >= HEARTBEAT_DEAD_AFTER:
+                return _link_down(f"nenhum byte (nem heartbeat) em {HEARTBEAT_DEAD_AFTER}s")
+            if now - start_time >= timeout_seconds and not (
+                    adaptive and _heartbeat_enabled and now - start_time < RESPONSE_TIMEOUT):
+                break
+
+            try:
+                # Lê tudo que já estiver disponível de uma vez; se não houver nada,
+                # bloqueia em read(1) até chegar um byte ou estourar o timeout da porta
+                # (timeout=0.1 em connect_arduino), sem sleep entre as leituras.
+                data = arduino_serial.read(arduino_serial.in_waiting or 1)
+            except serial.SerialException as e:
+                print(f"Erro durante leitura da serial: {e}")
+                return _link_down(str(e))
+            if data:
+                last_rx_time = time.monotonic()
+            _command_tracker.received(len(data))
+            if _wire_tracer.level and data:
+                _wire_tracer.rx(data)
+            _frame_parser.feed(data)
 
         # Timeout ocorreu
-        print(f"ARDUINO -> PYTHON: TIMEOUT (após {timeout_seconds}s ao esperar por '{START_MARKER}...{END_MARKER}')")
-        if buffer_debug: print(f"   Buffer parcial recebido durante timeout: '{buffer_debug.strip()}'")
-        if raw_message_inside_markers: print(f"   Mensagem parcial entre marcadores: '{raw_message_inside_markers}'")
+        if quiet:
+            return f"{RESP_FAIL}:TIMEOUT_PY"
+        _command_tracker.timeout()
+        print(f"ARDUINO -> PYTHON: TIMEOUT (após {time.monotonic() - start_time:.1f}s ao esperar por '{START_MARKER}...{END_MARKER}')")
+        if _frame_parser.buffer:
+            print(f"   Mensagem parcial recebida durante timeout: '{_frame_parser.buffer[:200].decode('utf-8', errors='ignore').strip()}'")
+        _wire_tracer.dump("timeout", WIRE_TRACE_DUMP_BYTES)
         return f"{RESP_FAIL}:TIMEOUT_PY" # Retorna um erro padrão de timeout do Python
     
     print("Erro: Arduino não conectado para leitura.")
     return f"{RESP_FAIL}:NO_CONNECTION_PY"
 
 
+def get_template_store():
+    # None se outro processo (bulk_transfer.py...) está com o banco aberto; tenta de novo no próximo uso
+    global template_store
+    if template_store is None:
+        try:
+            template_store = TemplateStore(TEMPLATE_STORE_DIR)
+        except StoreLockedError as e:
+            print(f"Banco de templates do PC indisponível: {e}.")
+    return template_store
+
+
+def log_event(kind, outcome, user_id=NO_ID, confidence=0):
+    # Resultado de identificação/cadastro no event_log.py (só memória aqui; a gravação é numa thread)
+    global event_log
+    if not EVENT_LOG_DIR:
+        return
+    if event_log is None:
+        event_log = EventLog(EVENT_LOG_DIR)
+    event_log.record(kind, outcome, user_id, confidence)
+
+
+def get_similarity_index():
+    # None com DUPLICATE_CHECK desligado, sem NumPy ou com o banco aberto por outro processo
+    global similarity_index, DUPLICATE_CHECK
+    if similarity_index is None and DUPLICATE_CHECK:
+        try:
+            from similarity_index import SimilarityIndex # NumPy só é necessário para a checagem
+        except ImportError:
+            print("NumPy não instalado: checagem de cadastro duplicado desligada.")
+            DUPLICATE_CHECK = False
+            return None
+        store = get_template_store()
+        if store is None:
+            return None
+        similarity_index = SimilarityIndex(store)
+    return similarity_index
+
+
+def ask_enroll_download():
+    # Com DUPLICATE_CHECK o download não é opcional: a checagem precisa do template
+    if DUPLICATE_CHECK:
+        print("O template será baixado para o PC (necessário para a checagem de cadastro duplicado).")
+        return True
+    return input("Deseja fazer o download do template para o PC? (s/N): ").strip().lower() == 's'
+
+
+def confirm_enroll_not_duplicate(user_id, template):
+    # Chamado antes do STORE_MODEL, com o modelo pendente no CharBuffer1 e o template baixado
+    # dele. Quem decide se é a mesma digital é o sensor: o SEARCH_B1 procura o modelo no flash,
+    # e os candidatos do índice de similaridade (banco do PC, que pode ter IDs fora do flash)
+    # são conferidos com UPLOAD_TPL_B2 + MATCH_B2. O score do índice é só um pré-filtro (ver
+    # similarity_index.py). Retorna False se era um duplicado e o usuário desistiu do cadastro.
+    if not DUPLICATE_CHECK:
+        return True
+    start = time.perf_counter()
+    duplicates = []
+    found = search_sensor_flash()
+    if found is not None and found[0] != user_id: # Regravar o mesmo ID não é duplicado
+        duplicates.append(found)
+    index = get_similarity_index()
+    if index is not None:
+        skip = {user_id} | {template_id for template_id, _ in duplicates}
+        candidates = [template_id for template_id, _ in index.find_duplicates(template, DUPLICATE_MIN_SCORE)
+                      if template_id not in skip]
+        for template_id in candidates[:HOST_MATCH_TOP_K]:
+            confidence = match_on_sensor(get_template_store().get(template_id))
+            if confidence is not None:
+                duplicates.append((template_id, confidence))
+    metrics.record_span('duplicate_check', time.perf_counter() - start)
+    if not duplicates:
+        return True
+    for template_id, confidence in duplicates:
+        print(f"O sensor reconheceu a mesma digital já cadastrada no ID {template_id} (confiança {confidence}).")
+    return input("Gravar mesmo assim? (s/N): ").strip().lower() == 's'
+
+
+def search_sensor_flash():
+    # SEARCH_B1: procura o CharBuffer1 no flash do sensor. Retorna (ID, confiança) ou None
+    if not send_to_arduino(CMD_SEARCH_B1): return None
+    response = read_arduino_response()
+    if RESP_ID_FOUND in response: # Ex: ID_FOUND:12,CONFIDENCE:150
+        try:
+            sensor_id, confidence = response.split(f"{RESP_ID_FOUND}:")[1].split(",CONFIDENCE:")
+            return int(sensor_id), int(confidence)
+        except ValueError:
+            print(f"Resposta de ID_FOUND mal formatada do Arduino: {response}")
+    elif RESP_NOT_FOUND not in response:
+        print(f"Falha na busca no flash do sensor: {response}")
+    return None
+
+
+def match_on_sensor(template):
+    # Confere um template do banco do PC no sensor: UPLOAD_TPL_B2 (o CharBuffer1, com o probe
+    # ou o modelo pendente, fica intacto) + MATCH_B2. Retorna a pontuação do sensor ou None
+    # se não bateu (ou se não deu para comparar).
+    if template is None or not upload_template_b2(template):
+        return None
+    if not send_to_arduino(CMD_MATCH_B2): return None
+    response = read_arduino_response()
+    if response.startswith(f"{RESP_OK}:MATCHED:"):
+        return int(response.rsplit(":", 1)[1])
+    if response != RESP_NO_MATCH:
+        print(f"Falha na comparação no sensor: {response}")
+    return None
+
+
+def upload_template_b2(template):
+    # Manda o template para o CharBuffer2: chunks crus + soma, um ACK por chunk (como no
+    # upload_template_b1 do async_client.py). Retorna True se o sensor recebeu tudo.
+    if not send_to_arduino(CMD_UPLOAD_TEMPLATE_B2): return False
+    response = read_arduino_response(timeout_seconds=5)
+    if f"{RESP_OK}:UPLOAD_READY" not in response:
+        if RESP_UNKNOWN_COMMAND in response:
+            print("O sketch do Arduino não tem o comando UPLOAD_TPL_B2 (conferência no sensor indisponível).")
+        else:
+            print(f"Falha ao iniciar o upload do template: {response}")
+        return False
+    for offset in range(0, TEMPLATE_SIZE, DATA_PACKET_PAYLOAD_SIZE):
+        chunk = bytes(template[offset:offset + DATA_PACKET_PAYLOAD_SIZE])
+        data = chunk + (sum(chunk) & 0xFFFF).to_bytes(TEMPLATE_BIN_CHECKSUM_SIZE, 'big')
+        _command_tracker.sent_raw(len(data))
+        if _wire_tracer.level:
+            _wire_tracer.tx(data)
+        arduino_serial.write(data)
+        arduino_serial.flush()
+        response = read_arduino_response(timeout_seconds=5)
+        if f"{RESP_OK}:UPLOAD_CHUNK_ACK:{offset + len(chunk)}" not in response:
+            print(f"Falha no upload do template (offset {offset}): {response}")
+            return False
+    response = read_arduino_response(timeout_seconds=5)
+    return f"{RESP_OK}:TEMPLATE_UPLOAD_COMPLETE" in response
+
+
+def save_enroll_template(user_id, template):
+    # Só depois do OK:STORED:ID: o banco do PC (e o índice de duplicados) não pode ter
+    # template de um ID que não está no flash
+    store = get_template_store()
+    if store is None:
+        print(f"Template do ID {user_id} não foi salvo no banco local do PC.")
+        return
+    store.put(user_id, template, port=SERIAL_PORT)
+    if similarity_index is not None:
+        similarity_index.add(user_id, template)
+    print(f"Template salvo no banco local do PC ({TEMPLATE_STORE_DIR}) com ID {user_id}.")
+
+
+def read_arduino_raw_into(view, timeout_seconds=RESPONSE_TIMEOUT):
+    # Lê len(view) bytes do bloco cru anunciado por TEMPLATE_BIN direto para view (memoryview)
+    if _frame_parser.framed:
+        # No v2 o bloco chegou junto com o quadro (ver FrameParser)
+        if len(_framed_raw) < len(view):
+            print(f"Erro: bloco binário menor que o esperado ({len(_framed_raw)}/{len(view)} bytes).")
+            return False
+        view[:] = _framed_raw[:len(view)]
+        del _framed_raw[:len(view)]
+        return True
+    filled = 0
+    start_time = time.monotonic()
+    last_rx_time = start_time
+    while True:
+        filled += _frame_parser.read_raw(view[filled:])
+        if filled == len(view):
+            return True
+        if not _frame_parser.raw_pending:
+            print(f"Erro: bloco binário terminou antes do esperado ({filled}/{len(view)} bytes).")
+            _wire_tracer.dump("bloco binário incompleto", WIRE_TRACE_DUMP_BYTES)
+            return False
+        now = time.monotonic()
+        if _heartbeat_enabled and now - last_rx_time >= HEARTBEAT_DEAD_AFTER:
+            _link_down(f"bloco binário parou em {filled}/{len(view)} bytes")
+            return False
+        if now - start_time >= timeout_seconds:
+            print(f"ARDUINO -> PYTHON: TIMEOUT no bloco binário ({filled}/{len(view)} bytes)")
+            _command_tracker.timeout()
+            _wire_tracer.dump("timeout no bloco binário", WIRE_TRACE_DUMP_BYTES)
+            return False
+        try:
+            data = arduino_serial.read(arduino_serial.in_waiting or 1)
+        except serial.SerialException as e:
+            print(f"Erro durante leitura da serial: {e}")
+            _link_down(str(e))
+            return False
+        if data:
+            last_rx_time = time.monotonic()
+        _command_tracker.received(len(data))
+        if _wire_tracer.level and data:
+            _wire_tracer.rx(data)
+        _frame_parser.feed(data)
+
+
+@metrics.span('download_template')
+def download_template_b1():
+    # Baixa o template do CharBuffer1 do sensor. Retorna um bytearray de TEMPLATE_SIZE ou None.
+    # Os chunks (binários ou HEX) são decodificados e conferidos à medida que chegam,
+    # direto no buffer pré-alocado.
+    command = CMD_DOWNLOAD_TEMPLATE_B1
+    if TEMPLATE_TRANSFER_BINARY:
+        command = f"{CMD_DOWNLOAD_TEMPLATE_B1},{TPL_MODE_BIN}"
+    if not send_to_arduino(command): # Comando para o Arduino
+        print("Falha ao enviar comando de download para o Arduino.")
+        return None
+
+    # A primeira resposta deve ser TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED (ou ..._BIN)
+    ack_response = read_arduino_response()
+    if not (RESP_OK in ack_response and "TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED" in ack_response):
+        print(f"Arduino não confirmou o início da transferência do template. Resposta: {ack_response}")
+        return None
+    binary_mode = ack_response.endswith(f"_{TPL_MODE_BIN}")
+    print(f"Arduino confirmou início da transferência do template (modo {'binário' if binary_mode else 'HEX'})...")
+
+    template = bytearray(TEMPLATE_SIZE)
+    template_view = memoryview(template)
+    checksum = bytearray(TEMPLATE_BIN_CHECKSUM_SIZE)
+    received = 0
+    start_time = time.monotonic()
+
+    while True: # Loop até fim ou erro claro
+        arduino_reply = read_arduino_response()
+
+        if arduino_reply.startswith(f"{RESP_TEMPLATE_BIN}:"):
+            chunk_len = int(arduino_reply.split(":", 1)[1]) # Já validado pelo FrameParser
+            if chunk_len <= 0 or received + chunk_len > TEMPLATE_SIZE:
+                print(f"ERRO: chunk binário inválido ({arduino_reply}) com {received} bytes já recebidos.")
+                return None
+            chunk_view = template_view[received:received + chunk_len]
+            if not read_arduino_raw_into(chunk_view) or not read_arduino_raw_into(memoryview(checksum)):
+                return None
+            # v2: CRC do chunk (o FrameParser já pediu de novo os que chegaram corrompidos)
+            if _frame_parser.framed:
+                chunk_ok = frame_crc(chunk_view) == int.from_bytes(checksum, 'big')
+            else:
+                chunk_ok = sum(chunk_view) & 0xFFFF == int.from_bytes(checksum, 'big')
+            if not chunk_ok:
+                print(f"ERRO: soma do chunk binário não confere (offset {received}).")
+                _wire_tracer.dump("soma do chunk binário", WIRE_TRACE_DUMP_BYTES)
+                return None
+            received += chunk_len
+        elif arduino_reply.startswith(f"{RESP_TEMPLATE_CHUNK}:"):
+            hex_chunk = arduino_reply.split(":", 1)[1]
+            chunk_len = len(hex_chunk) // 2
+            if len(hex_chunk) % 2 or received + chunk_len > TEMPLATE_SIZE:
+                print(f"ERRO: chunk HEX inválido ({len(hex_chunk)} caracteres) com {received} bytes já recebidos.")
+                return None
+            try:
+                template_view[received:received + chunk_len] = bytes.fromhex(hex_chunk)
+            except ValueError as e:
+                print(f"Erro ao converter chunk do template de HEX para bytes: {e}")
+                return None
+            received += chunk_len
+        elif arduino_reply.startswith("DBG:"):
+            print(f"ARDUINO DEBUG: {arduino_reply[4:]}")
+            # Apenas loga, continua esperando o próximo pacote de dados ou finalização
+        elif RESP_OK in arduino_reply and "TEMPLATE_DOWNLOAD_COMPLETE" in arduino_reply:
+            try:
+                bytes_downloaded_count_from_arduino = int(arduino_reply.split(":")[-1])
+            except ValueError:
+                print(f"Resposta de fim de download mal formatada: {arduino_reply}")
+                return None
+            print(f"Arduino reportou download completo: {bytes_downloaded_count_from_arduino} bytes.")
+            if received == TEMPLATE_SIZE and bytes_downloaded_count_from_arduino == TEMPLATE_SIZE:
+                elapsed_ms = (time.monotonic() - start_time) * 1000
+                print(f"Template reconstruído com sucesso ({received} bytes em {elapsed_ms:.0f} ms).")
+                return template
+            print(f"ERRO: Discrepância no tamanho! Python reconstruiu {received} (esperava {TEMPLATE_SIZE}), Arduino reportou {bytes_downloaded_count_from_arduino}")
+            return None
+        elif f"{RESP_FAIL}:TIMEOUT_PY" in arduino_reply: # Timeout do read_arduino_response
+            print("Timeout geral esperando dados/fim do template do Arduino.")
+            return None
+        elif f"{RESP_FAIL}:LINK_DOWN_PY" in arduino_reply:
+            print("Link com o Arduino caiu durante o download do template.")
+            return None
+        elif RESP_FAIL in arduino_reply: # Uma falha explícita do Arduino durante a transferência
+            print(f"Falha na transferência do template reportada pelo Arduino: {arduino_reply}")
+            return None
+        else:
+            print(f"Resposta inesperada durante download do template: {arduino_reply}")
+            _wire_tracer.dump("resposta inesperada no download", WIRE_TRACE_DUMP_BYTES)
+            # Aqui pode ser um problema, talvez quebrar o loop ou ter um contador de erros
+
+
 # --- Funções de interação (enroll_finger_interactive, identify_current_finger, etc.) ---
 # As funções de interação (enroll, identify, count) permanecem praticamente as mesmas,
 # pois a lógica de enviar comandos e esperar respostas específicas é mantida.
 # Apenas certifique-se que as strings de resposta esperadas (RESP_OK:IMAGE1_TAKEN, etc.)
 # correspondem exatamente ao que o Arduino envia.
 
-def enroll_finger_interactive():
-    if not arduino_serial:
-        print("Arduino não conectado.")
-        return
-
-    # Obter ID do usuário
-    user_id_str = ""
-    user_id = -1
+def ask_enroll_id():
+    # Obter ID do usuário (0 = cancelar). Com o mapa local de IDs, ID ocupado ou acima da
+    # capacidade é recusado aqui, antes do cadastro começar, e Enter usa o primeiro ID livre.
+    local = _slot_map_ready()
+    capacity = local.capacity if local else (sensor_capacity or DEFAULT_SENSOR_CAPACITY)
+    suggestion = local.first_free() if local else None
+    if local and suggestion is None:
+        print(f"Sensor cheio ({local.count} digitais): apague uma antes de cadastrar outra.")
+        return 0
+    hint = f", Enter = {suggestion}" if suggestion else ""
     while True:
+        answer = input(f"Digite o ID para o novo cadastro (1-{capacity}{hint}, ou 0 para cancelar): ").strip()
+        if not answer and suggestion:
+            return suggestion
         try:
-            user_id_str = input("Digite o ID para o novo cadastro (1-127, ou 0 para cancelar): ")
-            user_id = int(user_id_str)
-            # A capacidade real será verificada pelo Arduino, mas uma checagem básica aqui é boa.
-            if 0 <= user_id <= 127: 
-                break
-            else:
-                print("ID inválido. Deve ser entre 1 e 127 (ou 0 para cancelar).")
+            user_id = int(answer)
         except ValueError:
             print("Por favor, digite um número.")
-    
+            continue
+        if user_id == 0:
+            return 0
+        if not 0 < user_id <= capacity:
+            print(f"ID inválido. Deve ser entre 1 e {capacity} (ou 0 para cancelar).")
+        elif local and local.is_occupied(user_id):
+            print(f"O ID {user_id} já tem uma digital no sensor (apague-a antes). Próximo livre: {local.first_free(user_id) or suggestion}.")
+        else:
+            return user_id
+
+
+# Mensagens para o usuário a cada evento dos comandos *_AUTO
+AUTO_EVENT_MESSAGES = {
+    RESP_ASK_PLACE_FINGER: "Coloque o dedo no sensor...",
+    RESP_ASK_REMOVE_FINGER: "Retire o dedo do sensor...",
+    RESP_ASK_PLACE_AGAIN: "Coloque o MESMO dedo novamente no sensor...",
+}
+
+
+def run_auto_command(command_payload, on_event=None):
+    # Manda um comando *_AUTO e consome os eventos EVT: até a resposta final, que é retornada
+    if not send_to_arduino(command_payload):
+        return f"{RESP_FAIL}:SEND_FAIL_PY"
+    while True:
+        response = read_arduino_response(timeout_seconds=AUTO_EVENT_TIMEOUT)
+        if not response.startswith(f"{RESP_EVENT}:"):
+            return response
+        event = response[len(RESP_EVENT) + 1:]
+        if on_event:
+            on_event(event)
+        elif event in AUTO_EVENT_MESSAGES:
+            print(AUTO_EVENT_MESSAGES[event])
+
+
+@metrics.span('enroll_auto', _command_tracker)
+def enroll_finger_auto():
+    # Cadastro com ENROLL_AUTO: o Arduino avança sozinho pelos passos, sem Enter entre eles.
+    # Se o sketch não conhece o comando, segue no modo passo a passo.
+    if not arduino_serial:
+        print("Arduino não conectado.")
+        return
+
+    user_id = ask_enroll_id()
+    if user_id == 0:
+        print("Cadastro cancelado.")
+        return
+    download = ask_enroll_download()
+    full_template_bytes = None
+
+    print(f"\nIniciando cadastro automático para ID: {user_id}")
+    command = f"{CMD_ENROLL_AUTO},{user_id}"
+    if download:
+        command += f",{AUTO_MODE_NOSTORE}" # Baixa antes de gravar no flash
+    response = run_auto_command(command)
+    if RESP_UNKNOWN_COMMAND in response:
+        print("Sketch sem ENROLL_AUTO, usando o cadastro passo a passo.")
+        _command_tracker.retry(CMD_ENROLL)
+        enroll_finger_interactive(user_id)
+        return
+
+    if download and f"{RESP_OK}:MODEL_PENDING:{user_id}" in response:
+        full_template_bytes = download_template_b1()
+        if full_template_bytes is not None and not confirm_enroll_not_duplicate(user_id, full_template_bytes):
+            print("Cadastro cancelado: o modelo não foi gravado no sensor.")
+            log_event('enroll', 'DUPLICATE', user_id)
+            return
+        if not send_to_arduino(CMD_STORE_MODEL): return
+        response = read_arduino_response()
+
+    if f"{RESP_OK}:STORED:{user_id}" in response:
+        print(f"Digital armazenada com sucesso no flash do sensor para o ID {user_id}!")
+        if full_template_bytes is not None:
+            save_enroll_template(user_id, full_template_bytes)
+        log_event('enroll', 'STORED', user_id)
+    elif RESP_ENROLL_MISMATCH in response:
+        print("As digitais não correspondem. Tente novamente.")
+        log_event('enroll', 'MISMATCH', user_id)
+    elif RESP_NO_FINGER in response:
+        print("Nenhum dedo detectado a tempo.")
+        log_event('enroll', 'NO_FINGER', user_id)
+    else:
+        print(f"Falha no cadastro: {response}")
+        log_event('enroll', 'FAIL', user_id)
+
+
+@metrics.span('enroll', _command_tracker)
+def enroll_finger_interactive(user_id=None):
+    if not arduino_serial:
+        print("Arduino não conectado.")
+        return
+
+    if user_id is None:
+        user_id = ask_enroll_id()
     if user_id == 0:
         print("Cadastro cancelado.")
         return
@@ -290,71 +1095,20 @@ def enroll_finger_interactive():
     if f"{RESP_OK}:MODEL_CREATED" not in response: # Arduino envia OK:MODEL_CREATED
         if RESP_ENROLL_MISMATCH in response: # Checa se o erro específico foi mismatch
             print("As digitais não correspondem. Tente novamente.")
+            log_event('enroll', 'MISMATCH', user_id)
         else:
             print(f"Falha ao criar modelo: {response}")
+            log_event('enroll', 'FAIL', user_id)
         return
-    full_template_bytes = None # Inicializa
-    choice_download = input("Deseja fazer o download do template para o PC? (s/N): ").strip().lower()
+    full_template_bytes = None # Inicializa; vai para o banco do PC só depois do OK:STORED
     
-    if choice_download == 's':
+    if ask_enroll_download():
         print("Solicitando download do template do sensor (do CharBuffer1)...")
-        if send_to_arduino(CMD_DOWNLOAD_TEMPLATE_B1): # Comando para o Arduino
-            template_hex_parts = []
-            bytes_downloaded_count_from_arduino = 0
-            transfer_successful = False
-
-            # Loop para receber os chunks do template
-            # A primeira resposta deve ser TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED
-            ack_response = read_arduino_response(timeout_seconds=5)
-            if RESP_OK in ack_response and "TEMPLATE_UPLOAD_CMD_ACKNOWLEDGED" in ack_response:
-                print("Arduino confirmou início da transferência do template...")
-                
-                received_all_expected = False # Flag para indicar se o download foi OK
-                while not received_all_expected: # Loop até fim ou erro claro
-                    arduino_reply = read_arduino_response(timeout_seconds=15) # Timeout um pouco maior
-
-                    if arduino_reply.startswith("TEMPLATE_CHUNK:"):
-                        hex_chunk = arduino_reply.split(":", 1)[1]
-                        template_hex_parts.append(hex_chunk)
-                    elif arduino_reply.startswith("DBG:"):
-                        print(f"ARDUINO DEBUG: {arduino_reply[4:]}")
-                        # Apenas loga, continua esperando o próximo pacote de dados ou finalização
-                    elif RESP_OK in arduino_reply and "TEMPLATE_DOWNLOAD_COMPLETE" in arduino_reply:
-                        try:
-                            bytes_downloaded_count_from_arduino = int(arduino_reply.split(":")[-1])
-                            print(f"Arduino reportou download completo: {bytes_downloaded_count_from_arduino} bytes.")
-                            full_hex_string = "".join(template_hex_parts)
-                            full_template_bytes = bytes.fromhex(full_hex_string)
-                            
-                            # TEMPLATE_SIZE é 512 bytes.
-                            # Cada chunk tem 128 bytes (DATA_PACKET_PAYLOAD_SIZE no Arduino)
-                            # Então esperamos 512 / 128 = 4 chunks.
-                            expected_template_size = 512 # Defina isso no Python
-                            if len(full_template_bytes) == expected_template_size and \
-                            bytes_downloaded_count_from_arduino == expected_template_size:
-                                print(f"Template reconstruído com sucesso ({len(full_template_bytes)} bytes).")
-                                transfer_successful = True
-                            else:
-                                print(f"ERRO: Discrepância no tamanho! Python reconstruiu {len(full_template_bytes)} (esperava {expected_template_size}), Arduino reportou {bytes_downloaded_count_from_arduino}")
-                        except ValueError as e:
-                            print(f"Erro ao converter template de HEX para bytes: {e}")
-                        except Exception as e:
-                            print(f"Erro inesperado ao finalizar template: {e}")
-                        received_all_expected = True # Sai do loop while
-                    elif RESP_FAIL in arduino_reply: # Uma falha explícita do Arduino durante a transferência
-                        print(f"Falha na transferência do template reportada pelo Arduino: {arduino_reply}")
-                        received_all_expected = True # Sai do loop while
-                        transfer_successful = False
-                    elif f"{RESP_FAIL}:TIMEOUT_PY" in arduino_reply: # Timeout do read_arduino_response
-                        print("Timeout geral esperando dados/fim do template do Arduino.")
-                        received_all_expected = True # Sai do loop while
-                        transfer_successful = False
-                    else:
-                        print(f"Resposta inesperada durante download do template: {arduino_reply}")
-                        # Aqui pode ser um problema, talvez quebrar o loop ou ter um contador de erros
-            # ... (resto da lógica para salvar se transfer_successful) ...
-        else:
-            print("Falha ao enviar comando de download para o Arduino.")
+        full_template_bytes = download_template_b1()
+        if full_template_bytes is not None and not confirm_enroll_not_duplicate(user_id, full_template_bytes):
+            print("Cadastro cancelado: o modelo não foi gravado no sensor.")
+            log_event('enroll', 'DUPLICATE', user_id)
+            return
         # print("Solicitando download do template do sensor (MODO DUMP BRUTO)...")
         # if send_to_arduino(CMD_DOWNLOAD_TEMPLATE_B1):
         #     raw_dump_hex = ""
@@ -423,13 +1177,18 @@ def enroll_finger_interactive():
         response = read_arduino_response() 
         if f"{RESP_OK}:STORED:{user_id}" in response:
             print(f"Digital armazenada com sucesso no flash do sensor para o ID {user_id}!")
+            if full_template_bytes is not None:
+                save_enroll_template(user_id, full_template_bytes)
+            log_event('enroll', 'STORED', user_id)
         else:
             print(f"Falha ao armazenar modelo no flash do sensor: {response}")
+            log_event('enroll', 'FAIL', user_id)
     else:
         print("Modelo não será armazenado no flash do sensor.")
 
 
 
+@metrics.span('identify', _command_tracker)
 def identify_current_finger():
     if not arduino_serial:
         print("Arduino não conectado.")
@@ -454,8 +1213,10 @@ def identify_current_finger():
     if f"{RESP_OK}:IMAGE_TAKEN" not in response: # Arduino envia OK:IMAGE_TAKEN
         if RESP_NO_FINGER in response:
             print("Nenhum dedo detectado.")
+            log_event('identify', 'NO_FINGER')
         else:
             print(f"Falha ao capturar imagem para identificação: {response}")
+            log_event('identify', 'FAIL')
         return
 
     # Python envia comando para Arduino converter a imagem
@@ -463,13 +1224,36 @@ def identify_current_finger():
     response = read_arduino_response() 
     if f"{RESP_OK}:CONVERT_DONE" not in response: # Arduino envia OK:CONVERT_DONE
         print(f"Falha ao converter imagem para identificação: {response}")
+        log_event('identify', 'FAIL')
         return
     
     # Arduino agora faz a busca automaticamente e envia o resultado.
     # Python apenas espera pela resposta final da busca.
     print("Aguardando resultado da busca do Arduino...")
-    response = read_arduino_response(timeout_seconds=10) # A busca pode demorar um pouco
-    
+    response = read_arduino_response() # A busca pode demorar um pouco (o timeout aprendido do IMAGE_TO_TZ1 já inclui ela)
+    print_identify_result(response)
+
+
+@metrics.span('identify_auto', _command_tracker)
+def identify_finger_auto():
+    # Identificação com IDENTIFY_AUTO: um comando só, o Arduino espera o dedo sozinho.
+    if not arduino_serial:
+        print("Arduino não conectado.")
+        return
+    print("\nIniciando identificação automática...")
+    response = run_auto_command(CMD_IDENTIFY_AUTO)
+    if RESP_UNKNOWN_COMMAND in response:
+        print("Sketch sem IDENTIFY_AUTO, usando a identificação passo a passo.")
+        _command_tracker.retry(CMD_IDENTIFY)
+        identify_current_finger()
+    elif RESP_NO_FINGER in response:
+        print("Nenhum dedo detectado.")
+        log_event('identify', 'NO_FINGER')
+    else:
+        print_identify_result(response)
+
+
+def print_identify_result(response):
     if RESP_ID_FOUND in response: # Ex: ID_FOUND:12,CONFIDENCE:150
         try:
             # A resposta já vem limpa do RESP_PREFIX por read_arduino_response
@@ -478,20 +1262,104 @@ def identify_current_finger():
             sensor_id = parts_id.split(",CONFIDENCE:")[0]    # "12"
             confidence = parts_id.split(",CONFIDENCE:")[1]   # "150"
             print(f"Digital encontrada! ID do Sensor: {sensor_id}, Confiança: {confidence}")
-        except IndexError:
+            log_event('identify', 'FOUND', int(sensor_id), int(confidence))
+        except (IndexError, ValueError):
             print(f"Resposta de ID_FOUND mal formatada do Arduino: {response}")
+            log_event('identify', 'FAIL')
     elif RESP_NOT_FOUND in response:
         print("Digital não encontrada no banco de dados do sensor.")
+        log_event('identify', 'NOT_FOUND')
     elif RESP_FAIL in response: # Se houve alguma falha genérica no processo
         print(f"Falha na busca da digital: {response}")
+        log_event('identify', 'FAIL')
     else:
         print(f"Resposta inesperada do Arduino durante a busca: {response}")
+        log_event('identify', 'FAIL')
+
+
+@metrics.span('identify_host', _command_tracker)
+def identify_finger_host():
+    # Identificação pelo banco do PC: o sensor captura o probe, que é baixado e comparado
+    # com todos os templates do TemplateStore; os melhores candidatos são conferidos no sensor.
+    global template_matcher
+    if not arduino_serial:
+        print("Arduino não conectado.")
+        return
+    if template_matcher is None:
+        from matcher import TemplateMatcher # NumPy só é necessário para este modo
+        store = get_template_store()
+        if store is None:
+            return
+        template_matcher = TemplateMatcher(store, workers=HOST_MATCH_WORKERS)
+
+    print("\nIniciando identificação pelo banco do PC...")
+    if not send_to_arduino(f"{CMD_IDENTIFY},{IDENTIFY_MODE_HOST}"): return
+
+    response = read_arduino_response()
+    if RESP_ASK_PLACE_FINGER not in response:
+        print(f"Erro no fluxo de identificação (esperava {RESP_ASK_PLACE_FINGER}): {response}")
+        return
+
+    input("Coloque o dedo no sensor para identificação e pressione Enter...")
+    if not send_to_arduino(CMD_GET_IMAGE): return
+
+    response = read_arduino_response()
+    if f"{RESP_OK}:IMAGE_TAKEN" not in response:
+        if RESP_NO_FINGER in response:
+            print("Nenhum dedo detectado.")
+            log_event('identify_host', 'NO_FINGER')
+        else:
+            print(f"Falha ao capturar imagem para identificação: {response}")
+            log_event('identify_host', 'FAIL')
+        return
+
+    if not send_to_arduino(CMD_IMAGE_TO_TZ1): return
+    response = read_arduino_response()
+    if f"{RESP_OK}:CONVERT_DONE" not in response:
+        print(f"Falha ao converter imagem para identificação: {response}")
+        log_event('identify_host', 'FAIL')
+        return
+
+    probe = download_template_b1()
+    if probe is None:
+        print("Falha ao baixar o probe do sensor.")
+        log_event('identify_host', 'FAIL')
+        return
+
+    start_time = time.perf_counter()
+    candidates = template_matcher.top_k(probe, HOST_MATCH_TOP_K)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    metrics.record_span('host_match', elapsed_ms / 1000)
+    if not candidates:
+        print("Banco de templates do PC está vazio.")
+        log_event('identify_host', 'NOT_FOUND')
+        return
+    print(f"Busca 1:N em {len(template_matcher)} templates levou {elapsed_ms:.1f} ms. Candidatos:")
+    for template_id, score in candidates:
+        print(f"   ID {template_id}: score {score:.3f}")
+
+    # O probe é uma captura só e os templates do banco vêm do CREATE_MODEL: o score de bytes
+    # crus só ordena os candidatos. Quem diz se é a mesma digital é o sensor (o probe continua
+    # no CharBuffer1; cada candidato vai para o CharBuffer2 e passa pelo MATCH_B2).
+    store = get_template_store()
+    for template_id, _ in candidates:
+        confidence = match_on_sensor(store.get(template_id))
+        if confidence is not None:
+            print(f"Digital encontrada no banco do PC! ID {template_id}, confiança do sensor {confidence}")
+            log_event('identify_host', 'FOUND', template_id, confidence)
+            return
+    print(f"Digital não encontrada no banco do PC (o sensor não confirmou nenhum dos {len(candidates)} candidatos).")
+    log_event('identify_host', 'NOT_FOUND')
 
 
 def get_sensor_template_count():
     if not arduino_serial:
         print("Arduino não conectado.")
         return
+    local = _slot_map_ready()
+    if local is not None:
+        print(f"\nTemplates armazenados no sensor: {local.count} (mapa local, {local.capacity - local.count} IDs livres)")
+        return
     print("\nSolicitando contagem de templates...")
     if not send_to_arduino(CMD_COUNT): return
     
@@ -508,6 +1376,63 @@ def get_sensor_template_count():
         print(f"Resposta inesperada para contagem de templates: {response}")
 
 
+def delete_sensor_template():
+    if not arduino_serial:
+        print("Arduino não conectado.")
+        return
+    try:
+        user_id = int(input("Digite o ID a apagar do sensor (0 para cancelar): "))
+    except ValueError:
+        print("Por favor, digite um número.")
+        return
+    if user_id == 0:
+        print("Remoção cancelada.")
+        return
+    local = _slot_map_ready()
+    if local and not local.in_range(user_id):
+        print(f"ID inválido. Deve ser entre 1 e {local.capacity}.")
+        return
+    if local and not local.is_occupied(user_id):
+        print(f"O ID {user_id} já está livre no sensor.")
+        return
+
+    if not send_to_arduino(f"{CMD_DELETE},{user_id}"): return
+    response = read_arduino_response() # OK:DELETED:ID (o mapa local já foi atualizado na leitura)
+    if f"{RESP_OK}:DELETED:{user_id}" in response:
+        print(f"Digital do ID {user_id} apagada do sensor.")
+        # O banco do PC segue o flash: um template velho do ID apontaria duplicados que não existem mais
+        store = get_template_store()
+        if store is not None and store.delete(user_id):
+            if similarity_index is not None:
+                similarity_index.remove(user_id)
+            print(f"Template do ID {user_id} removido do banco local do PC.")
+    elif RESP_UNKNOWN_COMMAND in response:
+        print("O sketch do Arduino não tem o comando DELETE.")
+    else:
+        print(f"Falha ao apagar a digital: {response}")
+
+
+def print_metrics():
+    # Resumo das latências por comando e por fluxo (p50/p95 pelos buckets do histograma)
+    _command_tracker.finish()
+    snapshot = metrics.snapshot()
+    if not snapshot['commands'] and not snapshot['spans']:
+        print("Nenhuma métrica registrada ainda.")
+        return
+    def fmt(seconds):
+        return "-" if seconds is None else f"<={seconds * 1000:.0f} ms"
+    print(f"\n{'Comando':<18} {'envios':>6} {'1º byte p50':>12} {'fim p50':>10} {'fim p95':>10} {'timeouts':>8} {'retries':>7}")
+    for name, stats in sorted(snapshot['commands'].items()):
+        final = stats['final_frame_seconds']
+        print(f"{name:<18} {stats['sent']:>6} {fmt(stats['first_byte_seconds']['p50']):>12} "
+              f"{fmt(final['p50']):>10} {fmt(final['p95']):>10} {stats['timeouts']:>8} {stats['retries']:>7}")
+    for name, span in sorted(snapshot['spans'].items()):
+        print(f"Fluxo {name}: {span['count']}x, média {span['sum'] / span['count'] * 1000:.0f} ms, p95 {fmt(span['p95'])}")
+    if METRICS_EXPORT_PATH:
+        metrics.write_prometheus(METRICS_EXPORT_PATH)
+        print(f"Métricas gravadas em {METRICS_EXPORT_PATH}.")
+
+
 def main_menu():
     global arduino_serial
     if not connect_arduino(): # Tenta conectar e inicializar o sensor
@@ -515,20 +1440,37 @@ def main_menu():
         return
 
     while True:
+        if arduino_serial is None and AUTO_RECONNECT and not reconnect_arduino():
+            print("Arduino desconectado: as opções que usam o sensor vão falhar até a reconexão.")
         print("\n--- Menu Principal ---")
         print("1. Cadastrar nova digital")
         print("2. Identificar digital")
         print("3. Obter contagem de templates no sensor")
-        print("4. Sair")
+        print("4. Identificar digital (banco do PC)")
+        print("5. Mostrar métricas de latência")
+        print("6. Apagar digital do sensor")
+        print("7. Sair")
         choice = input("Escolha uma opção: ").strip()
 
         if choice == '1':
-            enroll_finger_interactive()
+            if USE_AUTO_COMMANDS:
+                enroll_finger_auto()
+            else:
+                enroll_finger_interactive()
         elif choice == '2':
-            identify_current_finger()
+            if USE_AUTO_COMMANDS:
+                identify_finger_auto()
+            else:
+                identify_current_finger()
         elif choice == '3':
             get_sensor_template_count()
         elif choice == '4':
+            identify_finger_host()
+        elif choice == '5':
+            print_metrics()
+        elif choice == '6':
+            delete_sensor_template()
+        elif choice == '7':
             print("Saindo...")
             break
         else:
@@ -537,6 +1479,15 @@ def main_menu():
     if arduino_serial and arduino_serial.is_open:
         arduino_serial.close()
         print("Porta serial fechada.")
+    if template_matcher is not None:
+        template_matcher.close()
+    if event_log is not None:
+        event_log.close()
+    if template_store is not None:
+        template_store.close()
+    if METRICS_EXPORT_PATH:
+        _command_tracker.finish()
+        metrics.write_prometheus(METRICS_EXPORT_PATH)
 
 if __name__ == '__main__':
     main_menu()
\ No newline at end of file
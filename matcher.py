@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from protocol import TEMPLATE_SIZE
+
+# Busca 1:N no PC sobre os templates do TemplateStore.
+#
+# O score é a similaridade de bits entre os templates de 512 bytes
+# (1 - distância de Hamming / 4096 bits). Não é o matcher de minúcias do sensor:
+# serve para ranquear candidatos sem o limite de slots do flash. O top-k pode ser
+# confirmado no sensor depois, se necessário.
+#
+# A matriz (N, 512) fica empacotada em memória e é comparada em lote como (N, 64) uint64:
+# XOR com o probe + contagem de bits. Com workers > 0 as linhas são divididas entre
+# processos, que leem a matriz de uma memória compartilhada.
+
+TEMPLATE_BITS = TEMPLATE_SIZE * 8
+_WORDS = TEMPLATE_SIZE // 8
+
+if hasattr(np, 'bitwise_count'): # NumPy >= 2.0
+    def _popcount_rows(words):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount_rows(words):
+        return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def hamming_distances(words, probe_words):
+    # words: (N, 64) uint64, probe_words: (64,) uint64 -> (N,) bits diferentes
+    return _popcount_rows(np.bitwise_xor(words, probe_words))
+
+
+def _top_k(distances, k):
+    k = min(k, len(distances))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    best = np.argpartition(distances, k - 1)[:k]
+    return best[np.argsort(distances[best], kind='stable')]
+
+
+def _shard_top_k(shm_name, rows, start, stop, probe, k):
+    # Executado nos processos do pool: compara só as linhas [start, stop)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        words = np.ndarray((rows, _WORDS), dtype=np.uint64, buffer=shm.buf)[start:stop]
+        distances = hamming_distances(words, np.frombuffer(probe, dtype=np.uint64))
+        best = _top_k(distances, k)
+        return best + start, distances[best]
+    finally:
+        del words
+        shm.close()
+
+
+class TemplateMatcher:
+
+    def __init__(self, store, workers=0):
+        self.store = store
+        self.workers = workers # 0 = tudo no processo atual
+        self._version = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._words = np.empty((0, _WORDS), dtype=np.uint64)
+        self._shm = None
+        self._pool = None
+
+    def refresh(self):
+        # Reempacota a matriz só se o banco mudou desde a última busca
+        if self._version == self.store.version:
+            return
+        version = self.store.version
+        ids, data = self.store.packed()
+        self._ids = np.array(ids, dtype=np.int64)
+        if self.workers:
+            self._release_shared()
+            self._shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            self._shm.buf[:len(data)] = data
+            self._words = np.ndarray((len(ids), _WORDS), dtype=np.uint64, buffer=self._shm.buf)
+        else:
+            self._words = np.frombuffer(data, dtype=np.uint64).reshape(len(ids), _WORDS)
+        self._version = version
+
+    def __len__(self):
+        self.refresh()
+        return len(self._ids)
+
+    def scores(self, probe):
+        # Score de todos os templates (mesma ordem de store.packed())
+        self.refresh()
+        distances = hamming_distances(self._words, self._probe_words(probe))
+        return 1.0 - distances / TEMPLATE_BITS
+
+    def top_k(self, probe, k=5):
+        # Lista de (ID, score) dos k templates mais parecidos, do melhor para o pior
+        self.refresh()
+        probe_words = self._probe_words(probe)
+        if self.workers and len(self._ids) >= self.workers * 1024:
+            rows, distances = self._top_k_parallel(probe_words, k)
+        else:
+            all_distances = hamming_distances(self._words, probe_words)
+            rows = _top_k(all_distances, k)
+            distances = all_distances[rows]
+        return [(int(self._ids[row]), 1.0 - int(d) / TEMPLATE_BITS) for row, d in zip(rows, distances)]
+
+    def _top_k_parallel(self, probe_words, k):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        rows = len(self._ids)
+        step = -(-rows // self.workers)
+        futures = [
+            self._pool.submit(_shard_top_k, self._shm.name, rows, start, min(start + step, rows), probe_words.tobytes(), k)
+            for start in range(0, rows, step)
+        ]
+        shard_rows, shard_distances = zip(*(f.result() for f in futures))
+        candidate_rows = np.concatenate(shard_rows)
+        candidate_distances = np.concatenate(shard_distances)
+        best = _top_k(candidate_distances, k)
+        return candidate_rows[best], candidate_distances[best]
+
+    def _probe_words(self, probe):
+        if len(probe) != TEMPLATE_SIZE:
+            raise ValueError(f"Probe deve ter {TEMPLATE_SIZE} bytes (recebido {len(probe)})")
+        return np.frombuffer(bytes(probe), dtype=np.uint64)
+
+    def _release_shared(self):
+        if self._shm is not None:
+            self._words = np.empty((0, _WORDS), dtype=np.uint64)
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._release_shared()
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) - 1)
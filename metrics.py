@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Métricas de latência do protocolo, leves o bastante para ficarem sempre ligadas.
+#
+# Para cada comando (ENROLL, IDENTIFY, GET_IMAGE, IMAGE_TO_TZ1, DOWNLOAD_TPL_B1, ...):
+#   - envio -> primeiro byte da resposta e envio -> último quadro antes do próximo comando
+#   - bytes enviados/recebidos, timeouts e retentativas
+# e spans para fluxos inteiros (cadastro, identificação...).
+#
+# As latências vão para histogramas de buckets fixos (memória constante, sem guardar as
+# amostras). snapshot() devolve tudo num dict; write_prometheus()/write_json() gravam em
+# arquivo (formato texto do Prometheus, para o node_exporter textfile collector, ou JSON).
+#
+# Cada conexão usa um CommandTracker, que sabe qual comando está em andamento e atribui
+# a ele os bytes e quadros que chegam.
+
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 60) # s
+METRIC_PREFIX = 'fingerprint'
+
+
+def command_name(command_payload):
+    # "ENROLL,12" -> "ENROLL" (o valor não entra no nome, para o número de séries ficar fixo)
+    return command_payload.split(',', 1)[0]
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Último bucket = acima do maior limite (+Inf)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Limite superior do bucket onde cai o quantil q (estimativa, como no Prometheus)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'buckets': dict(zip([*map(str, self.bounds), '+Inf'], self.counts)),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class _CommandStats:
+    __slots__ = ('sent', 'first_byte', 'final_frame', 'bytes_sent', 'bytes_received', 'timeouts', 'retries')
+
+    def __init__(self):
+        self.sent = 0
+        self.first_byte = Histogram()
+        self.final_frame = Histogram()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        self.retries = 0
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {} # nome do comando -> _CommandStats
+        self._spans = {}    # nome do span -> Histogram
+        self.started_at = time.time()
+
+    def _stats(self, name):
+        stats = self._commands.get(name)
+        if stats is None:
+            stats = self._commands[name] = _CommandStats()
+        return stats
+
+    def record_command(self, name, bytes_sent, bytes_received, first_byte_s, final_frame_s):
+        with self._lock:
+            stats = self._stats(name)
+            stats.sent += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            if first_byte_s is not None:
+                stats.first_byte.observe(first_byte_s)
+            if final_frame_s is not None:
+                stats.final_frame.observe(final_frame_s)
+
+    def record_timeout(self, name):
+        with self._lock:
+            self._stats(name).timeouts += 1
+
+    def record_retry(self, name):
+        with self._lock:
+            self._stats(name).retries += 1
+
+    def latency_quantile(self, name, q, min_samples=1):
+        # Quantil q (limite do bucket) de envio -> último quadro do comando, ou None com menos de min_samples
+        with self._lock:
+            stats = self._commands.get(name)
+            if stats is None or stats.final_frame.count < min_samples:
+                return None
+            return stats.final_frame.quantile(q)
+
+    def record_span(self, name, seconds):
+        with self._lock:
+            histogram = self._spans.get(name)
+            if histogram is None:
+                histogram = self._spans[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, name, tracker=None):
+        # with metrics.span("enroll"): ... (também serve como decorador).
+        # Com tracker, fecha o comando em andamento no fim do span.
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            if tracker is not None:
+                tracker.finish()
+            self.record_span(name, time.perf_counter() - start_time)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'commands': {
+                    name: {
+                        'sent': stats.sent,
+                        'first_byte_seconds': stats.first_byte.snapshot(),
+                        'final_frame_seconds': stats.final_frame.snapshot(),
+                        'bytes_sent': stats.bytes_sent,
+                        'bytes_received': stats.bytes_received,
+                        'timeouts': stats.timeouts,
+                        'retries': stats.retries,
+                    }
+                    for name, stats in self._commands.items()
+                },
+                'spans': {name: histogram.snapshot() for name, histogram in self._spans.items()},
+            }
+
+    def to_prometheus(self):
+        lines = []
+
+        def histogram_lines(metric, help_text, label, histograms):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.bounds), '+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.total}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+
+        def counter_lines(metric, help_text, attribute):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, stats in commands:
+                lines.append(f'{metric}{{command="{name}"}} {getattr(stats, attribute)}')
+
+        with self._lock:
+            commands = sorted(self._commands.items())
+            histogram_lines(f"{METRIC_PREFIX}_command_first_byte_seconds", "Envio do comando ate o primeiro byte da resposta",
+                            'command', [(name, stats.first_byte) for name, stats in commands])
+            histogram_lines(f"{METRIC_PREFIX}_command_final_frame_seconds", "Envio do comando ate o ultimo quadro da resposta",
+                            'command', [(name, stats.final_frame) for name, stats in commands])
+            counter_lines(f"{METRIC_PREFIX}_commands_total", "Comandos enviados", 'sent')
+            counter_lines(f"{METRIC_PREFIX}_command_bytes_sent_total", "Bytes enviados ao Arduino", 'bytes_sent')
+            counter_lines(f"{METRIC_PREFIX}_command_bytes_received_total", "Bytes recebidos do Arduino", 'bytes_received')
+            counter_lines(f"{METRIC_PREFIX}_command_timeouts_total", "Respostas que estouraram o timeout", 'timeouts')
+            counter_lines(f"{METRIC_PREFIX}_command_retries_total", "Comandos repetidos ou refeitos por outro caminho", 'retries')
+            histogram_lines(f"{METRIC_PREFIX}_span_seconds", "Duracao dos fluxos (cadastro, identificacao...)",
+                            'span', sorted(self._spans.items()))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.to_prometheus())
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.snapshot(), indent=2))
+
+
+def _write_atomic(path, text):
+    # O coletor nunca vê um arquivo pela metade
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class CommandTracker:
+    # Comando em andamento numa conexão. sent() fecha o anterior e abre o próximo;
+    # received()/frame() marcam o primeiro byte e o último quadro.
+
+    __slots__ = ('metrics', '_name', '_sent_at', '_first_byte_at', '_last_frame_at', '_bytes_sent', '_bytes_received')
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._name = None
+
+    @property
+    def current(self):
+        # Nome do comando em andamento (ou None)
+        return self._name
+
+    def sent(self, command_payload, nbytes):
+        self.finish()
+        self._name = command_name(command_payload)
+        self._sent_at = time.perf_counter()
+        self._first_byte_at = None
+        self._last_frame_at = None
+        self._bytes_sent = nbytes
+        self._bytes_received = 0
+
+    def sent_raw(self, nbytes):
+        # Bytes crus (UPLOAD_TPL_B1) contam para o comando em andamento
+        if self._name is not None:
+            self._bytes_sent += nbytes
+
+    def received(self, nbytes):
+        if self._name is None or not nbytes:
+            return
+        if self._first_byte_at is None:
+            self._first_byte_at = time.perf_counter()
+        self._bytes_received += nbytes
+
+    def frame(self):
+        if self._name is not None:
+            self._last_frame_at = time.perf_counter()
+
+    def timeout(self):
+        if self._name is not None:
+            self.metrics.record_timeout(self._name)
+
+    def retry(self, command_payload):
+        self.metrics.record_retry(command_name(command_payload))
+
+    def finish(self):
+        if self._name is None:
+            return
+        first_byte = self._first_byte_at - self._sent_at if self._first_byte_at is not None else None
+        final_frame = self._last_frame_at - self._sent_at if self._last_frame_at is not None else None
+        self.metrics.record_command(self._name, self._bytes_sent, self._bytes_received, first_byte, final_frame)
+        self._name = None
+
+
+# Instância padrão do processo (main.py, daemon, clientes asyncio)
+metrics = Metrics()
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import time
+
+from async_client import AsyncFingerprintClient, SensorError
+
+# Vários leitores no mesmo processo.
+#
+# O controlador abre e inicializa todos os sensores em paralelo (o tempo de partida é o
+# do sensor mais lento, não a soma). Os usuários são distribuídos entre os flashes dos
+# sensores (shards) para passar do limite de slots de um sensor só: cada ID global é
+# mapeado para (sensor, slot) em SHARD_MAP_FILE.
+#
+# Identificação: o probe é capturado no leitor onde o dedo foi colocado e buscado em
+# todos os flashes ao mesmo tempo (SEARCH_B1 no próprio leitor, UPLOAD_TPL_B1 + SEARCH_B1
+# nos outros). O primeiro ID_FOUND confiável vence e as outras buscas são canceladas.
+
+SHARD_MAP_FILE = 'shard_map.json'
+MIN_CONFIDENCE = 50 # Confiança mínima (do sensor) para aceitar um ID_FOUND
+
+
+class MultiSensorController:
+
+    def __init__(self, clients, shard_map_path=SHARD_MAP_FILE):
+        self.clients = list(clients)
+        self.shard_map_path = shard_map_path
+        self._shards = self._load_shard_map() # ID global -> (nome do sensor, slot)
+
+    @classmethod
+    async def open(cls, ports, baudrate=9600, shard_map_path=SHARD_MAP_FILE):
+        # Abre e inicializa todas as portas em paralelo com o AsyncFingerprintClient.connect()
+        # (PING até o sketch responder depois do reset do DTR, INIT_SENSOR de novo a cada
+        # ARDUINO_READY_FOR_INIT). Se um sensor falhar, fecha os que abriram.
+        start_time = time.perf_counter()
+        results = await asyncio.gather(*(AsyncFingerprintClient.connect(port, baudrate) for port in ports),
+                                       return_exceptions=True)
+        clients = [result for result in results if not isinstance(result, BaseException)]
+        for port, result in zip(ports, results):
+            if isinstance(result, BaseException):
+                await asyncio.gather(*(client.close() for client in clients))
+                raise SensorError(str(result) or type(result).__name__, f"INIT_SENSOR em {port}")
+        for client in clients:
+            print(f"Sensor {client.name}: capacidade {client.capacity}")
+        print(f"{len(clients)} sensores prontos em {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        return cls(clients, shard_map_path)
+
+    async def init_all(self):
+        # Reinicializa os sensores já abertos (mesma espera pelo boot do init_sensor)
+        results = await asyncio.gather(*(client.init_sensor() for client in self.clients), return_exceptions=True)
+        for client, result in zip(self.clients, results):
+            if isinstance(result, Exception):
+                raise SensorError(str(result), f"INIT_SENSOR em {client.name}")
+            print(f"Sensor {client.name}: capacidade {client.capacity}")
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients))
+
+    # --- Mapa de shards ---
+
+    def _load_shard_map(self):
+        if not os.path.exists(self.shard_map_path):
+            return {}
+        with open(self.shard_map_path, encoding='utf-8') as f:
+            return {int(user_id): (sensor, slot) for user_id, (sensor, slot) in json.load(f).items()}
+
+    def _save_shard_map(self):
+        tmp_path = self.shard_map_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(user_id): list(shard) for user_id, shard in self._shards.items()}, f)
+        os.replace(tmp_path, self.shard_map_path)
+
+    def _used_slots(self, client):
+        return {slot for sensor, slot in self._shards.values() if sensor == client.name}
+
+    def _pick_shard(self):
+        # Sensor com mais slots livres e o menor slot livre nele
+        best = None
+        for client in self.clients:
+            used = self._used_slots(client)
+            free = (client.capacity or 0) - len(used)
+            if free > 0 and (best is None or free > best[1]):
+                best = (client, free, used)
+        if best is None:
+            raise SensorError("Todos os sensores estão cheios", "ENROLL")
+        client, _, used = best
+        slot = next(s for s in range(1, client.capacity + 1) if s not in used)
+        return client, slot
+
+    def lookup(self, sensor_name, slot):
+        for user_id, shard in self._shards.items():
+            if shard == (sensor_name, slot):
+                return user_id
+        return None
+
+    # --- Operações ---
+
+    async def enroll(self, user_id, reader_index=0, on_prompt=None):
+        # Captura no leitor reader_index e grava no shard escolhido (que pode ser outro sensor)
+        if user_id in self._shards:
+            raise ValueError(f"ID {user_id} já cadastrado em {self._shards[user_id]}")
+        reader = self.clients[reader_index]
+        target, slot = self._pick_shard()
+        # O ENROLL valida o ID contra a capacidade do leitor; como o STORE é feito com STORE_B1,
+        # para outro sensor qualquer ID válido serve
+        enroll_id = slot if target is reader else 1
+        template = await reader.enroll(enroll_id, on_prompt=on_prompt, store=False, download=target is not reader)
+        if target is not reader:
+            await target.upload_template_b1(template)
+        await target.store_b1(slot)
+        self._shards[user_id] = (target.name, slot)
+        self._save_shard_map()
+        return target.name, slot
+
+    async def identify(self, reader_index=0, on_prompt=None, min_confidence=MIN_CONFIDENCE):
+        # Retorna (ID global, nome do sensor, slot, confiança) ou None
+        reader = self.clients[reader_index]
+        start_time = time.perf_counter()
+        if len(self.clients) == 1:
+            match = await reader.identify(on_prompt=on_prompt)
+            return self._resolve(reader, match, min_confidence)
+
+        probe = await reader.capture_probe_template(on_prompt=on_prompt)
+        searches = {asyncio.create_task(self._search(client, client is reader, probe)): client
+                    for client in self.clients}
+        result = None
+        try:
+            pending = set(searches)
+            while pending and result is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        print(f"Busca em {searches[task].name} falhou: {task.exception()}")
+                        continue
+                    result = self._resolve(searches[task], task.result(), min_confidence)
+                    if result is not None:
+                        break
+        finally:
+            for task in searches:
+                task.cancel()
+            await asyncio.gather(*searches, return_exceptions=True)
+        print(f"Identificação em {len(self.clients)} sensores levou {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        return result
+
+    async def _search(self, client, probe_in_buffer, probe):
+        if not probe_in_buffer:
+            await client.upload_template_b1(probe)
+        return await client.search_b1()
+
+    def _resolve(self, client, match, min_confidence):
+        if match is None:
+            return None
+        slot, confidence = match
+        if confidence < min_confidence:
+            return None
+        return self.lookup(client.name, slot), client.name, slot, confidence
@@ -0,0 +1,382 @@
+import binascii
+from collections import deque
+
+# Delimitadores
+START_MARKER = '<'
+END_MARKER = '>'
+
+# --- Constantes para Comandos (Python para Arduino) ---
+CMD_INIT_SENSOR = "INIT_SENSOR" # Novo comando
+CMD_ENROLL = "ENROLL"
+CMD_IDENTIFY = "IDENTIFY"
+CMD_DELETE = "DELETE" # <DELETE,ID>: apaga o template do ID (OK:DELETED:ID)
+CMD_COUNT = "COUNT"
+CMD_EMPTY = "EMPTY"   # Não implementado no Arduino ainda
+CMD_GET_IMAGE = "GET_IMAGE"
+CMD_IMAGE_TO_TZ1 = "IMAGE_TO_TZ1"
+CMD_IMAGE_TO_TZ2 = "IMAGE_TO_TZ2"
+CMD_CREATE_MODEL = "CREATE_MODEL"
+CMD_STORE_MODEL = "STORE_MODEL"
+CMD_REMOVE_FINGER_ACK = "REMOVE_FINGER_ACK"
+CMD_DOWNLOAD_TEMPLATE_B1 = "DOWNLOAD_TPL_B1"
+CMD_ENROLL_AUTO = "ENROLL_AUTO"     # <ENROLL_AUTO,ID[,NOSTORE]>: cadastro inteiro num comando (eventos EVT:)
+CMD_IDENTIFY_AUTO = "IDENTIFY_AUTO" # Identificação inteira num comando (eventos EVT:)
+AUTO_MODE_NOSTORE = "NOSTORE"       # ENROLL_AUTO termina em OK:MODEL_PENDING:ID, sem gravar
+CMD_UPLOAD_TEMPLATE_B1 = "UPLOAD_TPL_B1" # PC -> CharBuffer1 (chunks crus + soma, um ACK por chunk)
+CMD_SEARCH_B1 = "SEARCH_B1" # Busca o CharBuffer1 no flash do sensor (ID_FOUND / NOT_FOUND)
+CMD_STORE_B1 = "STORE_B1"   # <STORE_B1,ID>: grava o CharBuffer1 no ID
+CMD_PING = "PING"       # <PING,TOKEN> -> PONG:TOKEN[,INIT:1,BAUD:230400,CAP:127] (responde mesmo antes do INIT_SENSOR)
+CMD_BAUD = "BAUD"       # <BAUD,115200>: Arduino troca a taxa e espera PING/BAUD_OK na taxa nova
+CMD_BAUD_OK = "BAUD_OK" # Confirma a nova taxa (sem isso o Arduino volta para a anterior)
+TPL_MODE_BIN = "BIN" # <DOWNLOAD_TPL_B1,BIN>: pede a transferência binária do template
+IDENTIFY_MODE_HOST = "HOST" # <IDENTIFY,HOST>: captura o probe no CharBuffer1 sem buscar no flash do sensor
+FRAMING_MODE = "FRAMED" # <INIT_SENSOR,FRAMED>: pede o protocolo v2 (resposta termina em ,FRAMING:2)
+CMD_NAK = "NAK" # <SS:NAK,XX*CCCC> (v2): pede ao Arduino o quadro de sequência XX de novo
+CMD_HEARTBEAT = "HEARTBEAT" # <HEARTBEAT,250>: Arduino manda <RESP:HB> a cada 250 ms (0 desliga)
+CMD_INDEX = "INDEX" # <INDEX,PAGINA> -> OK:INDEX:PAGINA:HEX, ocupação de 256 IDs (1 bit cada)
+CMD_LOAD_B1 = "LOAD_B1" # <LOAD_B1,ID>: flash -> CharBuffer1 (OK:LOADED:ID), para baixar com DOWNLOAD_TPL_B1
+CMD_UPLOAD_TEMPLATE_B2 = "UPLOAD_TPL_B2" # PC -> CharBuffer2 (como o UPLOAD_TPL_B1), sem mexer no CharBuffer1
+CMD_MATCH_B2 = "MATCH_B2" # Compara CharBuffer1 e CharBuffer2 no sensor: OK:MATCHED:PONTOS ou NO_MATCH
+
+# --- Constantes para Respostas (Arduino para Python) ---
+RESP_PREFIX = "RESP:" # O Python irá remover isso ao ler
+RESP_ARDUINO_READY_FOR_INIT = "ARDUINO_READY_FOR_INIT" # Arduino pronto para receber INIT_SENSOR
+RESP_SENSOR_READY = "SENSOR_READY"
+RESP_SENSOR_ERROR = "SENSOR_ERROR"
+RESP_UNKNOWN_COMMAND = "UNKNOWN_COMMAND"
+RESP_OK = "OK"
+RESP_FAIL = "FAIL"
+RESP_COMM_ERROR = "COMM_ERROR"
+RESP_IMAGE_FAIL = "IMAGE_FAIL"
+RESP_IMAGE_MESSY = "IMAGE_MESSY"
+RESP_FEATURE_FAIL = "FEATURE_FAIL"
+RESP_NO_FINGER = "NO_FINGER"
+RESP_ENROLL_MISMATCH = "ENROLL_MISMATCH"
+RESP_BAD_LOCATION = "BAD_LOCATION"
+RESP_FLASH_ERROR = "FLASH_ERROR"
+RESP_NOT_FOUND = "NOT_FOUND"
+RESP_NO_MATCH = "NO_MATCH"
+RESP_ASK_PLACE_FINGER = "ASK_PLACE_FINGER"
+RESP_ASK_REMOVE_FINGER = "ASK_REMOVE_FINGER"
+RESP_ASK_PLACE_AGAIN = "ASK_PLACE_AGAIN"
+RESP_FINGER_REMOVED = "FINGER_REMOVED"
+RESP_ID_FOUND = "ID_FOUND"
+RESP_COUNT_RESULT = "COUNT_RESULT"
+RESP_PONG = "PONG"
+RESP_EVENT = "EVT" # <RESP:EVT:IMAGE1_TAKEN> etc.: progresso dos comandos *_AUTO
+RESP_TEMPLATE_CHUNK = "TEMPLATE_CHUNK" # Chunk em HEX
+RESP_TEMPLATE_BIN = "TEMPLATE_BIN"     # <RESP:TEMPLATE_BIN:LEN> + LEN bytes crus + soma do payload (2 bytes)
+RESP_NAK = "NAK" # (v2) O quadro do PC chegou corrompido: mande o mesmo comando de novo
+RESP_HEARTBEAT = "HB" # <RESP:HB>, sem sequência nem CRC: o FrameParser só conta e descarta
+# Adicione outras respostas conforme necessário
+
+TEMPLATE_SIZE = 512 # bytes (mesmo TEMPLATE_SIZE do Arduino)
+TEMPLATE_BIN_CHECKSUM_SIZE = 2 # Soma de 16 bits do payload, depois dos bytes crus
+DATA_PACKET_PAYLOAD_SIZE = 128 # Tamanho dos chunks do upload (DATA_PACKET_PAYLOAD_SIZE no Arduino)
+INDEX_PAGE_SLOTS = 256 # IDs por página do INDEX (ReadIndexTable do sensor, 32 bytes)
+MAX_FRAME_SIZE = 4096 # Quadro parcial maior que isso é descartado (o maior quadro real é um chunk HEX, ~300 bytes)
+
+# --- Protocolo v2 (negociado no INIT_SENSOR) ---
+# Cada quadro, nos dois sentidos, vira <SS:conteúdo*CCCC>: SS é o número de sequência
+# (2 dígitos hex, por sentido) e CCCC a CRC-16/CCITT (poly 0x1021, início 0xFFFF) de
+# "SS:conteúdo". No bloco cru do TEMPLATE_BIN os 2 bytes do fim são a mesma CRC do
+# payload em vez da soma. Quadro corrompido é pedido de novo na hora (NAK), sem esperar timeout.
+FRAMING_VERSION = 2
+FRAME_SEQ_MODULO = 256
+FRAME_REORDER_WINDOW = 16 # Buraco maior que isso na sequência não é pedido de novo (ressincroniza)
+_FRAME_SUFFIX_SIZE = 5 # "*CCCC"
+
+
+def frame_crc(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(seq, payload):
+    # Conteúdo de um quadro v2 (sem os marcadores)
+    body = f"{seq:02X}:{payload}"
+    return f"{body}*{frame_crc(body.encode('utf-8')):04X}"
+
+
+def decode_frame(frame):
+    # (seq, conteúdo) de um quadro v2, ou (None, frame) se estiver corrompido
+    if len(frame) >= 3 + _FRAME_SUFFIX_SIZE and frame[2] == ':' and frame[-_FRAME_SUFFIX_SIZE] == '*':
+        body = frame[:-_FRAME_SUFFIX_SIZE]
+        try:
+            seq = int(frame[:2], 16)
+            crc = int(frame[-4:], 16)
+        except ValueError:
+            return None, frame
+        if frame_crc(body.encode('utf-8')) == crc:
+            return seq, body[3:]
+    return None, frame
+
+
+def parse_pong(response, token):
+    # Estado que o sketch manda no PONG (INIT, BAUD, CAP, como inteiros); {} se o sketch é antigo
+    # (só PONG:TOKEN) e None se a resposta não é o PONG deste token
+    head, _, fields = response.partition(',')
+    if head != f"{RESP_PONG}:{token}":
+        return None
+    state = {}
+    for field in fields.split(','):
+        key, _, value = field.partition(':')
+        if key and value.isdigit():
+            state[key] = int(value)
+    return state
+
+_START_BYTE = START_MARKER.encode('ascii')
+_END_BYTE = END_MARKER.encode('ascii')
+_NEWLINE_BYTE = b'\n'
+_RAW_BLOCK_PREFIX = f"{RESP_PREFIX}{RESP_TEMPLATE_BIN}:"
+_HEARTBEAT_FRAME = f"{RESP_PREFIX}{RESP_HEARTBEAT}"
+
+
+class FrameParser:
+    # Monta quadros <...> a partir de pedaços de bytes recebidos da serial.
+    # Usa um único bytearray reutilizável: os bytes chegam em blocos (tudo que
+    # estiver disponível na porta), os quadros completos vão para uma fila e só
+    # o quadro parcial (a partir do último '<') fica guardado para o próximo bloco.
+    #
+    # Um quadro TEMPLATE_BIN anuncia um bloco de bytes crus logo depois do '>'.
+    # Enquanto raw_pending > 0 o parser não procura quadros (os bytes crus podem
+    # conter '<' e '>'); quem leu o anúncio consome o bloco com read_raw().
+    #
+    # Com framed=True (protocolo v2) cada item da fila é (seq, conteúdo) já conferido
+    # pela CRC, ou (None, quadro) se estiver corrompido. O bloco cru de um TEMPLATE_BIN
+    # é lido pelo próprio parser e vem junto: (seq, conteúdo, bytes), porque o quadro
+    # pode ficar guardado esperando a retransmissão de um anterior. Se a CRC do bloco
+    # (os 2 últimos bytes) não confere, o item é (seq, None).
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = deque()
+        self.raw_pending = 0
+        self.dropped_bytes = 0 # Bytes fora de quadro descartados (debug sem marcadores, lixo)
+        self.heartbeats = 0 # <RESP:HB> recebidos (não vão para a fila)
+        self.framed = False
+        self._raw_frame = None # (seq, conteúdo) do TEMPLATE_BIN cujo bloco está chegando (v2)
+
+    def reset(self):
+        self.buffer.clear()
+        self.frames.clear()
+        self.raw_pending = 0
+        self._raw_frame = None
+
+    def feed(self, data):
+        if data:
+            self.buffer += data
+            if self._raw_frame is not None:
+                self._collect_raw()
+            elif not self.raw_pending:
+                self._parse()
+
+    def _collect_raw(self):
+        if len(self.buffer) < self.raw_pending:
+            return
+        seq, payload = self._raw_frame
+        raw = bytes(self.buffer[:self.raw_pending])
+        if frame_crc(raw[:-TEMPLATE_BIN_CHECKSUM_SIZE]) == int.from_bytes(raw[-TEMPLATE_BIN_CHECKSUM_SIZE:], 'big'):
+            self.frames.append((seq, payload, raw))
+        else:
+            self.frames.append((seq, None))
+        del self.buffer[:self.raw_pending]
+        self.raw_pending = 0
+        self._raw_frame = None
+        self._parse()
+
+    def read_raw(self, dest):
+        # Copia para dest (memoryview) os bytes do bloco cru que já chegaram; retorna quantos copiou
+        n = min(len(dest), self.raw_pending, len(self.buffer))
+        if n:
+            dest[:n] = self.buffer[:n]
+            del self.buffer[:n]
+            self.raw_pending -= n
+            if not self.raw_pending:
+                self._parse()
+        return n
+
+    def pop_frame(self):
+        # Retorna o conteúdo do próximo quadro completo (sem os marcadores) ou None
+        if self.frames:
+            return self.frames.popleft()
+        return None
+
+    def _parse(self):
+        buf = self.buffer
+        pos = 0
+        while True:
+            end = buf.find(_END_BYTE, pos)
+            if self.framed:
+                # v2: quadros nunca têm '\n' dentro; '\n' depois de um '<' sem '>' é um quadro
+                # cujo '>' se corrompeu. Conta como corrompido (NAK) em vez de esperar o timeout.
+                newline = buf.find(_NEWLINE_BYTE, pos, end if end >= 0 else len(buf))
+                if newline >= 0:
+                    start = buf.rfind(_START_BYTE, pos, newline)
+                    if start >= 0:
+                        self.frames.append((None, buf[start + 1:newline].decode('utf-8', errors='ignore')))
+                    pos = newline + 1
+                    continue
+            if end < 0:
+                break
+            # Um '<' no meio reinicia a mensagem (mesmo comportamento do Arduino),
+            # por isso usamos o último '<' antes do '>'.
+            start = buf.rfind(_START_BYTE, pos, end)
+            # '>' sem '<' correspondente é lixo (ex.: texto de debug não formatado);
+            # no v2 é um quadro cujo '<' se corrompeu
+            if start < 0 and self.framed:
+                self.frames.append((None, buf[pos:end].decode('utf-8', errors='ignore')))
+            pos = end + 1
+            if start >= 0:
+                frame = buf[start + 1:end].decode('utf-8', errors='ignore')
+                if frame == _HEARTBEAT_FRAME:
+                    self.heartbeats += 1
+                    continue
+                if self.framed:
+                    seq, frame = decode_frame(frame)
+                    if seq is None or not frame.startswith(_RAW_BLOCK_PREFIX):
+                        self.frames.append((seq, frame))
+                        continue
+                else:
+                    self.frames.append(frame)
+                if frame.startswith(_RAW_BLOCK_PREFIX):
+                    try:
+                        self.raw_pending = int(frame[len(_RAW_BLOCK_PREFIX):]) + TEMPLATE_BIN_CHECKSUM_SIZE
+                    except ValueError:
+                        pass # Anúncio mal formado: segue tratando como texto
+                    if self.raw_pending:
+                        del buf[:pos]
+                        if self.framed:
+                            self._raw_frame = (seq, frame)
+                            self._collect_raw()
+                        return
+                    if self.framed:
+                        self.frames.append((seq, frame))
+
+        # Só o último '<' pode começar um quadro; o resto é lixo fora de quadro
+        # (o '\n' após o '>', prints do Arduino...)
+        start = buf.rfind(_START_BYTE, pos)
+        if start < 0:
+            self.dropped_bytes += len(buf) - pos
+            buf.clear()
+        else:
+            self.dropped_bytes += start - pos
+            del buf[:start]
+            if len(buf) > MAX_FRAME_SIZE:
+                # '<' sem '>' e texto continuando a chegar: descarta para a memória não crescer
+                self.dropped_bytes += len(buf)
+                buf.clear()
+
+
+class FrameSequencer:
+    # Protocolo v2: entrega os quadros do Arduino na ordem da sequência. Um quadro
+    # corrompido ou um buraco na sequência gera NAK imediato dos números que faltam;
+    # os quadros que chegaram depois ficam guardados até a retransmissão chegar.
+    # expire() repete os NAK sem resposta e, depois de max_requests pedidos, desiste
+    # do quadro. Repetidos (retransmissão de algo já entregue) são descartados.
+
+    def __init__(self):
+        self.ready = deque() # (seq, item) já na ordem
+        self.expected = 0
+        self.corrupted = 0
+        self.lost = 0
+        self.duplicates = 0
+        self._held = {}    # seq -> item, à frente de um buraco
+        self._missing = {} # seq -> [instante do último NAK, NAKs enviados]
+        self._suspect = 0 # Quadros corrompidos que podem não ter sido pedidos de novo
+
+    def reset(self, expected=0):
+        self.ready.clear()
+        self._held.clear()
+        self._missing.clear()
+        self._suspect = 0
+        self.expected = expected
+
+    def push(self, seq, item, now):
+        # Recebe um quadro (seq None = corrompido); retorna os números a pedir de novo
+        if seq is None:
+            # Não dá para saber qual era: pede o próximo esperado (de novo, se a própria
+            # retransmissão se corrompeu) e lembra de pedir o seguinte quando alcançarmos
+            self.corrupted += 1
+            self._suspect = min(self._suspect + 1, FRAME_REORDER_WINDOW)
+            self._missing.pop(self.expected, None)
+            return self._request([self.expected], now)
+        ahead = (seq - self.expected) % FRAME_SEQ_MODULO
+        if ahead == 0:
+            self._deliver(seq, item)
+            if self._suspect and not self._held and self.expected not in self._missing:
+                # Alcançamos tudo que chegou; o corrompido pode ter sido o quadro seguinte
+                # (ex.: a resposta final, que não tem um quadro depois para revelar o buraco).
+                # Vários corrompidos podem ter sido vários quadros seguidos: um pedido por quadro.
+                self._suspect -= 1
+                return self._request([self.expected], now)
+            return []
+        if ahead >= FRAME_SEQ_MODULO // 2 or seq in self._held:
+            self.duplicates += 1
+            return []
+        if ahead > FRAME_REORDER_WINDOW:
+            # Perdemos a conta (muito lixo, Arduino reiniciado...): recomeça deste quadro
+            self.lost += ahead
+            self._skip_to(seq)
+            self._deliver(seq, item)
+            return []
+        self._held[seq] = item
+        self._missing.pop(seq, None)
+        return self._request([(self.expected + i) % FRAME_SEQ_MODULO for i in range(ahead)
+                              if (self.expected + i) % FRAME_SEQ_MODULO not in self._held], now)
+
+    def reject(self, seq, now):
+        # Quadro com número legível mas conteúdo corrompido (CRC do bloco cru): pede ele
+        # de novo, mesmo que já tenha sido pedido (a retransmissão também pode se corromper)
+        self.corrupted += 1
+        ahead = (seq - self.expected) % FRAME_SEQ_MODULO
+        if ahead >= FRAME_SEQ_MODULO // 2 or ahead > FRAME_REORDER_WINDOW or seq in self._held:
+            return []
+        self._missing.pop(seq, None)
+        return self._request([(self.expected + i) % FRAME_SEQ_MODULO for i in range(ahead + 1)
+                              if (self.expected + i) % FRAME_SEQ_MODULO not in self._held], now)
+
+    def expire(self, now, timeout, max_requests):
+        # Retorna os números a pedir de novo (NAK sem resposta há timeout segundos). Depois de
+        # max_requests pedidos desiste do quadro; só pula o número se algo depois dele já chegou
+        # (senão o quadro pode simplesmente não ter sido enviado ainda).
+        again = []
+        for seq, request in list(self._missing.items()):
+            if now - request[0] < timeout:
+                continue
+            if request[1] < max_requests:
+                request[0] = now
+                request[1] += 1
+                again.append(seq)
+            elif not self._held:
+                del self._missing[seq] # Pode ser pedido de novo no próximo quadro corrompido
+                self._suspect = 0 # Nada depois dele: os corrompidos já foram todos recuperados
+        while self._held and self.expected in self._missing and self.expected not in again \
+                and now - self._missing[self.expected][0] >= timeout:
+            self.lost += 1
+            self._skip_to((self.expected + 1) % FRAME_SEQ_MODULO)
+            self._drain()
+        return [seq for seq in again if seq in self._missing]
+
+    def _request(self, seqs, now):
+        seqs = [seq for seq in seqs if seq not in self._missing]
+        for seq in seqs:
+            self._missing[seq] = [now, 1]
+        return seqs
+
+    def _skip_to(self, seq):
+        while self.expected != seq:
+            self._missing.pop(self.expected, None)
+            item = self._held.pop(self.expected, None)
+            if item is not None:
+                self.ready.append((self.expected, item))
+            self.expected = (self.expected + 1) % FRAME_SEQ_MODULO
+
+    def _deliver(self, seq, item):
+        self._missing.pop(seq, None)
+        self.ready.append((seq, item))
+        self.expected = (seq + 1) % FRAME_SEQ_MODULO
+        self._drain()
+
+    def _drain(self):
+        while self.expected in self._held:
+            self._deliver(self.expected, self._held.pop(self.expected))
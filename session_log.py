@@ -0,0 +1,290 @@
+import contextlib
+import io
+import struct
+import sys
+import time
+
+# Gravação e reprodução de sessões seriais.
+#
+# RecordingSerial embrulha a porta (serial.Serial) e grava num log binário, append-only,
+# cada bloco escrito e cada bloco lido, com o instante (monotônico) em que passou pela
+# porta. O custo é um struct.pack e um write bufferizado por bloco; o arquivo é descarregado
+# no máximo uma vez por FLUSH_INTERVAL.
+#
+# ReplaySerial lê o log e faz o papel da porta para o código do PC: os bytes recebidos
+# ficam disponíveis no mesmo intervalo (depois do comando enviado que os precedeu) que na
+# sessão original, multiplicado por 1/speed, ou imediatamente com speed=None. Assim uma
+# sessão real pode ser reexecutada contra um parser/transporte novo (replay_session).
+#
+# Formato: cabeçalho de sessão (MAGIC, versão, hora de início) seguido de registros
+#   <B tipo><Q microssegundos desde o início da sessão><H tamanho> + dados
+# Um arquivo pode ter várias sessões (uma por abertura da porta).
+#
+#   python session_log.py info sessao.log
+#   python session_log.py replay sessao.log [velocidade]   (sem velocidade: o mais rápido possível)
+
+MAGIC = b'FPSL'
+VERSION = 1
+FLUSH_INTERVAL = 1.0 # s
+REPLAY_READ_TIMEOUT = 60 # s; os bytes estão no log, então só esperamos o horário deles
+RECORD_TX = 0   # PC -> Arduino
+RECORD_RX = 1   # Arduino -> PC
+RECORD_BAUD = 2 # Troca da taxa da porta (dados = taxa nova, uint32)
+_SESSION_HEADER = struct.Struct('<4sBd')
+_RECORD_HEADER = struct.Struct('<BQH')
+_MAX_RECORD_DATA = 0xFFFF
+
+
+class RecordingSerial:
+    # Mesma interface do serial.Serial usada pelo main.py; o resto é repassado à porta
+
+    def __init__(self, port, log_path):
+        self._port = port
+        self._log = open(log_path, 'ab')
+        self._log.write(_SESSION_HEADER.pack(MAGIC, VERSION, time.time()))
+        self._start = time.monotonic()
+        self._last_flush = self._start
+
+    def _record(self, kind, data):
+        now = time.monotonic()
+        elapsed_us = int((now - self._start) * 1_000_000)
+        for offset in range(0, len(data), _MAX_RECORD_DATA):
+            chunk = data[offset:offset + _MAX_RECORD_DATA]
+            self._log.write(_RECORD_HEADER.pack(kind, elapsed_us, len(chunk)))
+            self._log.write(chunk)
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._log.flush()
+            self._last_flush = now
+
+    def write(self, data):
+        written = self._port.write(data)
+        self._record(RECORD_TX, bytes(data))
+        return written
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        if data:
+            self._record(RECORD_RX, data)
+        return data
+
+    @property
+    def baudrate(self):
+        return self._port.baudrate
+
+    @baudrate.setter
+    def baudrate(self, rate):
+        self._port.baudrate = rate
+        self._record(RECORD_BAUD, struct.pack('<I', rate))
+
+    @property
+    def dtr(self):
+        return self._port.dtr
+
+    @dtr.setter
+    def dtr(self, state):
+        self._port.dtr = state # Sem registro: o reset aparece no log como o ARDUINO_READY_FOR_INIT
+
+    def close(self):
+        self._port.close()
+        self._log.close()
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+
+def read_sessions(log_path):
+    # Lista de sessões; cada uma é (hora de início, [(tipo, segundos, dados), ...])
+    sessions = []
+    with open(log_path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos + _SESSION_HEADER.size <= len(data):
+        if data[pos:pos + 4] == MAGIC:
+            _, version, started_at = _SESSION_HEADER.unpack_from(data, pos)
+            if version != VERSION:
+                raise ValueError(f"Versão de log desconhecida: {version}")
+            records = []
+            sessions.append((started_at, records))
+            pos += _SESSION_HEADER.size
+            continue
+        if not sessions or pos + _RECORD_HEADER.size > len(data):
+            break
+        kind, elapsed_us, length = _RECORD_HEADER.unpack_from(data, pos)
+        pos += _RECORD_HEADER.size
+        if pos + length > len(data):
+            break # Registro cortado no fim (processo morto antes do flush)
+        records.append((kind, elapsed_us / 1_000_000, data[pos:pos + length]))
+        pos += length
+    return sessions
+
+
+class ReplaySerial:
+    # Porta falsa que reproduz os bytes recebidos de uma sessão gravada
+
+    def __init__(self, records, speed=1.0, timeout=0.1):
+        self.timeout = timeout
+        self.is_open = True
+        self.baudrate = 9600
+        self.speed = speed
+        self.divergences = 0 # Bytes escritos pelo PC diferentes dos da sessão original
+        self._records = [r for r in records if r[0] != RECORD_BAUD]
+        self._index = 0
+        self._anchor_original = 0.0 # Instante original do último envio (ou do início)
+        self._anchor_replay = time.monotonic()
+        self._tx_pending = b'' # Parte do próximo envio gravado ainda não escrita pelo PC
+        self._rx = bytearray()  # Bytes já liberados e ainda não lidos
+
+    def _due(self, original_time):
+        if self.speed is None:
+            return self._anchor_replay
+        return self._anchor_replay + (original_time - self._anchor_original) / self.speed
+
+    def _release(self):
+        # Libera os registros RX cujo horário já chegou, parando no próximo envio do PC
+        now = time.monotonic()
+        while self._index < len(self._records):
+            kind, original_time, data = self._records[self._index]
+            if kind != RECORD_RX or self._due(original_time) > now:
+                return
+            self._rx += data
+            self._index += 1
+
+    def _next_rx_due(self):
+        if self._index < len(self._records):
+            kind, original_time, _ = self._records[self._index]
+            if kind == RECORD_RX:
+                return self._due(original_time)
+        return None
+
+    def waiting_for_host(self):
+        # True quando tudo até o próximo envio já foi lido (ou o log acabou)
+        self._release()
+        return not self._rx and self._next_rx_due() is None
+
+    def finished(self):
+        return self._index >= len(self._records) and not self._rx
+
+    def write(self, data):
+        data = bytes(data)
+        written = len(data)
+        while data:
+            if not self._tx_pending:
+                # Pula RX que o PC não chegou a ler antes deste envio
+                while self._index < len(self._records) and self._records[self._index][0] == RECORD_RX:
+                    self._index += 1
+                if self._index >= len(self._records):
+                    self.divergences += len(data)
+                    break
+                _, original_time, self._tx_pending = self._records[self._index]
+                self._index += 1
+                self._anchor_original = original_time
+                self._anchor_replay = time.monotonic()
+            n = min(len(data), len(self._tx_pending))
+            if data[:n] != self._tx_pending[:n]:
+                self.divergences += n
+            data = data[n:]
+            self._tx_pending = self._tx_pending[n:]
+        return written
+
+    @property
+    def in_waiting(self):
+        self._release()
+        return len(self._rx)
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            self._release()
+            if self._rx:
+                data = bytes(self._rx[:size])
+                del self._rx[:size]
+                return data
+            due = self._next_rx_due()
+            now = time.monotonic()
+            if due is None or due > deadline:
+                if deadline > now:
+                    time.sleep(deadline - now if due is None else min(deadline - now, max(due - now, 0)))
+                if time.monotonic() >= deadline:
+                    return b''
+                continue
+            time.sleep(max(due - now, 0))
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass # Bytes descartados na sessão original nunca foram lidos, então não estão no log
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def replay_session(records, speed=None):
+    # Reexecuta uma sessão pelo send_to_arduino/read_arduino_response atuais do main.py:
+    # cada comando gravado é reenviado e os quadros recebidos são lidos como na sessão.
+    # Retorna (segundos de relógio, segundos de CPU, comandos, divergências).
+    import main
+    from protocol import CMD_NAK, END_MARKER, FRAMING_VERSION, RESP_SENSOR_READY, START_MARKER, decode_frame
+    from wire_trace import TRACE_OFF
+
+    replay = ReplaySerial(records, speed=speed)
+    main.arduino_serial = replay
+    main._frame_parser.reset()
+    main._frame_parser.framed = False
+    main._heartbeat_enabled = False # O tempo da reprodução não é o da sessão: sem detecção de link morto
+    main._wire_tracer.level = TRACE_OFF
+    commands = [data for kind, _, data in records if kind == RECORD_TX]
+    parser = main._frame_parser
+    scratch = bytearray(_MAX_RECORD_DATA)
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    previous = None
+    for data in commands:
+        text = data.decode('utf-8', errors='replace')
+        if text.startswith(START_MARKER) and text.rstrip().endswith(END_MARKER):
+            payload = text.strip()[1:-1]
+            if parser.framed:
+                # NAK e reenvios (v2) o main.py gera sozinho ao ler os mesmos quadros
+                payload = decode_frame(payload)[1]
+                if data == previous or payload.startswith(f"{CMD_NAK},"):
+                    continue
+            main.send_to_arduino(payload)
+        else:
+            replay.write(data) # Bytes crus (upload de template)
+        previous = data
+        # Lê tudo o que a sessão recebeu até o próximo comando (quadros e blocos binários)
+        while True:
+            if parser.raw_pending and not parser.framed:
+                main.read_arduino_raw_into(memoryview(scratch)[:parser.raw_pending], timeout_seconds=REPLAY_READ_TIMEOUT)
+            elif parser.frames or main._frame_sequencer.ready or not replay.waiting_for_host():
+                response = main.read_arduino_response(timeout_seconds=REPLAY_READ_TIMEOUT)
+                if RESP_SENSOR_READY in response and f",FRAMING:{FRAMING_VERSION}" in response:
+                    main._enable_framing()
+            else:
+                break
+    main._command_tracker.finish()
+    return time.perf_counter() - wall_start, time.process_time() - cpu_start, len(commands), replay.divergences
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('info', 'replay'):
+        print("Uso: python session_log.py info|replay ARQUIVO [velocidade]")
+        sys.exit(1)
+    sessions = read_sessions(sys.argv[2])
+    if sys.argv[1] == 'info':
+        for number, (started_at, records) in enumerate(sessions, 1):
+            tx = sum(len(d) for k, _, d in records if k == RECORD_TX)
+            rx = sum(len(d) for k, _, d in records if k == RECORD_RX)
+            duration = records[-1][1] if records else 0
+            print(f"Sessão {number}: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at))}, "
+                  f"{duration:.1f} s, {len(records)} registros, {tx} bytes enviados, {rx} bytes recebidos")
+    else:
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else None
+        for number, (_, records) in enumerate(sessions, 1):
+            with contextlib.redirect_stdout(io.StringIO()):
+                wall, cpu, commands, divergences = replay_session(records, speed)
+            print(f"Sessão {number}: {commands} comandos em {wall * 1000:.0f} ms (CPU {cpu * 1000:.0f} ms), "
+                  f"{divergences} bytes divergentes")
@@ -0,0 +1,152 @@
+import numpy as np
+
+from matcher import TEMPLATE_BITS, _WORDS, hamming_distances
+from protocol import TEMPLATE_SIZE
+
+# Índice de similaridade dos templates do TemplateStore, para achar cadastros duplicados
+# (a mesma digital em outro ID) antes do STORE_MODEL sem comparar o template com o banco todo.
+#
+# O score é o mesmo do matcher.py (1 - distância de Hamming / 4096 bits). O índice é um LSH
+# por amostragem de bits: cada uma das LSH_TABLES tabelas usa LSH_KEY_BITS posições de bit
+# sorteadas (semente fixa) como chave, e dois templates com score s caem na mesma chave de uma
+# tabela com probabilidade s ** LSH_KEY_BITS. Só os templates que colidem com o probe em
+# alguma tabela são comparados de verdade (hamming_distances), então a busca custa
+# LSH_TABLES buscas binárias + as comparações dos candidatos (~120 com 100k templates), e não N.
+#
+# Com 20 tabelas de 14 bits: score 0.95 -> chance de não ser candidato ~1e-6; score 0.90
+# (DUPLICATE_MIN_SCORE) ~0.5%; templates sem relação (score ~0.5) quase nunca colidem.
+#
+# Limite: o score compara bytes crus, e duas capturas reais do mesmo dedo dão templates com
+# minúcias em outra ordem e posição, então o 0.9 não foi validado com templates reais (só com
+# o fake_arduino.py, que gera o mesmo template para o mesmo dedo). Por isso o resultado é só
+# uma lista de candidatos: o main.py confere cada um no sensor (UPLOAD_TPL_B2 + MATCH_B2)
+# antes de acusar o duplicado, e procura o modelo no flash com o SEARCH_B1.
+#
+# Cada tabela é um array de chaves ordenado (+ a ordem das linhas) consultado com searchsorted.
+# add() logo depois de store.put() põe o template numa cauda pequena, comparada inteira
+# a cada busca, que é ordenada junto com o resto quando passa de TAIL_MAX_ROWS linhas.
+# Se o banco mudou por outro caminho (store.version), a próxima busca reconstrói tudo.
+
+LSH_TABLES = 20
+LSH_KEY_BITS = 14
+DUPLICATE_MIN_SCORE = 0.9
+TAIL_MAX_ROWS = 256
+_BUILD_BATCH = 4096 # Linhas por vez ao calcular as chaves (unpackbits de 4096 bits por linha)
+
+
+class SimilarityIndex:
+
+    def __init__(self, store, tables=LSH_TABLES, key_bits=LSH_KEY_BITS, seed=0):
+        self.store = store
+        rng = np.random.default_rng(seed)
+        self._positions = np.stack([rng.choice(TEMPLATE_BITS, key_bits, replace=False) for _ in range(tables)])
+        self._weights = 1 << np.arange(key_bits, dtype=np.int64)
+        self._version = None
+        self._rows = {} # ID -> linha
+        self._ids = np.empty(0, dtype=np.int64) # -1 = linha apagada/regravada
+        self._words = np.empty((0, _WORDS), dtype=np.uint64)
+        self._keys = np.empty((0, tables), dtype=np.int64)
+        self._count = 0 # Linhas em uso (as arrays crescem em dobro)
+        self._sorted_rows = 0 # Linhas [0, _sorted_rows) estão nas tabelas ordenadas; o resto é a cauda
+        self._sorted_keys = []
+        self._order = []
+        self.last_candidates = 0 # Templates comparados na última busca
+
+    def _keys_of(self, data):
+        # data: (n, 512) uint8 -> (n, tables) chaves
+        keys = np.empty((len(data), len(self._positions)), dtype=np.int64)
+        for start in range(0, len(data), _BUILD_BATCH):
+            bits = np.unpackbits(data[start:start + _BUILD_BATCH], axis=1)
+            keys[start:start + _BUILD_BATCH] = bits[:, self._positions] @ self._weights
+        return keys
+
+    def refresh(self):
+        # Reconstrói o índice só se o banco mudou por fora do add()/remove()
+        if self._version == self.store.version:
+            return
+        version = self.store.version
+        ids, data = self.store.packed()
+        data = np.frombuffer(data, dtype=np.uint8).reshape(len(ids), TEMPLATE_SIZE)
+        self._ids = np.array(ids, dtype=np.int64)
+        self._words = data.view(np.uint64).copy()
+        self._keys = self._keys_of(data)
+        self._rows = {template_id: row for row, template_id in enumerate(ids)}
+        self._count = len(ids)
+        self._sort()
+        self._version = version
+
+    def _sort(self):
+        # Junta a cauda às tabelas ordenadas (e descarta as linhas apagadas)
+        live = np.flatnonzero(self._ids[:self._count] >= 0)
+        if len(live) < self._count:
+            self._ids = self._ids[live]
+            self._words = self._words[live]
+            self._keys = self._keys[live]
+            self._rows = {int(template_id): row for row, template_id in enumerate(self._ids)}
+            self._count = len(live)
+        keys = self._keys[:self._count]
+        self._order = [np.argsort(keys[:, table], kind='stable') for table in range(keys.shape[1])]
+        self._sorted_keys = [keys[order, table] for table, order in enumerate(self._order)]
+        self._sorted_rows = self._count
+
+    def __len__(self):
+        self.refresh()
+        return len(self._rows)
+
+    def add(self, template_id, template):
+        # Chamar logo depois de store.put(template_id, template). Se o índice ainda não foi
+        # montado ou o banco mudou por outro caminho no meio, só deixa para o refresh().
+        if self._version is None or self.store.version != self._version + 1:
+            return
+        probe_words = self._probe_words(template)
+        self._drop_row(template_id)
+        if self._count == len(self._ids):
+            size = max(2 * self._count, 16)
+            self._ids = np.resize(self._ids, size)
+            self._words = np.resize(self._words, (size, _WORDS))
+            self._keys = np.resize(self._keys, (size, self._keys.shape[1]))
+        row = self._count
+        self._ids[row] = template_id
+        self._words[row] = probe_words
+        self._keys[row] = self._keys_of(probe_words.view(np.uint8)[None])[0]
+        self._rows[template_id] = row
+        self._count += 1
+        if self._count - self._sorted_rows > TAIL_MAX_ROWS:
+            self._sort()
+        self._version = self.store.version
+
+    def remove(self, template_id):
+        # Chamar logo depois de store.delete(template_id)
+        if self._version is None or self.store.version != self._version + 1:
+            return
+        self._drop_row(template_id)
+        self._version = self.store.version
+
+    def _drop_row(self, template_id):
+        row = self._rows.pop(template_id, None)
+        if row is not None:
+            self._ids[row] = -1
+
+    def find_duplicates(self, template, min_score=DUPLICATE_MIN_SCORE):
+        # Lista de (ID, score) dos templates com score >= min_score, do melhor para o pior
+        self.refresh()
+        probe_words = self._probe_words(template)
+        probe_keys = self._keys_of(probe_words.view(np.uint8)[None])[0]
+        candidates = [np.arange(self._sorted_rows, self._count)]
+        for key, sorted_keys, order in zip(probe_keys, self._sorted_keys, self._order):
+            first = np.searchsorted(sorted_keys, key, side='left')
+            last = np.searchsorted(sorted_keys, key, side='right')
+            candidates.append(order[first:last])
+        rows = np.unique(np.concatenate(candidates))
+        rows = rows[self._ids[rows] >= 0]
+        self.last_candidates = len(rows)
+        distances = hamming_distances(self._words[rows], probe_words)
+        max_distance = int((1.0 - min_score) * TEMPLATE_BITS)
+        close = np.flatnonzero(distances <= max_distance)
+        close = close[np.argsort(distances[close], kind='stable')]
+        return [(int(self._ids[rows[i]]), 1.0 - int(distances[i]) / TEMPLATE_BITS) for i in close]
+
+    def _probe_words(self, template):
+        if len(template) != TEMPLATE_SIZE:
+            raise ValueError(f"Template deve ter {TEMPLATE_SIZE} bytes (recebido {len(template)})")
+        return np.frombuffer(bytes(template), dtype=np.uint64)
@@ -0,0 +1,133 @@
+import time
+
+from protocol import INDEX_PAGE_SLOTS, RESP_COUNT_RESULT, RESP_ID_FOUND, RESP_OK
+
+# Mapa local dos IDs ocupados no flash do sensor (1 bit por ID), mantido pelo main.py
+# (o AsyncFingerprintClient.occupied_slots também devolve um, para as transferências em lote).
+#
+# Começa sem sincronizar; load_page() com cada página do <INDEX,PAGINA> (ReadIndexTable do
+# sensor) e mark_synced() o reconciliam. Depois disso cada resposta lida da serial passa por
+# observe(): OK:STORED:ID e OK:DELETED:ID ligam/desligam o bit, então COUNT, o próximo ID
+# livre e a validação do ID do cadastro são respondidos aqui, sem ir ao Arduino.
+#
+# O mapa deixa de valer (fresh() False, o main.py reconcilia de novo) depois de max_age
+# segundos ou quando a serial o contradiz: ID_FOUND de um ID que ele acha livre, ou um
+# COUNT_RESULT diferente da contagem dele (outro programa mexeu no sensor).
+
+_STORED_PREFIX = f"{RESP_OK}:STORED:"
+_DELETED_PREFIX = f"{RESP_OK}:DELETED:"
+_ID_FOUND_PREFIX = f"{RESP_ID_FOUND}:"
+_COUNT_PREFIX = f"{RESP_COUNT_RESULT}:"
+_PAGE_BYTES = INDEX_PAGE_SLOTS // 8
+
+
+def _leading_int(text):
+    # "12,CONFIDENCE:150" -> 12; None se não começar com um número
+    digits = text.split(',', 1)[0]
+    return int(digits) if digits.isdigit() else None
+
+
+class SlotMap:
+
+    def __init__(self, capacity, max_age=300.0):
+        self.capacity = capacity # IDs válidos: 1..capacity
+        self.max_age = max_age
+        self.pages = capacity // INDEX_PAGE_SLOTS + 1
+        self._bits = bytearray(self.pages * _PAGE_BYTES)
+        self.count = 0
+        self.synced_at = None # time.time() da última reconciliação completa
+
+    def fresh(self):
+        return self.synced_at is not None and time.time() - self.synced_at < self.max_age
+
+    def invalidate(self):
+        self.synced_at = None
+
+    def in_range(self, slot):
+        return 0 < slot <= self.capacity
+
+    def is_occupied(self, slot):
+        return 0 <= slot <= self.capacity and bool(self._bits[slot >> 3] & (1 << (slot & 7)))
+
+    def occupied(self):
+        # IDs ocupados, em ordem
+        return [slot for slot in range(1, self.capacity + 1) if self._bits[slot >> 3] & (1 << (slot & 7))]
+
+    def first_free(self, start=1):
+        # Menor ID livre >= start (pula bytes cheios de uma vez); None com o sensor cheio
+        slot = max(start, 1)
+        while slot <= self.capacity:
+            if slot & 7 == 0 and self._bits[slot >> 3] == 0xFF:
+                slot += 8
+                continue
+            if not self._bits[slot >> 3] & (1 << (slot & 7)):
+                return slot
+            slot += 1
+        return None
+
+    def set(self, slot, occupied):
+        # Retorna True se o bit mudou
+        if not 0 <= slot <= self.capacity:
+            return False
+        mask = 1 << (slot & 7)
+        if bool(self._bits[slot >> 3] & mask) == occupied:
+            return False
+        self._bits[slot >> 3] ^= mask
+        self.count += 1 if occupied else -1
+        return True
+
+    def load_page(self, page, table):
+        # Tabela de 32 bytes do <INDEX,page> (bit i do byte j = ID page*256 + j*8 + i)
+        if not 0 <= page < self.pages or len(table) != _PAGE_BYTES:
+            raise ValueError(f"página {page} com {len(table)} bytes")
+        self._bits[page * _PAGE_BYTES:(page + 1) * _PAGE_BYTES] = table
+        # Bits acima da capacidade não são IDs (o sensor não devia marcá-los)
+        last = self.capacity + 1
+        if last < len(self._bits) * 8:
+            self._bits[last >> 3] &= (1 << (last & 7)) - 1
+            self._bits[(last >> 3) + 1:] = bytes(len(self._bits) - (last >> 3) - 1)
+        self.count = sum(bin(byte).count('1') for byte in self._bits)
+
+    def mark_synced(self):
+        self.synced_at = time.time()
+
+    def observe(self, response):
+        # Atualiza o mapa com uma resposta do Arduino. Retorna True se ele mudou (vale gravar).
+        if response.startswith(_STORED_PREFIX):
+            slot = _leading_int(response[len(_STORED_PREFIX):])
+            return slot is not None and self.set(slot, True)
+        if response.startswith(_DELETED_PREFIX):
+            slot = _leading_int(response[len(_DELETED_PREFIX):])
+            return slot is not None and self.set(slot, False)
+        if response.startswith(_ID_FOUND_PREFIX):
+            slot = _leading_int(response[len(_ID_FOUND_PREFIX):])
+            if slot is not None and not self.is_occupied(slot):
+                self.set(slot, True)
+                self.invalidate()
+                return True
+        elif response.startswith(_COUNT_PREFIX):
+            count = _leading_int(response[len(_COUNT_PREFIX):])
+            if count is not None and count != self.count and self.synced_at is not None:
+                self.invalidate()
+                return True
+        return False
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'bits': self._bits.hex(), 'synced_at': self.synced_at}
+
+    @classmethod
+    def from_dict(cls, data, capacity, max_age=300.0):
+        # Mapa gravado (session cache); um vazio se for de outra capacidade ou estiver ilegível
+        slot_map = cls(capacity, max_age)
+        if not data or data.get('capacity') != capacity:
+            return slot_map
+        try:
+            bits = bytes.fromhex(data['bits'])
+        except (KeyError, TypeError, ValueError):
+            return slot_map
+        if len(bits) != len(slot_map._bits):
+            return slot_map
+        slot_map._bits[:] = bits
+        slot_map.count = sum(bin(byte).count('1') for byte in bits)
+        slot_map.synced_at = data.get('synced_at')
+        return slot_map
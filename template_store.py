@@ -0,0 +1,360 @@
+import json
+import mmap
+import os
+import threading
+import time
+from array import array
+
+from protocol import TEMPLATE_SIZE
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# Banco de templates no PC (além dos slots 1-127 do flash do sensor).
+#
+#   templates.dat         registros fixos de TEMPLATE_SIZE bytes, acessados via mmap
+#   templates.idx         log append-only de pares int32 (ID, slot); slot -1 = apagado (tombstone)
+#   templates.meta.jsonl  metadados (uma linha JSON por gravação), carregados só quando pedidos
+#
+# Abrir o banco lê apenas o índice (8 bytes por gravação); o arquivo de dados é mapeado
+# e nunca lido inteiro. Gravar um template escreve no próximo slot livre e acrescenta uma
+# entrada no índice, sem reescrever nada. Regravar um ID ou apagar deixa o slot antigo
+# como lixo, que a compactação (em segundo plano) remove.
+#
+# A compactação grava os três arquivos de uma geração nova (templates.N.dat, templates.N.idx,
+# templates.N.meta.jsonl; a geração 0 usa os nomes acima), com fsync, e só então troca o
+# número em templates.gen: essa troca é o único ponto de commit. Uma queda antes dela deixa
+# o banco na geração antiga; depois dela, na nova. Arquivos de outras gerações que sobrarem
+# são apagados na abertura.
+#
+# Um processo por vez: o índice e o próximo slot livre ficam em memória, então dois processos
+# (main.py e bulk_transfer.py no mesmo diretório) gravariam no mesmo slot. A abertura pega um
+# lock exclusivo em templates.lock (flock; no Windows msvcrt.locking) até o close(), e
+# recusa com StoreLockedError se outro processo já está com o banco aberto.
+
+DATA_FILE = 'templates.dat'
+INDEX_FILE = 'templates.idx'
+META_FILE = 'templates.meta.jsonl'
+GENERATION_FILE = 'templates.gen'
+LOCK_FILE = 'templates.lock'
+TOMBSTONE = -1
+GROW_RECORDS = 1024       # O arquivo de dados cresce de 1024 em 1024 registros (no mínimo)
+COMPACT_MIN_GARBAGE = 1024 # Compacta sozinho quando há pelo menos isso de slots mortos...
+COMPACT_GARBAGE_RATIO = 0.5 # ...e eles são mais da metade dos slots usados
+_INDEX_ENTRY_SIZE = 8
+
+
+class StoreLockedError(RuntimeError):
+    # Outro processo está com o banco aberto
+    pass
+
+
+class TemplateStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._compact_thread = None
+        self._metadata = None
+        self.version = 0 # Incrementado a cada alteração (para caches como o do matcher)
+        self._lock_file = _lock_directory(directory) # Antes de tudo: a abertura apaga arquivos
+        self._generation = self._load_generation()
+        self._remove_other_generations()
+        self._load_index()
+        self._open_data()
+        self._index_file = open(self._path(INDEX_FILE), 'ab')
+        self._meta_file = open(self._path(META_FILE), 'a', encoding='utf-8')
+
+    def _path(self, name, generation=None):
+        # Arquivo da geração atual (ou da indicada); GENERATION_FILE não tem geração
+        generation = self._generation if generation is None else generation
+        if generation and name != GENERATION_FILE:
+            name = name.replace('templates.', f'templates.{generation}.', 1)
+        return os.path.join(self.directory, name)
+
+    def _load_generation(self):
+        try:
+            with open(os.path.join(self.directory, GENERATION_FILE), encoding='utf-8') as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0 # Banco sem compactação ainda (ou de antes das gerações)
+
+    def _remove_other_generations(self):
+        # Sobras de uma compactação interrompida, antes ou depois do commit
+        keep = {os.path.basename(self._path(name)) for name in (DATA_FILE, INDEX_FILE, META_FILE, GENERATION_FILE)}
+        keep.add(LOCK_FILE)
+        for name in os.listdir(self.directory):
+            if name.startswith('templates.') and name not in keep:
+                os.remove(os.path.join(self.directory, name))
+
+    def _load_index(self):
+        path = self._path(INDEX_FILE)
+        entries = array('i')
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                data = f.read()
+                usable = len(data) - len(data) % _INDEX_ENTRY_SIZE
+                if usable != len(data):
+                    # Entrada parcial (queda no meio de uma gravação): descarta para manter o alinhamento
+                    f.truncate(usable)
+                entries.frombytes(data[:usable])
+        ids, slots = entries[0::2], entries[1::2]
+        self._slots = dict(zip(ids, slots)) # A última entrada de cada ID vale
+        for template_id in [t for t, slot in self._slots.items() if slot == TOMBSTONE]:
+            del self._slots[template_id]
+        self._next_slot = max(slots) + 1 if slots else 0
+        self._index_entries = len(slots)
+
+    def _open_data(self):
+        path = self._path(DATA_FILE)
+        self._data_file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        size = os.fstat(self._data_file.fileno()).st_size
+        self._capacity = max(size // TEMPLATE_SIZE, self._next_slot, GROW_RECORDS)
+        if size < self._capacity * TEMPLATE_SIZE:
+            self._data_file.truncate(self._capacity * TEMPLATE_SIZE)
+        self._mm = mmap.mmap(self._data_file.fileno(), self._capacity * TEMPLATE_SIZE)
+
+    def _grow(self, min_records):
+        # No Windows o arquivo não pode mudar de tamanho enquanto está mapeado
+        self._mm.close()
+        self._capacity = max(self._capacity * 2, min_records)
+        self._data_file.truncate(self._capacity * TEMPLATE_SIZE)
+        self._mm = mmap.mmap(self._data_file.fileno(), self._capacity * TEMPLATE_SIZE)
+
+    def _append_index(self, template_id, slot):
+        self._index_file.write(array('i', (template_id, slot)).tobytes())
+        self._index_file.flush()
+        self._index_entries += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._slots)
+
+    def __contains__(self, template_id):
+        return template_id in self._slots
+
+    def ids(self):
+        with self._lock:
+            return list(self._slots)
+
+    def get(self, template_id):
+        # Retorna os bytes do template (cópia) ou None
+        with self._lock:
+            slot = self._slots.get(template_id)
+            if slot is None:
+                return None
+            offset = slot * TEMPLATE_SIZE
+            return self._mm[offset:offset + TEMPLATE_SIZE]
+
+    def put(self, template_id, template, **metadata):
+        if len(template) != TEMPLATE_SIZE:
+            raise ValueError(f"Template deve ter {TEMPLATE_SIZE} bytes (recebido {len(template)})")
+        with self._lock:
+            slot = self._next_slot
+            if slot >= self._capacity:
+                self._grow(slot + 1)
+            offset = slot * TEMPLATE_SIZE
+            self._mm[offset:offset + TEMPLATE_SIZE] = template
+            # Dados no disco antes da entrada do índice que aponta para eles; só as páginas do
+            # registro (o msync do mapa inteiro varre todas as páginas a cada gravação)
+            start = offset - offset % mmap.PAGESIZE
+            self._mm.flush(start, offset + TEMPLATE_SIZE - start)
+            self._append_index(template_id, slot)
+            self._slots[template_id] = slot
+            self._next_slot += 1
+            record = {'id': template_id, 'stored_at': time.time(), **metadata}
+            self._meta_file.write(json.dumps(record) + '\n')
+            self._meta_file.flush()
+            if self._metadata is not None:
+                self._metadata[template_id] = record
+            self.version += 1
+        self._maybe_compact()
+        return slot
+
+    def delete(self, template_id):
+        with self._lock:
+            if template_id not in self._slots:
+                return False
+            self._append_index(template_id, TOMBSTONE)
+            del self._slots[template_id]
+            if self._metadata is not None:
+                self._metadata.pop(template_id, None)
+            self.version += 1
+        self._maybe_compact()
+        return True
+
+    def metadata(self, template_id):
+        with self._lock:
+            if self._metadata is None:
+                self._metadata = self._load_metadata()
+            return self._metadata.get(template_id)
+
+    def _load_metadata(self):
+        self._meta_file.flush()
+        metadata = {}
+        with open(self._path(META_FILE), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # Linha parcial no fim do arquivo
+                metadata[record['id']] = record
+        return {template_id: record for template_id, record in metadata.items() if template_id in self._slots}
+
+    def live_slots(self):
+        # Pares (ID, slot) dos templates válidos, em ordem de slot
+        with self._lock:
+            return sorted(self._slots.items(), key=lambda item: item[1])
+
+    def packed(self):
+        # (IDs, bytes) com todos os templates válidos em sequência, em ordem de slot.
+        # Usado para montar a matriz (N, TEMPLATE_SIZE) do matcher.
+        with self._lock:
+            pairs = self.live_slots()
+            mm = self._mm
+            data = b''.join([mm[slot * TEMPLATE_SIZE:(slot + 1) * TEMPLATE_SIZE] for _, slot in pairs])
+            return [template_id for template_id, _ in pairs], data
+
+    def garbage(self):
+        # Slots ocupados por templates apagados ou regravados
+        with self._lock:
+            return self._next_slot - len(self._slots)
+
+    def _maybe_compact(self):
+        garbage = self.garbage()
+        if garbage >= COMPACT_MIN_GARBAGE and garbage > self._next_slot * COMPACT_GARBAGE_RATIO:
+            self.compact(background=True)
+
+    def compact(self, background=True):
+        # Reescreve só os templates válidos num arquivo novo e troca os arquivos.
+        # A cópia é feita sem segurar o lock; o que mudar durante a cópia é aplicado no fim.
+        if self._compact_thread and self._compact_thread.is_alive():
+            return self._compact_thread
+        if not background:
+            self._compact()
+            return None
+        self._compact_thread = threading.Thread(target=self._compact, name='template-store-compact', daemon=True)
+        self._compact_thread.start()
+        return self._compact_thread
+
+    def _compact(self):
+        with self._lock:
+            snapshot = self.live_slots()
+            log_position = self._index_entries
+            generation = self._generation + 1
+
+        data_tmp = self._path(DATA_FILE, generation)
+        new_slots = {}
+        with open(data_tmp, 'wb') as out:
+            for template_id, slot in snapshot:
+                record = self._read_slot(slot)
+                new_slots[template_id] = len(new_slots)
+                out.write(record)
+
+            with self._lock:
+                # Aplica as gravações/remoções feitas durante a cópia, na ordem do log
+                for template_id, slot in self._index_entries_since(log_position):
+                    new_slots.pop(template_id, None)
+                    if slot != TOMBSTONE:
+                        new_slots[template_id] = out.tell() // TEMPLATE_SIZE
+                        out.write(self._read_slot(slot))
+                out.flush()
+                os.fsync(out.fileno())
+                self._swap_compacted(generation, new_slots)
+
+    def _read_slot(self, slot):
+        with self._lock:
+            offset = slot * TEMPLATE_SIZE
+            return self._mm[offset:offset + TEMPLATE_SIZE]
+
+    def _index_entries_since(self, log_position):
+        self._index_file.flush()
+        entries = array('i')
+        with open(self._path(INDEX_FILE), 'rb') as f:
+            f.seek(log_position * _INDEX_ENTRY_SIZE)
+            entries.frombytes(f.read())
+        return zip(entries[0::2], entries[1::2])
+
+    def _swap_compacted(self, generation, new_slots):
+        entries = array('i')
+        for template_id, slot in new_slots.items():
+            entries.extend((template_id, slot))
+        with open(self._path(INDEX_FILE, generation), 'wb') as f:
+            f.write(entries.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self._metadata is None:
+            self._metadata = self._load_metadata()
+        with open(self._path(META_FILE, generation), 'w', encoding='utf-8') as f:
+            for template_id in new_slots:
+                if template_id in self._metadata:
+                    f.write(json.dumps(self._metadata[template_id]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Commit: a partir daqui o banco é a geração nova
+        generation_tmp = self._path(GENERATION_FILE + '.tmp')
+        with open(generation_tmp, 'w', encoding='utf-8') as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(generation_tmp, self._path(GENERATION_FILE))
+        _fsync_directory(self.directory)
+
+        self._mm.close()
+        self._data_file.close()
+        self._index_file.close()
+        self._meta_file.close()
+        old_generation, self._generation = self._generation, generation
+        for name in (DATA_FILE, INDEX_FILE, META_FILE):
+            os.remove(self._path(name, old_generation))
+
+        self._slots = new_slots
+        self._next_slot = len(new_slots)
+        self._index_entries = len(new_slots)
+        self._open_data()
+        self._index_file = open(self._path(INDEX_FILE), 'ab')
+        self._meta_file = open(self._path(META_FILE), 'a', encoding='utf-8')
+        self.version += 1
+
+    def close(self):
+        if self._compact_thread:
+            self._compact_thread.join()
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._data_file.close()
+            self._index_file.close()
+            self._meta_file.close()
+            self._lock_file.close() # Solta o lock
+
+
+def _lock_directory(directory):
+    # Lock exclusivo sem espera no LOCK_FILE; o arquivo aberto segura o lock até ser fechado
+    lock_file = open(os.path.join(directory, LOCK_FILE), 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        raise StoreLockedError(f"Banco de templates em {directory} já está aberto por outro processo") from None
+    return lock_file
+
+
+def _fsync_directory(directory):
+    # Garante que o rename chegou ao disco (POSIX; no Windows não dá para abrir diretórios)
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
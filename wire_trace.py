@@ -0,0 +1,112 @@
+import time
+from collections import deque
+
+# Rastreamento do que passa pela serial, com memória fixa.
+#
+# Os bytes enviados e recebidos vão para um anel (bytearray de tamanho fixo) e cada
+# bloco/quadro vira um registro curto numa deque com maxlen. Nada cresce com o tempo
+# de execução: um dia inteiro de DBG: do Arduino ocupa o mesmo que um minuto.
+#
+# Níveis (podem ser trocados a qualquer momento em tracer.level):
+#   TRACE_OFF     nada é guardado; quem chama testa "if tracer.level" antes de qualquer trabalho
+#   TRACE_ERRORS  guarda no anel em silêncio e despeja os últimos bytes em timeout/erro de protocolo
+#   TRACE_FRAMES  também imprime cada comando e quadro (o que o main.py imprimia sempre)
+#   TRACE_BYTES   também imprime cada bloco cru recebido
+
+TRACE_OFF = 0
+TRACE_ERRORS = 1
+TRACE_FRAMES = 2
+TRACE_BYTES = 3
+
+DEFAULT_CAPACITY = 16 * 1024 # Bytes no anel (o dump mostra no máximo isso)
+MAX_RECORDS = 1024           # Blocos/quadros lembrados
+MAX_FRAME_TEXT = 96          # Quadros maiores (chunks HEX) são guardados truncados
+
+TX = '>'  # PC -> Arduino
+RX = '<'  # Arduino -> PC
+FRAME = '#' # Quadro completo reconhecido pelo FrameParser
+
+
+class WireTracer:
+
+    def __init__(self, name='serial', level=TRACE_ERRORS, capacity=DEFAULT_CAPACITY):
+        self.name = name
+        self.level = level
+        self._ring = bytearray(capacity)
+        self._written = 0 # Total de bytes já escritos no anel (posição = _written % capacidade)
+        self._records = deque(maxlen=MAX_RECORDS) # (instante, direção, posição inicial, tamanho ou texto)
+        self._start_time = time.monotonic()
+
+    def _store(self, data):
+        # Retorna (posição, tamanho) do que ficou no anel: de um bloco maior que ele, só o final
+        capacity = len(self._ring)
+        if len(data) > capacity:
+            # O começo conta como já sobrescrito
+            self._written += len(data) - capacity
+            data = data[-capacity:]
+        position = self._written
+        offset = position % capacity
+        first = min(len(data), capacity - offset)
+        self._ring[offset:offset + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+        self._written += len(data)
+        return position, len(data)
+
+    def tx(self, data):
+        if not self.level:
+            return
+        self._records.append((time.monotonic(), TX, *self._store(data)))
+        if self.level >= TRACE_FRAMES:
+            print(f"PYTHON -> ARDUINO: {bytes(data).decode('utf-8', errors='replace').strip()}")
+
+    def rx(self, data):
+        if not self.level:
+            return
+        self._records.append((time.monotonic(), RX, *self._store(data)))
+        if self.level >= TRACE_BYTES:
+            print(f"ARDUINO -> PYTHON (BYTES): {bytes(data)!r}")
+
+    def frame(self, frame):
+        if not self.level:
+            return
+        self._records.append((time.monotonic(), FRAME, self._written, frame[:MAX_FRAME_TEXT]))
+        if self.level >= TRACE_FRAMES:
+            print(f"ARDUINO -> PYTHON: <{frame}>")
+
+    def _bytes_at(self, position, length):
+        # Bytes [position, position + length) do fluxo, se ainda estiverem no anel
+        capacity = len(self._ring)
+        oldest = max(0, self._written - capacity)
+        if position + length <= oldest:
+            return None
+        if position < oldest:
+            length -= oldest - position
+            position = oldest
+        offset = position % capacity
+        first = min(length, capacity - offset)
+        return bytes(self._ring[offset:offset + first]) + bytes(self._ring[:length - first])
+
+    def dump(self, reason, max_bytes=None):
+        # Imprime os blocos e quadros que ainda estão no anel (os últimos max_bytes, se dado)
+        if not self.level:
+            return ""
+        oldest = max(0, self._written - (max_bytes or len(self._ring)))
+        lines = [f"--- Rastro da serial {self.name} ({reason}): últimos {self._written - oldest} bytes ---"]
+        for timestamp, direction, position, payload in self._records:
+            if direction == FRAME:
+                if position >= oldest:
+                    lines.append(f"{timestamp - self._start_time:10.3f} {FRAME} <{payload}>")
+                continue
+            if position + payload <= oldest:
+                continue
+            data = self._bytes_at(max(position, oldest), position + payload - max(position, oldest))
+            if data is not None:
+                lines.append(f"{timestamp - self._start_time:10.3f} {direction} {data!r}")
+        lines.append("--- Fim do rastro ---")
+        text = '\n'.join(lines)
+        print(text)
+        return text
+
+    def clear(self):
+        self._records.clear()
+        self._written = 0